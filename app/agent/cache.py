@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from app.config import settings
+from app.metrics import METRICS
+
+
+def normalise_tool_input(tool_input: str | dict[str, Any]) -> str:
+    """Canonical form of a tool input, so equivalent calls share a cache entry.
+
+    JSON objects are re-serialised with sorted keys and plain strings are
+    stripped, lower-cased and have their whitespace collapsed.
+    """
+    if isinstance(tool_input, str):
+        text = tool_input
+        try:
+            tool_input = json.loads(text)
+        except json.JSONDecodeError:
+            return " ".join(text.lower().split())
+
+    if isinstance(tool_input, dict):
+        return json.dumps(
+            {
+                key: value.strip() if isinstance(value, str) else value
+                for key, value in tool_input.items()
+            },
+            sort_keys=True,
+        )
+    return json.dumps(tool_input)
+
+
+def employee_id_of(tool_input: str | dict[str, Any]) -> str | None:
+    """Employee a tool input refers to: an `employee_id` key or a bare numeric ID."""
+    if isinstance(tool_input, str):
+        if tool_input.strip().isdigit():
+            return tool_input.strip()
+        try:
+            tool_input = json.loads(tool_input)
+        except json.JSONDecodeError:
+            return None
+
+    if isinstance(tool_input, dict) and tool_input.get("employee_id") is not None:
+        return str(tool_input["employee_id"]).strip()
+    return None
+
+
+@dataclass
+class _Entry:
+    output: str
+    employee_id: str | None
+    expires_at: float
+
+
+class ToolCache:
+    """Per-session memo of the outputs of side-effect-free tools.
+
+    Entries are keyed by tool name and normalised input, expire after a TTL
+    and are evicted least-recently-used first beyond `max_entries`. The
+    `generation` changes on every invalidation, so an output computed before
+    one is not stored after it, see `put`.
+    """
+
+    def __init__(
+        self,
+        ttl: float = settings.TOOL_CACHE_TTL,
+        max_entries: int = settings.TOOL_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, tool_name: str, tool_input: str | dict[str, Any]) -> str | None:
+        key = (tool_name, normalise_tool_input(tool_input))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                self._entries.pop(key, None)
+                METRICS.increment("tool_cache.misses")
+                return None
+            self._entries.move_to_end(key)
+            METRICS.increment("tool_cache.hits")
+            return entry.output
+
+    def put(
+        self,
+        tool_name: str,
+        tool_input: str | dict[str, Any],
+        output: str,
+        generation: int | None = None,
+    ) -> None:
+        """
+        Stores the output of a tool
+
+        Args:
+            tool_name (str)
+            tool_input (str | dict[str, Any])
+            output (str)
+            generation (int | None, optional): `generation` when the tool started, the output is dropped if the cache was invalidated since. Defaults to None.
+        """
+        key = (tool_name, normalise_tool_input(tool_input))
+        entry = _Entry(
+            output=output,
+            employee_id=employee_id_of(tool_input),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                METRICS.increment("tool_cache.stale_puts")
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(
+        self, tool_names: list[str], tool_input: str | dict[str, Any] | None = None
+    ) -> None:
+        """
+        Drops the entries of the given tools. If the write input refers to an
+        employee, only that employee's entries (and entries not tied to any
+        employee) are dropped.
+
+        Args:
+            tool_names (list[str]): tools whose outputs depend on the write
+            tool_input (str | dict[str, Any] | None, optional): input of the write tool. Defaults to None.
+        """
+        employee_id = employee_id_of(tool_input) if tool_input is not None else None
+        with self._lock:
+            self.generation += 1
+            for key in list(self._entries):
+                entry = self._entries[key]
+                if key[0] not in tool_names:
+                    continue
+                if employee_id is None or entry.employee_id in (None, employee_id):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
@@ -0,0 +1,132 @@
+import re
+from typing import Any, Callable
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish
+from langchain.schema.messages import BaseMessage
+
+from app.agent.constants import RESPOND_TOOL_NAME
+from app.ratelimit import RATE_LIMITER
+from app.utils import count_tokens
+
+
+class OpenAIRateLimitHandler(BaseCallbackHandler):
+    """Holds each chat model call until the "openai" bucket has capacity for
+    its prompt tokens. Raising from the handler aborts the call."""
+
+    raise_error: bool = True
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        **kwargs: Any,
+    ) -> None:
+        text = "\n".join(str(m.content) for prompt in messages for m in prompt)
+        RATE_LIMITER.acquire("openai", count_tokens(text))
+
+    def on_llm_start(
+        self, serialized: dict[str, Any], prompts: list[str], **kwargs: Any
+    ) -> None:
+        RATE_LIMITER.acquire("openai", count_tokens("\n".join(prompts)))
+
+
+OPENAI_RATE_LIMIT_HANDLER = OpenAIRateLimitHandler()
+
+
+# Opening of the respond action and of its input in the JSON blob of the agent
+RESPOND_ACTION_PATTERN = re.compile(r'"tool"\s*:\s*"' + RESPOND_TOOL_NAME + '"')
+TOOL_INPUT_PATTERN = re.compile(r'"tool_input"\s*:\s*"')
+JSON_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+
+class RespondStream:
+    """Extracts the answer of a respond action from the streamed LLM output.
+
+    The agent answers with a JSON blob, so the raw tokens are not shown. The
+    text of the "tool_input" string is decoded as it arrives, once the
+    action is known to be the respond tool.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.position: int | None = None
+        self.done = False
+
+    def feed(self, token: str) -> str:
+        """Adds a token of the LLM output, returns the new text of the answer."""
+        self.buffer += token
+        if self.done:
+            return ""
+        if self.position is None:
+            action = RESPOND_ACTION_PATTERN.search(self.buffer)
+            if not action:
+                return ""
+            start = TOOL_INPUT_PATTERN.search(self.buffer, action.end())
+            if not start:
+                return ""
+            self.position = start.end()
+
+        text: list[str] = []
+        i = self.position
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '"':
+                self.done = True
+                break
+            if char != "\\":
+                text.append(char)
+                i += 1
+                continue
+            # Incomplete escapes wait for the next token
+            if i + 1 >= len(self.buffer):
+                break
+            escaped = self.buffer[i + 1]
+            if escaped == "u":
+                if i + 6 > len(self.buffer):
+                    break
+                text.append(chr(int(self.buffer[i + 2 : i + 6], 16)))
+                i += 6
+            else:
+                text.append(JSON_ESCAPES.get(escaped, escaped))
+                i += 2
+        self.position = i
+        return "".join(text)
+
+
+class TurnCallbackHandler(BaseCallbackHandler):
+    """Collects the log of an agent turn and reports its progress as events:
+    {"type": "token", "text": ...} for the streamed answer and {"type": "step",
+    "tool": ...} for each tool the agent calls."""
+
+    def __init__(self, on_event: Callable[[dict[str, Any]], None] | None = None):
+        self.on_event = on_event
+        self.logs: list[str] = []
+        self._stream = RespondStream()
+
+    def _emit(self, event: dict[str, Any]) -> None:
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        **kwargs: Any,
+    ) -> None:
+        self._stream = RespondStream()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if text := self._stream.feed(token):
+            self._emit({"type": "token", "text": text})
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        self.logs.extend(line for line in action.log.splitlines() if line.strip())
+        if action.tool != RESPOND_TOOL_NAME:
+            self._emit({"type": "step", "tool": action.tool})
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        self.logs.append(f"Observation: {str(output).strip()}")
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
+        self.logs.extend(line for line in finish.log.splitlines() if line.strip())
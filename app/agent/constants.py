@@ -0,0 +1,2 @@
+# Name of the tool the agent uses to answer the user, which ends its turn
+RESPOND_TOOL_NAME = "respond_tool"
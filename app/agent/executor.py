@@ -1,16 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Optional
 
 from langchain.agents import AgentExecutor
-from langchain.agents.format_scratchpad import format_log_to_messages
+from langchain.agents.agent import ExceptionTool
+from langchain.agents.tools import InvalidTool
+from langchain.callbacks.manager import CallbackManagerForChainRun
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import load_prompt
+from langchain.schema import AgentAction, AgentFinish, OutputParserException
+from langchain.schema.messages import AIMessage, BaseMessage, HumanMessage
 from langchain.tools import BaseTool
 
+from app.agent.cache import ToolCache
+from app.agent.callbacks import OPENAI_RATE_LIMIT_HANDLER
+from app.agent.history import ChatHistoryRenderer
 from app.agent.output_parser import CustomJSONOutputParser
-from app.agent.tools import get_all_tools
+from app.agent.tool_selection import (
+    ToolSelector,
+    render_tool_names,
+    render_tool_strings,
+)
 from app.config import settings
+from app.utils import submit_in_context
+
+INIT_MESSAGE = "Hi, I am Maria, your personal HR assistant. To get started, can you please tell me your name and email address? Thanks!"
 
 TEMPLATE_TOOL_RESPONSE = """TOOL RESPONSE:
 ---------------------
@@ -19,49 +34,285 @@ TEMPLATE_TOOL_RESPONSE = """TOOL RESPONSE:
 USER'S INPUT
 --------------------
 
-Okay, so what is the response to my last comment? If using information obtained from the tools you must mention it explicitly without mentioning the tool names - I have forgotten all TOOL RESPONSES! Remember to respond with a markdown code snippet of a json blob with a single action, and NOTHING else - even if you just want to respond to the user. Do NOT respond with anything except a JSON snippet no matter what!"""
+Okay, so what is the response to my last comment? If using information obtained from the tools you must mention it explicitly without mentioning the tool names - I have forgotten all TOOL RESPONSES! Remember to respond with a markdown code snippet of a json blob with a single action (or a list of independent actions), and NOTHING else - even if you just want to respond to the user. Do NOT respond with anything except a JSON snippet no matter what!"""
+
+
+def format_steps_to_messages(
+    intermediate_steps: list[tuple[AgentAction, str]],
+    template_tool_response: str = "{observation}",
+) -> list[BaseMessage]:
+    """Construct the agent scratchpad. Actions emitted together in one LLM
+    output share its log, so they are rendered as a single AI message followed
+    by a single tool response with all their observations.
+
+    Args:
+        intermediate_steps (list[tuple[AgentAction, str]]): actions taken so far and their observations
+        template_tool_response (str, optional): template for the tool responses. Defaults to "{observation}".
+
+    Returns:
+        list[BaseMessage]: scratchpad messages
+    """
+    batches: list[tuple[str, list[tuple[AgentAction, str]]]] = []
+    for action, observation in intermediate_steps:
+        if batches and batches[-1][0] == action.log:
+            batches[-1][1].append((action, observation))
+        else:
+            batches.append((action.log, [(action, observation)]))
+
+    thoughts: list[BaseMessage] = []
+    for log, steps in batches:
+        if len(steps) == 1:
+            observation = steps[0][1]
+        else:
+            observation = "\n".join(
+                f"{action.tool} ({action.tool_input}): {observation}"
+                for action, observation in steps
+            )
+        thoughts.append(AIMessage(content=log))
+        thoughts.append(
+            HumanMessage(content=template_tool_response.format(observation=observation))
+        )
+    return thoughts
+
+
+class ConcurrentAgentExecutor(AgentExecutor):
+    """Agent executor that runs the actions emitted in a single LLM step concurrently."""
+
+    max_workers: int = 4
+    """Maximum number of tools running at the same time."""
+    tool_thread_setup: Optional[Callable[[], None]] = None
+    """Called in each worker thread before running a tool, e.g. to attach a UI context."""
+    tool_cache: Optional[ToolCache] = None
+    """Session memo for tools declaring `side_effect_free`. Tools declaring
+    `invalidates` drop the memoised outputs of those tools when they run, only
+    those of the employee of their input unless `invalidates_by_employee` is False."""
+
+    def _run_action(
+        self,
+        agent_action: AgentAction,
+        name_to_tool_map: dict[str, BaseTool],
+        color_mapping: dict[str, str],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> str:
+        if self.tool_thread_setup:
+            self.tool_thread_setup()
+
+        tool_run_kwargs = self.agent.tool_run_logging_kwargs()
+        if agent_action.tool not in name_to_tool_map:
+            return InvalidTool().run(
+                {
+                    "requested_tool_name": agent_action.tool,
+                    "available_tool_names": list(name_to_tool_map.keys()),
+                },
+                verbose=self.verbose,
+                color=None,
+                callbacks=run_manager.get_child() if run_manager else None,
+                **tool_run_kwargs,
+            )
+
+        tool = name_to_tool_map[agent_action.tool]
+        side_effect_free = getattr(tool, "side_effect_free", False)
+        if self.tool_cache is not None and side_effect_free:
+            cached = self.tool_cache.get(tool.name, agent_action.tool_input)
+            if cached is not None:
+                if run_manager:
+                    # Reported as a tool run, so the turn logs and traces show it
+                    tool_run_manager = run_manager.get_child().on_tool_start(
+                        {"name": tool.name, "description": tool.description},
+                        agent_action.tool_input,
+                        color=color_mapping[agent_action.tool],
+                        name=tool.name,
+                    )
+                    tool_run_manager.on_tool_end(
+                        cached,
+                        color=color_mapping[agent_action.tool],
+                        name=tool.name,
+                        **tool_run_kwargs,
+                    )
+                return cached
+
+        if tool.return_direct:
+            tool_run_kwargs["llm_prefix"] = ""
+        # A write running alongside may invalidate the cache while the tool runs
+        generation = self.tool_cache.generation if self.tool_cache is not None else None
+        observation = tool.run(
+            agent_action.tool_input,
+            verbose=self.verbose,
+            color=color_mapping[agent_action.tool],
+            callbacks=run_manager.get_child() if run_manager else None,
+            **tool_run_kwargs,
+        )
 
+        if self.tool_cache is not None:
+            if side_effect_free:
+                self.tool_cache.put(
+                    tool.name, agent_action.tool_input, observation, generation
+                )
+            if invalidates := getattr(tool, "invalidates", None):
+                # Inputs that do not name the employee written to drop every entry
+                scoped = getattr(tool, "invalidates_by_employee", True)
+                self.tool_cache.invalidate(
+                    invalidates, agent_action.tool_input if scoped else None
+                )
+        return observation
 
-def init_agent_executor(tools: list[BaseTool], verbose: bool = False) -> AgentExecutor:
+    def _handle_parsing_error(
+        self,
+        e: OutputParserException,
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> list[tuple[AgentAction, str]]:
+        # Same handling as AgentExecutor._take_next_step
+        if self.handle_parsing_errors is False:
+            raise ValueError(
+                "An output parsing error occurred. "
+                "In order to pass this error back to the agent and have it try "
+                "again, pass `handle_parsing_errors=True` to the AgentExecutor. "
+                f"This is the error: {str(e)}"
+            )
+        text = str(e)
+        if isinstance(self.handle_parsing_errors, bool):
+            if e.send_to_llm:
+                observation = str(e.observation)
+                text = str(e.llm_output)
+            else:
+                observation = "Invalid or incomplete response"
+        elif isinstance(self.handle_parsing_errors, str):
+            observation = self.handle_parsing_errors
+        else:
+            observation = self.handle_parsing_errors(e)
+
+        output = AgentAction("_Exception", observation, text)
+        if run_manager:
+            run_manager.on_agent_action(output, color="green")
+        observation = ExceptionTool().run(
+            output.tool_input,
+            verbose=self.verbose,
+            color=None,
+            callbacks=run_manager.get_child() if run_manager else None,
+            **self.agent.tool_run_logging_kwargs(),
+        )
+        return [(output, observation)]
+
+    def _take_next_step(
+        self,
+        name_to_tool_map: dict[str, BaseTool],
+        color_mapping: dict[str, str],
+        inputs: dict[str, str],
+        intermediate_steps: list[tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> AgentFinish | list[tuple[AgentAction, str]]:
+        try:
+            planned_steps = self._prepare_intermediate_steps(intermediate_steps)
+            output = self.agent.plan(
+                planned_steps,
+                callbacks=run_manager.get_child() if run_manager else None,
+                **inputs,
+            )
+        except OutputParserException as e:
+            return self._handle_parsing_error(e, run_manager)
+
+        if isinstance(output, AgentFinish):
+            return output
+
+        actions = [output] if isinstance(output, AgentAction) else list(output)
+        for agent_action in actions:
+            if run_manager:
+                run_manager.on_agent_action(agent_action, color="green")
+
+        if len(actions) == 1:
+            observations = [
+                self._run_action(
+                    actions[0], name_to_tool_map, color_mapping, run_manager
+                )
+            ]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(len(actions), self.max_workers)
+            ) as pool:
+                futures = [
+                    submit_in_context(
+                        pool,
+                        self._run_action,
+                        agent_action,
+                        name_to_tool_map,
+                        color_mapping,
+                        run_manager,
+                    )
+                    for agent_action in actions
+                ]
+                observations = [future.result() for future in futures]
+
+        return list(zip(actions, observations))
+
+
+def init_agent_executor(
+    tools: list[BaseTool],
+    verbose: bool = False,
+    tool_thread_setup: Callable[[], None] | None = None,
+    tool_cache: ToolCache | None = None,
+    history_renderer: ChatHistoryRenderer | None = None,
+    tool_selector: ToolSelector | None = None,
+    streaming: bool = False,
+) -> AgentExecutor:
+    # Keep the renderer of the session across turns to only render new messages
+    renderer = history_renderer or ChatHistoryRenderer()
     prompt = load_prompt(Path("./app/prompts/master.yaml").resolve())
-    tool_strings = "\n".join([f"{tool.name}: {tool.description}" for tool in tools])
-    tool_names = ", ".join([tool.name for tool in tools])
-    prompt = prompt.partial(
-        date=datetime.now().isoformat()[:10],
-        tool_names=tool_names,
-        tool_strings=tool_strings,
-    )
+    prompt = prompt.partial(date=datetime.now().isoformat()[:10])
+
+    # Without a selector every tool is described in the prompt
+    def select_tools(x: dict[str, Any]) -> list[BaseTool]:
+        if tool_selector is None:
+            return tools
+        return tool_selector.select(
+            x["input"], x["chat_history"], x["intermediate_steps"]
+        )
 
-    llm = ChatOpenAI(temperature=0.1, model=settings.OPENAI_MODEL)
+    llm = ChatOpenAI(
+        temperature=0.1,
+        model=settings.OPENAI_MODEL,
+        callbacks=[OPENAI_RATE_LIMIT_HANDLER],
+        # Tokens reach the on_llm_new_token callbacks of the invocation
+        streaming=streaming,
+    )
     llm_with_stop = llm.bind(stop=["\nObservation"])
 
     # Using LCEL
     agent: Any = (
         {
             "input": lambda x: x["input"],
-            "agent_scratchpad": lambda x: format_log_to_messages(
+            "agent_scratchpad": lambda x: format_steps_to_messages(
                 x["intermediate_steps"],
                 template_tool_response=TEMPLATE_TOOL_RESPONSE,
             ),
-            "chat_history": lambda x: x["chat_history"],
+            "chat_history": lambda x: renderer.render(x["chat_history"]),
+            "tool_strings": lambda x: render_tool_strings(select_tools(x)),
+            "tool_names": lambda x: render_tool_names(select_tools(x)),
         }
         | prompt
         | llm_with_stop
         | CustomJSONOutputParser()
     )
 
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=verbose)
+    agent_executor = ConcurrentAgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=verbose,
+        tool_thread_setup=tool_thread_setup,
+        tool_cache=tool_cache,
+        return_intermediate_steps=True,
+    )
     return agent_executor
 
 
 if __name__ == "__main__":
+    from app.agent.tools import get_all_tools
+
     chat_history = []
     tools = get_all_tools()
     agent_executor = init_agent_executor(tools, verbose=True)
 
-    init_message = "Hi, I am Maria, your personal HR assistant. To get started, can you please tell me your name and email address? Thanks!"
-    print(init_message)
-    chat_history.append({"role": "assistant", "content": init_message})
+    print(INIT_MESSAGE)
+    chat_history.append({"role": "assistant", "content": INIT_MESSAGE})
 
     while True:
         user_input = input(">>> ")
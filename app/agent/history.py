@@ -0,0 +1,42 @@
+import threading
+from typing import Any
+
+ROLE_LABELS = {"user": "User", "assistant": "Maria"}
+
+
+def render_message(message: dict[str, Any]) -> str:
+    """One line per message text line, prefixed with the speaker. Only the role
+    and content are kept, the captured agent logs and other keys are dropped."""
+    role = str(message.get("role", ""))
+    label = ROLE_LABELS.get(role, role.capitalize())
+    lines = [line.strip() for line in str(message.get("content", "")).splitlines()]
+    return f"{label}: " + "\n".join(line for line in lines if line)
+
+
+class ChatHistoryRenderer:
+    """Renders the chat history of a session for the prompt.
+
+    The rendered text of the messages seen so far is kept, so each turn only
+    renders the messages added since the previous one. The whole history is
+    rendered again if an earlier message changed, e.g. after a reset.
+    """
+
+    def __init__(self) -> None:
+        self._keys: list[tuple[str, str]] = []
+        self._text = ""
+        self._lock = threading.Lock()
+
+    def render(self, messages: list[dict[str, Any]]) -> str:
+        keys = [(str(m.get("role")), str(m.get("content"))) for m in messages]
+        with self._lock:
+            n_cached = len(self._keys)
+            if len(keys) < n_cached or keys[:n_cached] != self._keys:
+                self._keys, self._text = [], ""
+                n_cached = 0
+
+            # Comparing the keys is cheap, the content strings are the same objects
+            for message in messages[n_cached:]:
+                line = render_message(message)
+                self._text = f"{self._text}\n{line}" if self._text else line
+            self._keys.extend(keys[n_cached:])
+            return self._text
@@ -1,34 +1,167 @@
 from __future__ import annotations
 
+import ast
+import json
 import logging
+import re
+from typing import Any
 
 from langchain.agents.agent import AgentOutputParser
-from langchain.output_parsers.json import parse_json_markdown
 from langchain.schema import AgentAction, AgentFinish, OutputParserException
 
-from app.agent.tools import RespondTool
+from app.agent.constants import RESPOND_TOOL_NAME
+from app.metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
+FENCED_BLOCK = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+CLOSING = {"{": "}", "[": "]"}
+
+
+def _extract_json_block(text: str) -> str | None:
+    """Get the first JSON-looking object or array in the text, ignoring fences and prose.
+    Unterminated blocks (e.g. a truncated completion) are closed."""
+    fenced = FENCED_BLOCK.search(text)
+    if fenced and fenced.group(1).lstrip()[:1] in CLOSING:
+        text = fenced.group(1)
+
+    start = next((i for i, char in enumerate(text) if char in CLOSING), None)
+    if start is None:
+        return None
+
+    stack: list[str] = []
+    quote: str | None = None
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in CLOSING:
+            stack.append(CLOSING[char])
+        elif stack and char == stack[-1]:
+            stack.pop()
+            if not stack:
+                return text[start : i + 1]
+
+    return text[start:] + (quote or "") + "".join(reversed(stack))
+
+
+def _escape_newlines_in_strings(block: str) -> str:
+    chars = []
+    quote: str | None = None
+    escaped = False
+    for char in block:
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+            elif char == "\n":
+                char = "\\n"
+        elif char in "\"'":
+            quote = char
+        chars.append(char)
+    return "".join(chars)
+
+
+def _repair(block: str) -> Any:
+    """Fix common formatting slips: trailing commas, single quotes and Python literals."""
+    block = TRAILING_COMMA.sub(r"\1", block)
+    try:
+        return json.loads(block, strict=False)
+    except json.JSONDecodeError:
+        pass
+    # Single-quoted strings and True/False/None are valid Python literals
+    return ast.literal_eval(_escape_newlines_in_strings(block))
+
+
+def parse_json_action(text: str) -> tuple[Any, bool]:
+    """
+    Parse the JSON blob emitted by the LLM, tolerating fences, surrounding prose,
+    unescaped newlines, single quotes, trailing commas and truncated output.
+
+    Args:
+        text (str): LLM output
+
+    Raises:
+        ValueError: if no JSON could be recovered from the text
+
+    Returns:
+        tuple[Any, bool]: the parsed JSON and whether it had to be repaired
+    """
+    block = _extract_json_block(text)
+    if block is None:
+        raise ValueError("No JSON found in the text")
+
+    try:
+        # strict=False accepts raw newlines and tabs inside strings
+        return json.loads(block, strict=False), False
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        return _repair(block), True
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"Could not repair JSON: {block}") from e
+
 
 class CustomJSONOutputParser(AgentOutputParser):
-    def parse(self, text: str) -> AgentAction | AgentFinish:
+    def parse(self, text: str) -> AgentAction | list[AgentAction] | AgentFinish:  # type: ignore[override]
+        METRICS.increment("output_parser.calls")
+        try:
+            response, repaired = parse_json_action(text)
+        except ValueError as e:
+            if "{" not in text and text.strip():
+                # The model answered in plain prose: treat it as the final answer
+                # instead of paying for another LLM round trip
+                METRICS.increment("output_parser.prose_fallback")
+                return AgentFinish({"output": text.strip()}, text)
+            METRICS.increment("output_parser.failures")
+            raise OutputParserException(f"Could not parse LLM output: {text}") from e
+
+        if repaired:
+            METRICS.increment("output_parser.repairs")
+            logger.info("Repaired LLM output: %s", text)
+
         try:
-            response = parse_json_markdown(text)
-            if isinstance(response, list):
-                # gpt turbo frequently ignores the directive to emit a single action
-                logger.warning("Got multiple tool responses: %s", response)
-                response = response[0]
-
-            if response["tool"] == RespondTool().name:  # type: ignore
-                return AgentFinish({"output": response["tool_input"]}, text)
-            else:
-                return AgentAction(
-                    response["tool"], response.get("tool_input", {}), text
-                )
+            if not isinstance(response, list):
+                return self._parse_action(response, text)
+
+            # Several independent actions: run them all in this step. A response
+            # only makes sense once the other actions' observations are known.
+            actions = [self._parse_action(item, text) for item in response]
+            tool_actions = [a for a in actions if isinstance(a, AgentAction)]
+            if not tool_actions:
+                return actions[0]
+            if len(tool_actions) < len(actions):
+                logger.warning("Dropping responses emitted with actions: %s", text)
+            return tool_actions  # type: ignore
         except Exception as e:
+            METRICS.increment("output_parser.failures")
             raise OutputParserException(f"Could not parse LLM output: {text}") from e
 
+    def _parse_action(
+        self, response: dict[str, Any], text: str
+    ) -> AgentAction | AgentFinish:
+        if response["tool"] == RESPOND_TOOL_NAME:
+            return AgentFinish({"output": response["tool_input"]}, text)
+
+        tool_input = response.get("tool_input", {})
+        if isinstance(tool_input, (dict, list)):
+            # The tools parse JSON inputs from strings themselves
+            tool_input = json.dumps(tool_input)
+        return AgentAction(response["tool"], tool_input, text)
+
     @property
     def _type(self) -> str:
         return "json-agent"
@@ -0,0 +1,121 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from app.agent.cache import ToolCache
+from app.config import settings
+from app.ratelimit import Priority, rate_limit_priority
+
+if TYPE_CHECKING:
+    from langchain.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+# e.g. "with employee_id 215", "employee id: 215", "employee 215"
+EMPLOYEE_ID_PATTERN = re.compile(r"employee(?:[ _]id)?\W{0,3}(\d+)\b", re.IGNORECASE)
+
+
+# Shared by the prefetchers of every session, so idle sessions hold no threads
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.PREFETCH_MAX_WORKERS,
+                thread_name_prefix="prefetch",
+            )
+        return _pool
+
+
+def find_employee_ids(text: str) -> list[str]:
+    """Employee IDs mentioned in a message or tool output, in order of appearance."""
+    return list(dict.fromkeys(EMPLOYEE_ID_PATTERN.findall(text)))
+
+
+class EmployeePrefetcher:
+    """Warms the session tool cache in the background when an employee is mentioned.
+
+    The next turns after an employee ID shows up usually ask for that employee's
+    requests or balance, so the read-only tools taking an employee ID are run
+    ahead of time and their outputs stored where the agent executor looks first.
+    """
+
+    def __init__(self, tools: list["BaseTool"], tool_cache: ToolCache) -> None:
+        """
+        Args:
+            tools (list[BaseTool]): side-effect-free tools whose input is an employee ID
+            tool_cache (ToolCache): the session tool cache to warm
+        """
+        self.tools = tools
+        self.tool_cache = tool_cache
+        self._last_prefetch: dict[str, float] = {}
+        self._pending: set[Future[None]] = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def observe(self, text: str) -> None:
+        """Prefetches the data of every employee mentioned in the text."""
+        for employee_id in find_employee_ids(text):
+            self.prefetch(employee_id)
+
+    def prefetch(self, employee_id: str) -> None:
+        """Schedules the prefetch of an employee, unless it is still cached."""
+        with self._lock:
+            if self._closed:
+                return
+            last = self._last_prefetch.get(employee_id)
+            if last is not None and time.monotonic() - last < self.tool_cache.ttl:
+                return
+            self._last_prefetch[employee_id] = time.monotonic()
+
+            # The shared absence index, and the BambooHR balances cached by the
+            # balance tool, back the time off request validation
+            pool = _get_pool()
+            futures = [pool.submit(self._warm_absence_index)]
+            for tool in self.tools:
+                futures.append(pool.submit(self._warm_tool, tool, employee_id))
+            self._pending.update(futures)
+        for future in futures:
+            future.add_done_callback(self._done)
+
+    def _done(self, future: "Future[None]") -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def _warm_tool(self, tool: "BaseTool", employee_id: str) -> None:
+        if self.tool_cache.get(tool.name, employee_id) is not None:
+            return
+        # A write tool may invalidate the cache while the prefetch runs
+        generation = self.tool_cache.generation
+        try:
+            # Prefetching yields the rate limits to the calls of the chat
+            with rate_limit_priority(Priority.BULK):
+                output = tool.run(employee_id)
+            self.tool_cache.put(tool.name, employee_id, output, generation)
+        except Exception:
+            # Prefetching is best effort, the tool will run again on demand
+            logger.warning("Prefetch of %s(%s) failed", tool.name, employee_id)
+
+    def _warm_absence_index(self) -> None:
+        from app.integrations.bamboo.absences import get_absence_index
+
+        try:
+            with rate_limit_priority(Priority.BULK):
+                get_absence_index()
+        except Exception:
+            logger.warning("Prefetch of the absence index failed")
+
+    def shutdown(self) -> None:
+        """Cancels the prefetches not started yet, no more are scheduled."""
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, set()
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,262 @@
+import threading
+from typing import TYPE_CHECKING, Any, Callable
+
+from app.agent.cache import ToolCache
+from app.agent.history import ChatHistoryRenderer
+from app.agent.prefetch import EmployeePrefetcher
+
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from langchain.tools import BaseTool
+
+    from app.agent.tool_selection import ToolSelector
+
+WELCOME_MESSAGE = """
+Hi, I am Maria, your personal HR assistant. To get started, can you please provide the following information:\n
+    - First Name
+    - Last Name
+    - Email Address
+I will then:\n
+    1. Send you a welcome email, the HR policies and a Slack invite.
+    2. Schedule a calendar event for your onboarding.
+    3. Enroll you in the HR system.
+Thanks!
+"""
+
+# Onboarding steps, each set by the callback of its tool
+ONBOARDING_STEPS = (
+    "welcome_email_sent",
+    "policies_email_sent",
+    "slack_invite_sent",
+    "calendar_event_created",
+    "enrolled_in_HR_system",
+)
+
+# Messages longer than this are refused
+MAX_INPUT_WORDS = 500
+
+
+class AgentSession:
+    """State of a conversation with the agent, and the turns run on it.
+
+    One turn runs at a time per session: `begin_turn` reserves the session and
+    `end_turn` releases it, once the session store has saved the turn. The
+    session can be read while a turn runs. Sessions are loaded and saved by the
+    session store, see app/agent/store.py.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        messages: list[dict[str, str]] | None = None,
+        onboarding: dict[str, bool] | None = None,
+        generation: int = 0,
+    ) -> None:
+        """
+        Args:
+            session_id (str)
+            messages (list[dict[str, str]] | None, optional): messages of a stored session, after the welcome message. Defaults to None.
+            onboarding (dict[str, bool] | None, optional): onboarding status of a stored session. Defaults to None.
+            generation (int, optional): resets of the session before it was loaded, see `SessionStore.reset`. Defaults to 0.
+        """
+        self.session_id = session_id
+        self.generation = generation
+        self.messages: list[dict[str, str]] = [
+            {"role": "assistant", "content": WELCOME_MESSAGE},
+            *(messages or []),
+        ]
+        self.onboarding = {step: False for step in ONBOARDING_STEPS}
+        self.onboarding.update(onboarding or {})
+        self.tool_cache = ToolCache()
+        self.history_renderer = ChatHistoryRenderer()
+        self._prefetcher: EmployeePrefetcher | None = None
+        self._tool_selector: "ToolSelector | None" = None
+        self._lock = threading.Lock()
+        self._busy = False
+        # Logs of the turns not saved yet, by message index. The saved ones are
+        # only kept by the session store
+        self._logs: dict[int, list[str]] = {}
+
+    @property
+    def busy(self) -> bool:
+        return self._busy
+
+    def snapshot(self) -> dict[str, Any]:
+        """Messages and onboarding status, as sent to the clients. The logs are
+        added by the session store."""
+        with self._lock:
+            return {
+                "session_id": self.session_id,
+                "messages": [{**message, "log": []} for message in self.messages],
+                "onboarding": dict(self.onboarding),
+                "busy": self._busy,
+            }
+
+    def export(
+        self,
+    ) -> tuple[list[dict[str, str]], dict[str, bool], dict[int, list[str]]]:
+        """
+        Takes the state to save: the messages after the welcome message, the
+        onboarding status, and the logs of the turns run since the last export
+
+        Returns:
+            tuple[list[dict[str, str]], dict[str, bool], dict[int, list[str]]]
+        """
+        with self._lock:
+            logs, self._logs = self._logs, {}
+            return self.messages[1:], dict(self.onboarding), logs
+
+    def onboarding_status(self) -> dict[str, bool]:
+        with self._lock:
+            return dict(self.onboarding)
+
+    def is_onboarding_done(self) -> bool:
+        # Called by the tool selector on the agent threads
+        with self._lock:
+            return all(self.onboarding.values())
+
+    def _set_step(self, step: str) -> Callable[[], None]:
+        def callback() -> None:
+            with self._lock:
+                self.onboarding[step] = True
+
+        return callback
+
+    @property
+    def prefetcher(self) -> EmployeePrefetcher:
+        if self._prefetcher is None:
+            from app.agent.tools import (
+                EstimateTimeOffBalanceTool,
+                ViewTimeOffRequestsTool,
+            )
+
+            self._prefetcher = EmployeePrefetcher(
+                tools=[ViewTimeOffRequestsTool(), EstimateTimeOffBalanceTool()],  # type: ignore
+                tool_cache=self.tool_cache,
+            )
+        return self._prefetcher
+
+    def build_tools(self) -> list["BaseTool"]:
+        from app.agent.tools import (
+            AddEmployeeToHRTool,
+            CancelTimeOffRequestTool,
+            CreateCalendarEventTool,
+            EstimateTimeOffBalanceTool,
+            FindCalendarSlotTool,
+            FindEmployeeTool,
+            HRPolicyEmailTool,
+            HRPolicyQATool,
+            MakeTimeOffRequestTool,
+            ModifyEmployeeTool,
+            RespondTool,
+            SlackInviteTool,
+            ViewEmployeeTool,
+            ViewTimeOffRequestsTool,
+            WelcomeEmailTool,
+            WhosOutTool,
+        )
+
+        return [
+            RespondTool(),  # type: ignore
+            WelcomeEmailTool(callback=self._set_step("welcome_email_sent")),  # type: ignore
+            HRPolicyEmailTool(callback=self._set_step("policies_email_sent")),  # type: ignore
+            SlackInviteTool(callback=self._set_step("slack_invite_sent")),  # type: ignore
+            FindCalendarSlotTool(),  # type: ignore
+            CreateCalendarEventTool(callback=self._set_step("calendar_event_created")),  # type: ignore
+            AddEmployeeToHRTool(callback=self._set_step("enrolled_in_HR_system")),  # type: ignore
+            HRPolicyQATool(),  # type: ignore
+            ModifyEmployeeTool(),  # type: ignore
+            ViewEmployeeTool(),  # type: ignore
+            FindEmployeeTool(),  # type: ignore
+            ViewTimeOffRequestsTool(),  # type: ignore
+            MakeTimeOffRequestTool(),  # type: ignore
+            CancelTimeOffRequestTool(),  # type: ignore
+            EstimateTimeOffBalanceTool(),  # type: ignore
+            WhosOutTool(),  # type: ignore
+        ]
+
+    @property
+    def tool_selector(self) -> "ToolSelector":
+        """Tools of the session and their selector, built on the first turn and
+        kept so the selections cached by the selector are reused."""
+        if self._tool_selector is None:
+            from app.agent.tool_selection import ToolSelector
+
+            self._tool_selector = ToolSelector(
+                self.build_tools(), is_onboarding_done=self.is_onboarding_done
+            )
+        return self._tool_selector
+
+    def init_agent(self, streaming: bool = False) -> "AgentExecutor":
+        from app.agent.executor import init_agent_executor
+
+        return init_agent_executor(
+            self.tool_selector.tools,
+            tool_cache=self.tool_cache,
+            history_renderer=self.history_renderer,
+            tool_selector=self.tool_selector,
+            streaming=streaming,
+        )
+
+    def begin_turn(self) -> bool:
+        """Reserves the session for a turn, False if one is already running."""
+        with self._lock:
+            if self._busy:
+                return False
+            self._busy = True
+            return True
+
+    def end_turn(self) -> None:
+        with self._lock:
+            self._busy = False
+
+    def run_turn(
+        self,
+        user_input: str,
+        on_event: Callable[[dict[str, Any]], None] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Runs the agent on a user message, in the calling thread. The session
+        must have been reserved with `begin_turn`, and is released with
+        `end_turn` by the caller once saved.
+
+        Args:
+            user_input (str): the user message
+            on_event (Callable[[dict[str, Any]], None] | None, optional): receives the streamed answer tokens and the tool steps. Defaults to None.
+
+        Returns:
+            dict[str, Any]: the assistant message, with the whole log of the turn
+        """
+        from app.agent.callbacks import TurnCallbackHandler
+
+        with self._lock:
+            chat_history = list(self.messages)
+        # Start fetching the data of any employee mentioned while the agent thinks
+        self.prefetcher.observe(user_input)
+
+        handler = TurnCallbackHandler(on_event)
+        result = self.init_agent(streaming=on_event is not None).invoke(
+            {"input": user_input, "chat_history": chat_history},
+            config={"callbacks": [handler]},
+        )
+
+        # Warm the cache for the employees that came up while the user types
+        for _, observation in result["intermediate_steps"]:
+            self.prefetcher.observe(str(observation))
+        self.prefetcher.observe(result["output"])
+
+        # The user message is only kept with its answer, a failed turn
+        # leaves the history as it was
+        with self._lock:
+            self.messages.append({"role": "user", "content": user_input})
+            self.messages.append({"role": "assistant", "content": result["output"]})
+            self._logs[len(self.messages) - 1] = handler.logs
+        return {
+            "role": "assistant",
+            "content": result["output"],
+            "log": handler.logs,
+        }
+
+    def close(self) -> None:
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown()
@@ -0,0 +1,348 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+
+from app.agent.session import ONBOARDING_STEPS, AgentSession
+from app.config import settings
+from app.metrics import METRICS
+
+# One letter per role in the encoded messages
+ROLE_CODES = {"user": "u", "assistant": "a"}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    state BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS logs (
+    session_id TEXT NOT NULL,
+    message_index INTEGER NOT NULL,
+    log BLOB NOT NULL,
+    PRIMARY KEY (session_id, message_index)
+);
+"""
+
+
+def _compress(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+
+
+def _decompress(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data))
+
+
+def encode_state(messages: list[dict[str, str]], onboarding: dict[str, bool]) -> bytes:
+    """
+    Encodes the state of a session: the messages as [role code, content]
+    pairs, the onboarding status as a bit per step, compressed
+
+    Args:
+        messages (list[dict[str, str]]): messages after the welcome message
+        onboarding (dict[str, bool]): onboarding status
+
+    Returns:
+        bytes: encoded state
+    """
+    return _compress(
+        {
+            "m": [[ROLE_CODES[m["role"]], m["content"]] for m in messages],
+            "o": sum(
+                1 << i for i, step in enumerate(ONBOARDING_STEPS) if onboarding[step]
+            ),
+        }
+    )
+
+
+def decode_state(data: bytes) -> tuple[list[dict[str, str]], dict[str, bool]]:
+    """Messages and onboarding status of an encoded state, see `encode_state`."""
+    state = _decompress(data)
+    messages = [
+        {"role": CODE_ROLES[role], "content": content} for role, content in state["m"]
+    ]
+    onboarding = {
+        step: bool(state["o"] & (1 << i)) for i, step in enumerate(ONBOARDING_STEPS)
+    }
+    return messages, onboarding
+
+
+def truncate_log(
+    log: list[str],
+    max_lines: int = settings.SESSION_LOG_MAX_LINES,
+    max_line_chars: int = settings.SESSION_LOG_MAX_LINE_CHARS,
+) -> list[str]:
+    """
+    Cuts a log to its first and last lines, and each line to its start
+
+    Args:
+        log (list[str]): log lines
+        max_lines (int, optional): lines kept. Defaults to settings.SESSION_LOG_MAX_LINES.
+        max_line_chars (int, optional): characters kept per line. Defaults to settings.SESSION_LOG_MAX_LINE_CHARS.
+
+    Returns:
+        list[str]: truncated log
+    """
+    if len(log) > max_lines:
+        head = max_lines // 2
+        tail = max_lines - head - 1
+        log = [
+            *log[:head],
+            f"[{len(log) - head - tail} lines truncated]",
+            *(log[-tail:] if tail else []),
+        ]
+    return [
+        line if len(line) <= max_line_chars else line[:max_line_chars] + "[...]"
+        for line in log
+    ]
+
+
+class MemorySessionBackend:
+    """Encoded sessions kept in memory, the least recently saved being dropped
+    beyond `max_sessions`. Sessions are lost on restart."""
+
+    def __init__(
+        self, max_sessions: int = settings.SESSION_MEMORY_MAX_SESSIONS
+    ) -> None:
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, tuple[bytes, dict[int, bytes]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> bytes | None:
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            return stored[0] if stored else None
+
+    def load_logs(self, session_id: str) -> dict[int, bytes]:
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            return dict(stored[1]) if stored else {}
+
+    def save(self, session_id: str, state: bytes, logs: dict[int, bytes]) -> None:
+        with self._lock:
+            stored_logs = self._sessions.pop(session_id, (b"", {}))[1]
+            self._sessions[session_id] = (state, {**stored_logs, **logs})
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                METRICS.increment("session_store.dropped")
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionBackend:
+    """Encoded sessions saved to a local SQLite database, the logs in their own
+    table so loading a session does not read them."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._initialised = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per operation, so the backend can be used from any thread
+        if not self._initialised:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialised:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._initialised = True
+        return connection
+
+    def load(self, session_id: str) -> bytes | None:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT state FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load_logs(self, session_id: str) -> dict[int, bytes]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT message_index, log FROM logs WHERE session_id = ?",
+                (session_id,),
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, session_id: str, state: bytes, logs: dict[int, bytes]) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, state, time.time()),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO logs (session_id, message_index, log) VALUES (?, ?, ?)",
+                [(session_id, index, log) for index, log in logs.items()],
+            )
+
+    def delete(self, session_id: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            connection.execute("DELETE FROM logs WHERE session_id = ?", (session_id,))
+
+
+SessionBackend = MemorySessionBackend | SQLiteSessionBackend
+
+
+class SessionStore:
+    """Sessions of the agent service, by ID. Unknown IDs get a new session.
+
+    Only the `max_live` most recently used sessions are kept as AgentSession
+    objects, with their tool cache and prefetcher. The least recently used idle
+    ones beyond that are evicted and loaded again from the backend when needed,
+    so the memory of the service does not grow with the number of users. The
+    logs of the answers are saved truncated and only read when asked for.
+    """
+
+    def __init__(
+        self, backend: SessionBackend, max_live: int = settings.SESSION_MAX_LIVE
+    ) -> None:
+        """
+        Args:
+            backend (SessionBackend): where the sessions are saved
+            max_live (int, optional): sessions kept loaded. Defaults to settings.SESSION_MAX_LIVE.
+        """
+        self.backend = backend
+        self.max_live = max_live
+        self._live: OrderedDict[str, AgentSession] = OrderedDict()
+        # Resets of each session, the sessions loaded before a reset are not saved
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _evict(self) -> list[AgentSession]:
+        # Sessions running a turn are kept, they are saved when it ends. The
+        # others are saved as they are dropped, in case a save was missed
+        evicted = []
+        for session_id in list(self._live):
+            if len(self._live) <= self.max_live:
+                break
+            if not self._live[session_id].busy:
+                session = self._live.pop(session_id)
+                self._write(session)
+                evicted.append(session)
+        METRICS.increment("session_store.evicted", len(evicted))
+        METRICS.set_gauge("session_store.live", len(self._live))
+        return evicted
+
+    def _get_locked(self, session_id: str) -> tuple[AgentSession, list[AgentSession]]:
+        # Called with the lock held, returns the session and the evicted ones
+        session = self._live.get(session_id)
+        if session is not None:
+            self._live.move_to_end(session_id)
+            return session, []
+
+        state = self.backend.load(session_id)
+        if state is None:
+            session = AgentSession(
+                session_id, generation=self._generations.get(session_id, 0)
+            )
+        else:
+            session = AgentSession(
+                session_id,
+                *decode_state(state),
+                generation=self._generations.get(session_id, 0),
+            )
+            METRICS.increment("session_store.loaded")
+        self._live[session_id] = session
+        return session, self._evict()
+
+    def get(self, session_id: str) -> AgentSession:
+        with self._lock:
+            session, evicted = self._get_locked(session_id)
+        for previous in evicted:
+            previous.close()
+        return session
+
+    def begin_turn(self, session_id: str) -> AgentSession | None:
+        """
+        Gets a session and reserves it for a turn in one step, so it cannot be
+        evicted or reset in between and the turn always runs on the live session
+
+        Args:
+            session_id (str)
+
+        Returns:
+            AgentSession | None: the reserved session, None if a turn of the session is running
+        """
+        with self._lock:
+            session, evicted = self._get_locked(session_id)
+            reserved = session.begin_turn()
+        for previous in evicted:
+            previous.close()
+        return session if reserved else None
+
+    def _write(self, session: AgentSession) -> None:
+        # Called with the lock held. A session reset since it was loaded is not
+        # saved, it would bring the old conversation back
+        if session.generation != self._generations.get(session.session_id, 0):
+            METRICS.increment("session_store.stale_saves")
+            return
+        messages, onboarding, logs = session.export()
+        if not messages and not logs:
+            # Nothing said yet, the session is the same as a new one
+            return
+        compressed = {
+            index: _compress(truncate_log(log)) for index, log in logs.items()
+        }
+        self.backend.save(
+            session.session_id, encode_state(messages, onboarding), compressed
+        )
+
+    def save(self, session: AgentSession) -> None:
+        """Saves the state of a session and the logs of its new answers. Turns
+        save the session before releasing it, so it is not evicted unsaved."""
+        with self._lock:
+            self._write(session)
+
+    def snapshot(self, session_id: str, logs: bool = False) -> dict[str, Any]:
+        """
+        Messages and onboarding status of a session, as sent to the clients
+
+        Args:
+            session_id (str)
+            logs (bool, optional): include the agent log of each answer. Defaults to False.
+
+        Returns:
+            dict[str, Any]
+        """
+        snapshot = self.get(session_id).snapshot()
+        if logs:
+            for index, log in self.backend.load_logs(session_id).items():
+                if index < len(snapshot["messages"]):
+                    snapshot["messages"][index]["log"] = _decompress(log)
+        return snapshot
+
+    def reset(self, session_id: str) -> AgentSession | None:
+        """
+        Starts the conversation of a session over
+
+        Args:
+            session_id (str)
+
+        Returns:
+            AgentSession | None: the new session, None if a turn of the session is running
+        """
+        with self._lock:
+            previous = self._live.get(session_id)
+            if previous is not None and previous.busy:
+                return None
+            self._live.pop(session_id, None)
+            self._generations[session_id] = self._generations.get(session_id, 0) + 1
+            self.backend.delete(session_id)
+        if previous is not None:
+            previous.close()
+        return self.get(session_id)
+
+
+def create_session_store() -> SessionStore:
+    """Session store saving to settings.SESSION_STORE_PATH, or in memory if not set."""
+    if settings.SESSION_STORE_PATH:
+        return SessionStore(SQLiteSessionBackend(settings.SESSION_STORE_PATH))
+    return SessionStore(MemorySessionBackend())
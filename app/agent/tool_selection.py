@@ -0,0 +1,152 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+from langchain.schema import AgentAction
+from langchain.schema.embeddings import Embeddings
+from langchain.tools import BaseTool
+
+from app.agent.constants import RESPOND_TOOL_NAME
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Selections kept per session, one per recent (input, previous message) pair
+SELECTION_CACHE_SIZE = 32
+
+# Tool description vectors, shared by the sessions. Keyed by the described text
+# so a changed description is embedded again.
+_description_vectors: dict[str, np.ndarray] = {}
+_description_vectors_lock = threading.Lock()
+
+
+def describe_tool(tool: BaseTool) -> str:
+    return f"{tool.name}: {tool.description}"
+
+
+def render_tool_strings(tools: list[BaseTool]) -> str:
+    return "\n".join(describe_tool(tool) for tool in tools)
+
+
+def render_tool_names(tools: list[BaseTool]) -> str:
+    return ", ".join(tool.name for tool in tools)
+
+
+class ToolSelector:
+    """Picks the tools described in the prompt at each agent step.
+
+    The tools of the onboarding steps are always offered until onboarding is
+    done. The respond tool and the tools already used in the current turn are
+    always offered too. The other tools are ranked by the similarity of their
+    description to the user input and the previous assistant message, and the
+    best `k` are added.
+    """
+
+    def __init__(
+        self,
+        tools: list[BaseTool],
+        k: int = settings.TOOL_SELECTION_K,
+        is_onboarding_done: Callable[[], bool] | None = None,
+        embeddings: Embeddings | None = None,
+    ) -> None:
+        """
+        Args:
+            tools (list[BaseTool]): all the tools of the agent
+            k (int, optional): tools picked by similarity. Defaults to settings.TOOL_SELECTION_K.
+            is_onboarding_done (Callable[[], bool] | None, optional): onboarding status of the session. Defaults to every onboarding tool having run.
+            embeddings (Embeddings | None, optional): Defaults to OpenAI embeddings.
+        """
+        self.tools = tools
+        self.k = k
+        self.is_onboarding_done = is_onboarding_done
+        self._embeddings = embeddings
+        self._used_tools: set[str] = set()
+        self._selections: OrderedDict[tuple[str, str], list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            from langchain.embeddings.openai import OpenAIEmbeddings
+
+            self._embeddings = OpenAIEmbeddings()
+        return self._embeddings
+
+    @property
+    def onboarding_tools(self) -> list[BaseTool]:
+        return [tool for tool in self.tools if getattr(tool, "onboarding", False)]
+
+    def onboarding_done(self) -> bool:
+        if self.is_onboarding_done is not None:
+            return self.is_onboarding_done()
+        return all(tool.name in self._used_tools for tool in self.onboarding_tools)
+
+    def _description_vectors(self, tools: list[BaseTool]) -> np.ndarray:
+        """Embeds the descriptions not embedded yet, in a single call."""
+        with _description_vectors_lock:
+            missing = [
+                describe_tool(tool)
+                for tool in tools
+                if describe_tool(tool) not in _description_vectors
+            ]
+            if missing:
+                vectors = self.embeddings.embed_documents(missing)
+                for text, vector in zip(missing, vectors):
+                    _description_vectors[text] = np.array(vector, dtype=np.float32)
+            return np.vstack([_description_vectors[describe_tool(t)] for t in tools])
+
+    def _rank(self, query: str, candidates: list[BaseTool]) -> list[str]:
+        """Names of the `k` candidates most similar to the query."""
+        if len(candidates) <= self.k:
+            return [tool.name for tool in candidates]
+        try:
+            vectors = self._description_vectors(candidates)
+            query_vector = np.array(self.embeddings.embed_query(query))
+        except Exception:
+            # Without embeddings every tool is offered, as before the selection
+            logger.warning("Tool selection failed, offering every tool")
+            return [tool.name for tool in candidates]
+
+        similarity = vectors @ query_vector / np.linalg.norm(vectors, axis=1)
+        return [candidates[i].name for i in np.argsort(-similarity)[: self.k]]
+
+    def select(
+        self,
+        user_input: str,
+        chat_history: list[dict[str, Any]] | None = None,
+        intermediate_steps: list[tuple[AgentAction, str]] | None = None,
+    ) -> list[BaseTool]:
+        """
+        Tools to describe in the prompt for an agent step
+
+        Args:
+            user_input (str): input of the current turn
+            chat_history (list[dict[str, Any]] | None, optional): previous messages. Defaults to None.
+            intermediate_steps (list[tuple[AgentAction, str]] | None, optional): steps of the current turn. Defaults to None.
+
+        Returns:
+            list[BaseTool]: selected tools, in the order of `tools`
+        """
+        used_now = {action.tool for action, _ in intermediate_steps or []}
+        previous = chat_history[-1].get("content", "") if chat_history else ""
+        key = (user_input, str(previous))
+
+        with self._lock:
+            self._used_tools |= used_now
+            pinned = {RESPOND_TOOL_NAME} | used_now
+            if not self.onboarding_done():
+                pinned |= {tool.name for tool in self.onboarding_tools}
+
+            ranked = self._selections.get(key)
+            if ranked is None:
+                candidates = [tool for tool in self.tools if tool.name not in pinned]
+                ranked = self._rank(f"{previous}\n{user_input}", candidates)
+                self._selections[key] = ranked
+                while len(self._selections) > SELECTION_CACHE_SIZE:
+                    self._selections.popitem(last=False)
+            else:
+                self._selections.move_to_end(key)
+
+        return [t for t in self.tools if t.name in pinned or t.name in ranked]
@@ -1,31 +1,30 @@
 import datetime
 import json
 from pathlib import Path
-from typing import Callable
+from typing import Any, Callable
 
-from langchain.chat_models import ChatOpenAI
 from langchain.tools import BaseTool
 
+from app.agent.constants import RESPOND_TOOL_NAME
 from app.config import settings
-from app.integrations.bamboo.employees import add_employee, edit_employee
-from app.integrations.bamboo.time_off import (
-    add_time_off_balance,
-    add_time_off_policy,
-    add_time_off_request,
-    cancel_time_off_request,
-    get_time_off_balance_estimate,
-    get_time_off_requests,
-)
-from app.integrations.faiss import build_index
-from app.integrations.gcal import schedule_event
-from app.integrations.gmail import send_message
-from app.integrations.google_auth import GoogleService, get_google_service
-
-FAISS_INDEX = build_index("./assets/HR_policies.pdf")
+
+# The integrations (Google client, FAISS, NumPy...) are slow to import, so each
+# tool imports what it needs on first use rather than when this module loads
+
+
+def _google_service(service_name: str) -> Any:
+    """Gets an authorized Google API service ("gmail" or "calendar")."""
+    from app.integrations.google_auth import GoogleService, get_google_service
+
+    return get_google_service(
+        service_name=GoogleService(service_name),
+        client_config=settings.GOOGLE_CLIENT_CONFIG,
+        scopes=settings.GOOGLE_SCOPES,
+    )
 
 
 class RespondTool(BaseTool):
-    name = "respond_tool"
+    name = RESPOND_TOOL_NAME
     description = "used to give an answer to the human. The input to this tool is a string with your response"
 
     def _run(self, query: str) -> str:
@@ -36,13 +35,12 @@ class WelcomeEmailTool(BaseTool):
     name = "welcome_email_tool"
     description = "useful to send a welcome email to a new employee. The input is the email address of the recipient."
     callback: Callable | None = None
+    onboarding: bool = True
 
     def _run(self, recipient_email: str) -> str:
-        service = get_google_service(
-            service_name=GoogleService.GMAIL,
-            client_config=settings.GOOGLE_CLIENT_CONFIG,
-            scopes=settings.GOOGLE_SCOPES,
-        )
+        from app.integrations.gmail import send_message
+
+        service = _google_service("gmail")
 
         send_message(
             service=service,
@@ -61,13 +59,12 @@ class HRPolicyEmailTool(BaseTool):
     name = "HR_policy_email_tool"
     description = "useful to send an email with the HR policies to the new employee. The only input is the email address of the recipient."
     callback: Callable | None = None
+    onboarding: bool = True
 
     def _run(self, recipient_email: str) -> str:
-        service = get_google_service(
-            service_name=GoogleService.GMAIL,
-            client_config=settings.GOOGLE_CLIENT_CONFIG,
-            scopes=settings.GOOGLE_SCOPES,
-        )
+        from app.integrations.gmail import send_message
+
+        service = _google_service("gmail")
 
         send_message(
             service=service,
@@ -87,13 +84,12 @@ class SlackInviteTool(BaseTool):
     name = "slack_invite_tool"
     description = "useful to send a slack invite to a new employee via email. The only input is the email address of the recipient."
     callback: Callable | None = None
+    onboarding: bool = True
 
     def _run(self, recipient_email: str) -> str:
-        service = get_google_service(
-            service_name=GoogleService.GMAIL,
-            client_config=settings.GOOGLE_CLIENT_CONFIG,
-            scopes=settings.GOOGLE_SCOPES,
-        )
+        from app.integrations.gmail import send_message
+
+        service = _google_service("gmail")
 
         send_message(
             service=service,
@@ -108,19 +104,98 @@ class SlackInviteTool(BaseTool):
         return f"\nAn email with a Slack invite has been sent to {recipient_email}\n"
 
 
+def find_calendar_slot(
+    service: Any,
+    attendees: list[str],
+    duration_minutes: int,
+    earliest: str | None = None,
+    latest: str | None = None,
+    timezone: str | None = None,
+) -> tuple[datetime.datetime, datetime.datetime] | None:
+    """Earliest working-hours slot when all the attendees are free, from the next
+    day by default and within settings.CALENDAR_SLOT_WINDOW_DAYS."""
+    from zoneinfo import ZoneInfo
+
+    from app.integrations.bamboo.leave import get_leave_calendar
+    from app.integrations.gcal import find_earliest_slot
+
+    timezone = timezone or settings.CALENDAR_TIMEZONE
+    if earliest:
+        window_start = datetime.datetime.fromisoformat(earliest)
+    else:
+        tomorrow = datetime.datetime.now(ZoneInfo(timezone)).date()
+        tomorrow += datetime.timedelta(days=1)
+        window_start = datetime.datetime.combine(tomorrow, datetime.time())
+    window_end = (
+        datetime.datetime.fromisoformat(latest)
+        if latest
+        else window_start + datetime.timedelta(days=settings.CALENDAR_SLOT_WINDOW_DAYS)
+    )
+
+    calendar = get_leave_calendar()
+    return find_earliest_slot(
+        service,
+        attendees=[settings.SYSTEM_EMAIL, *attendees],
+        duration=datetime.timedelta(minutes=duration_minutes),
+        window_start=window_start,
+        window_end=window_end,
+        timezone=timezone,
+        weekmask=calendar.weekmask,
+        holidays=calendar.holiday_set,
+    )
+
+
+class FindCalendarSlotTool(BaseTool):
+    name = "calendar_slot_tool"
+    description = """useful to find the earliest time when the attendees of a calendar event are all free, within working hours. The input to this tool is a JSON with the following format:
+    {
+        attendees: list[str],
+        duration_minutes: int,
+        earliest_iso_datetime: Optional[str],  # Defaults to the next day
+        latest_iso_datetime: Optional[str],
+        timezone: Optional[str]  # Defaults to Europe/London
+    }
+    """
+    side_effect_free: bool = True
+    onboarding: bool = True
+
+    def _run(self, slot_str: str) -> str:
+        try:
+            slot_dict = json.loads(slot_str)
+        except json.JSONDecodeError:
+            return "The input is not a valid JSON"
+
+        slot = find_calendar_slot(
+            _google_service("calendar"),
+            attendees=slot_dict.get("attendees", []),
+            duration_minutes=int(slot_dict.get("duration_minutes", 60)),
+            earliest=slot_dict.get("earliest_iso_datetime"),
+            latest=slot_dict.get("latest_iso_datetime"),
+            timezone=slot_dict.get("timezone"),
+        )
+        if slot is None:
+            return "\nThe attendees have no common free slot in that period\n"
+
+        start, end = slot
+        return f"\nThe earliest common free slot is from {start.isoformat()} to {end.isoformat()} ({start.tzinfo})\n"
+
+
 class CreateCalendarEventTool(BaseTool):
     name = "calendar_event_tool"
-    description = """useful to send a slack invite to a new employee via email. The input to this tool is a JSON with the following format:
+    description = """useful to schedule a calendar event. The input to this tool is a JSON with the following format:
     {
         title: str,
-        start_iso_datetime: str,
-        end_iso_datetime: str,
+        start_iso_datetime: Optional[str],  # Omit to use the earliest time when all the attendees are free
+        end_iso_datetime: Optional[str],
+        duration_minutes: Optional[int],  # Used when start_iso_datetime is omitted, defaults to 60
         attendees: list[str],
-        timezone: Optional[str]  # Defaults to UTC
+        timezone: Optional[str]  # Defaults to Europe/London
     }
     Make sure to confirm the details of the event with the user.
     """
     callback: Callable | None = None
+    onboarding: bool = True
+    invalidates: list[str] = ["calendar_slot_tool"]
 
     def _run(self, event: str) -> str:
         try:
@@ -128,35 +203,39 @@ class CreateCalendarEventTool(BaseTool):
         except json.JSONDecodeError:
             return "The event is not a valid JSON"
 
-        service = get_google_service(
-            service_name=GoogleService.GCAL,
-            client_config=settings.GOOGLE_CLIENT_CONFIG,
-            scopes=settings.GOOGLE_SCOPES,
-        )
-
-        # Parse datetime strings into datetime objects
-        # Add a UTC to BST correction
-        event_dict["start_iso_datetime"] = datetime.datetime.fromisoformat(
-            event_dict["start_iso_datetime"]
-        ) - datetime.timedelta(hours=1)
-
-        event_dict["end_iso_datetime"] = datetime.datetime.fromisoformat(
-            event_dict["end_iso_datetime"]
-        ) - datetime.timedelta(hours=1)
+        from app.integrations.gcal import schedule_event
+
+        service = _google_service("calendar")
+        timezone = event_dict.get("timezone") or settings.CALENDAR_TIMEZONE
+
+        # Naive datetimes are wall-clock times in the event timezone
+        if event_dict.get("start_iso_datetime"):
+            start_time = event_dict["start_iso_datetime"]
+            end_time = event_dict["end_iso_datetime"]
+        else:
+            slot = find_calendar_slot(
+                service,
+                attendees=event_dict["attendees"],
+                duration_minutes=int(event_dict.get("duration_minutes", 60)),
+                timezone=timezone,
+            )
+            if slot is None:
+                return "\nThe attendees have no common free slot in the next weeks\n"
+            start_time, end_time = slot[0].isoformat(), slot[1].isoformat()
 
         event_id = schedule_event(
             service=service,
             summary=event_dict["title"],
-            start_time=event_dict["start_iso_datetime"].isoformat(),
-            end_time=event_dict["end_iso_datetime"].isoformat(),
+            start_time=start_time,
+            end_time=end_time,
             attendees=event_dict["attendees"],
-            timezone=event_dict.get("timezone", "UTC"),
+            timezone=timezone,
         )
 
         if self.callback:
             self.callback()
 
-        return f"\nA calendar event has been created with id {event_id}\n"
+        return f"\nA calendar event has been created from {start_time} to {end_time} with id {event_id}\n"
 
 
 class AddEmployeeToHRTool(BaseTool):
@@ -169,6 +248,8 @@ class AddEmployeeToHRTool(BaseTool):
     }
     """
     callback: Callable | None = None
+    onboarding: bool = True
+    invalidates: list[str] = ["find_employee_tool"]
 
     def _run(self, employee_str: str) -> str:
         try:
@@ -176,6 +257,12 @@ class AddEmployeeToHRTool(BaseTool):
         except json.JSONDecodeError:
             return "The input is not a valid JSON"
 
+        from app.integrations.bamboo.employees import add_employee
+        from app.integrations.bamboo.time_off import (
+            add_time_off_balance,
+            add_time_off_policy,
+        )
+
         first_name = employee_dict["first_name"]
         last_name = employee_dict["last_name"]
         email_address = employee_dict["email_address"]
@@ -198,20 +285,59 @@ class AddEmployeeToHRTool(BaseTool):
 
 class HRPolicyQATool(BaseTool):
     name = "HR_policy_QA_tool"
-    description = "useful to answer questions about the HR policies. The input to this tool is a string with the question."
+    description = """useful to answer questions about the HR policies. The input to this tool is a string with the question,
+    or a JSON with the keys "question" and "employee_id" when the question is about the policies applying to a specific employee.
+    """
+    side_effect_free: bool = True
+    # Tenant (legal entity) whose handbook is searched, resolved from the employee location when not set
+    tenant: str | None = None
+    # Overrides of the retrieval settings (see RetrievalOptions), also accepted per
+    # question under the "retrieval" key of a JSON input
+    retrieval: dict[str, Any] = {}
 
     def _run(self, query: str) -> str:
-        docs = FAISS_INDEX.similarity_search("what is the holiday policy?", k=5)
-        clean_docs = [doc.page_content for doc in docs]
+        from langchain.chat_models import ChatOpenAI
+
+        from app.agent.callbacks import OPENAI_RATE_LIMIT_HANDLER
+        from app.integrations.bamboo.employees import get_employee
+        from app.integrations.chunking import pack_context
+        from app.integrations.policies import get_policy_index
+        from app.integrations.rerank import RetrievalOptions, retrieve
 
-        llm = ChatOpenAI(temperature=0.1, model=settings.OPENAI_MODEL)
+        location = None
+        retrieval = dict(self.retrieval)
+        try:
+            parsed = json.loads(query)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict):
+            query = parsed.get("question", query)
+            retrieval.update(parsed.get("retrieval") or {})
+            if parsed.get("employee_id") and self.tenant is None:
+                try:
+                    location = get_employee(
+                        str(parsed["employee_id"]), fields=["location"]
+                    ).get("location")
+                except Exception:
+                    # Unknown employee, answer with the default handbook
+                    location = None
+
+        index = get_policy_index(tenant=self.tenant, location=location)
+        docs = retrieve(index, query, RetrievalOptions.from_dict(retrieval))
+        context = pack_context(docs)
+
+        llm = ChatOpenAI(
+            temperature=0.1,
+            model=settings.OPENAI_MODEL,
+            callbacks=[OPENAI_RATE_LIMIT_HANDLER],
+        )
 
         result = llm.predict(
             f"""You are a helpful question-answering assistant. You are asked the following question:\n\n
             "{query}"\n
 
             You have to answer the question. You can use the following information:\n\n
-            {clean_docs}\n
+            {context}\n
 
             Answer:"
             """
@@ -230,6 +356,7 @@ class ModifyEmployeeTool(BaseTool):
         email_address: Optional[str],
     }
     """
+    invalidates: list[str] = ["view_employee_tool", "find_employee_tool"]
 
     def _run(self, employee_str: str) -> str:
         try:
@@ -237,16 +364,76 @@ class ModifyEmployeeTool(BaseTool):
         except json.JSONDecodeError:
             return "The input is not a valid JSON"
 
+        from app.integrations.bamboo.employees import edit_employee
+
         edit_employee(**employee_dict)
 
         return f"\nEmployee {employee_dict['employee_id']} has been modified successfully\n"
 
 
+class ViewEmployeeTool(BaseTool):
+    name = "view_employee_tool"
+    description = """useful to view the profile of an employee: name, emails, job title, department, location, hire date and manager. The input to this tool is the employee_id of the employee to view."""
+    side_effect_free: bool = True
+
+    def _run(self, employee_id: str) -> str:
+        from app.integrations.bamboo.directory import MIRROR_FIELDS
+        from app.integrations.bamboo.employees import get_employee
+
+        employee = get_employee(employee_id.strip(), fields=MIRROR_FIELDS)
+        profile = "\n".join(
+            f"{field}: {value}"
+            for field, value in employee.items()
+            if value not in (None, "")
+        )
+        return f"\nProfile of employee {employee_id}:\n{profile}\n"
+
+
+class FindEmployeeTool(BaseTool):
+    name = "find_employee_tool"
+    description = """useful to find the employee_id of a person from their name, part of it, or their email, instead of asking the user for the employee_id. The input to this tool is a string with the name or the email."""
+    side_effect_free: bool = True
+
+    def _run(self, query: str) -> str:
+        from app.integrations.bamboo.lookup import get_employee_lookup
+
+        lookup = get_employee_lookup()
+        matches = lookup.search(query.strip().strip('"'))
+        if not matches:
+            return f"\nNo employee matches {query}\n"
+
+        lines = []
+        for employee_id, score in matches:
+            employee = lookup.employees[employee_id]
+            manager = employee.get("supervisorEId")
+            details = ", ".join(
+                str(value)
+                for value in (
+                    employee.get("jobTitle"),
+                    employee.get("department"),
+                    employee.get("workEmail") or employee.get("homeEmail"),
+                    f"manager employee_id {manager}" if manager else None,
+                    employee.get("status")
+                    if employee.get("status") == "Inactive"
+                    else None,
+                )
+                if value
+            )
+            lines.append(
+                f"{employee.get('firstName', '')} {employee.get('lastName', '')} (employee_id {employee_id}, match {score}): {details}"
+            )
+        matches_str = "\n".join(lines)
+        return f"\nEmployees matching {query}:\n{matches_str}\n"
+
+
 class ViewTimeOffRequestsTool(BaseTool):
     name = "view_time_off_requests_tool"
     description = """useful to view all time off requests for an employee. The input to this tool is the employee_id of the employee to view."""
+    side_effect_free: bool = True
 
     def _run(self, employee_id: str) -> str:
+        from app.integrations.bamboo.time_off import get_time_off_requests
+
         return f"\nTime off requests for employee {employee_id}:\n{get_time_off_requests(employee_id)}\n"
 
 
@@ -259,13 +446,31 @@ class MakeTimeOffRequestTool(BaseTool):
         end_date: str,  # Format YYYY-MM-DD
     }
     """
+    invalidates: list[str] = [
+        "view_time_off_requests_tool",
+        "estimate_time_off_balance_tool",
+        "whos_out_tool",
+    ]
 
     def _run(self, time_off_request_str: str) -> str:
         try:
             time_off_request_dict = json.loads(time_off_request_str)
         except json.JSONDecodeError:
             return "The input is not a valid JSON"
+
+        from app.integrations.bamboo.absences import invalidate_absence_index
+        from app.integrations.bamboo.projection import invalidate_opening_balances
+        from app.integrations.bamboo.time_off import add_time_off_request
+        from app.integrations.bamboo.validation import validate_time_off_request
+
+        # Reject invalid requests locally before writing to the HR system
+        error = validate_time_off_request(**time_off_request_dict)
+        if error:
+            return f"\nThe time off request was not made: {error}\n"
+
         request_id = add_time_off_request(**time_off_request_dict)
+        invalidate_absence_index()
+        invalidate_opening_balances(time_off_request_dict["employee_id"])
 
         return f"\nTime off request with id {request_id} for employee {time_off_request_dict['employee_id']} has been made successfully\n"
 
@@ -273,9 +478,22 @@ class MakeTimeOffRequestTool(BaseTool):
 class CancelTimeOffRequestTool(BaseTool):
     name = "cancel_time_off_request_tool"
     description = """useful to cancel a time off request. The input to this tool is the request_id of the request to cancel."""
+    invalidates: list[str] = [
+        "view_time_off_requests_tool",
+        "estimate_time_off_balance_tool",
+        "whos_out_tool",
+    ]
+    # The input is a request ID, which does not tell whose entries are stale
+    invalidates_by_employee: bool = False
 
     def _run(self, request_id: str) -> str:
+        from app.integrations.bamboo.absences import invalidate_absence_index
+        from app.integrations.bamboo.projection import invalidate_opening_balances
+        from app.integrations.bamboo.time_off import cancel_time_off_request
+
         cancel_time_off_request(request_id=request_id)
+        invalidate_absence_index()
+        invalidate_opening_balances()
         return (
             f"\nTime off request with id {request_id} has been cancelled successfully\n"
         )
@@ -283,16 +501,80 @@ class CancelTimeOffRequestTool(BaseTool):
 
 class EstimateTimeOffBalanceTool(BaseTool):
     name = "estimate_time_off_balance_tool"
-    description = "useful to estimate the time off balance for an employee. The input to this tool is the employee_id of the employee to view."
+    description = "useful to estimate the time off balance for an employee, or for several at once (e.g. a team). The input to this tool is the employee_id of the employee to view, or a comma-separated list of employee_ids."
+    side_effect_free: bool = True
 
-    def _run(self, employee_id: str) -> str:
-        end_date = (datetime.date.today() + datetime.timedelta(days=365)).strftime(
-            "%Y-%m-%d"
+    def _run(self, employee_ids_str: str) -> str:
+        from app.integrations.bamboo.projection import estimate_balances
+
+        employee_ids = list(
+            dict.fromkeys(e.strip() for e in employee_ids_str.split(",") if e.strip())
         )
-        future_balance = get_time_off_balance_estimate(
-            employee_id=employee_id, end_date=end_date
+        if not employee_ids:
+            return "The input must be an employee_id or a comma-separated list of them"
+
+        # Projected from the balance BambooHR holds today, with the carryover and
+        # adjustments, minus the scheduled requests. Requests next year draw on
+        # the grant of that year
+        today = datetime.date.today()
+        year_end = today.replace(month=12, day=31).strftime("%Y-%m-%d")
+        end_date = (today + datetime.timedelta(days=365)).strftime("%Y-%m-%d")
+        today_str = today.strftime("%Y-%m-%d")
+
+        balances = estimate_balances(employee_ids, [today_str, year_end, end_date])
+        return "".join(
+            f"\nTime off balance for employee {employee_id}:\n"
+            + str(
+                {
+                    "unit": "hours",
+                    "balanceToday": balances[employee_id][today_str],
+                    "balanceAtEndOfYear": balances[employee_id][year_end],
+                    "balanceAfterScheduledRequests": balances[employee_id][end_date],
+                }
+            )
+            + "\n"
+            for employee_id in employee_ids
         )
-        return f"\nTime off balance for employee {employee_id}:\n{future_balance}\n"
+
+
+class WhosOutTool(BaseTool):
+    name = "whos_out_tool"
+    description = """useful to find out who is off work between two dates and the maximum number of people off at the same time in each team. The input to this tool is a JSON with the following format:
+    {
+        start_date: str,  # Format YYYY-MM-DD
+        end_date: str,  # Format YYYY-MM-DD
+    }
+    """
+    side_effect_free: bool = True
+
+    def _run(self, date_range_str: str) -> str:
+        try:
+            date_range_dict = json.loads(date_range_str)
+        except json.JSONDecodeError:
+            return "The input is not a valid JSON"
+
+        from app.integrations.bamboo.absences import get_absence_index
+
+        start_date = date_range_dict["start_date"]
+        end_date = date_range_dict["end_date"]
+        index = get_absence_index(start_date, end_date)
+
+        absences = [
+            f"{request.get('name', request['employeeId'])} (employee_id {request['employeeId']}): {request['start']} to {request['end']}"
+            for request in index.overlapping(start_date, end_date)
+        ]
+        if not absences:
+            return f"\nNobody is off between {start_date} and {end_date}\n"
+
+        peaks = [
+            f"{team}: {count} at once (first on {date})"
+            for team, (count, date) in index.max_concurrent_absences(
+                start_date, end_date
+            ).items()
+        ]
+        absences_str = "\n".join(absences)
+        peaks_str = "\n".join(peaks)
+        return f"\nPeople off between {start_date} and {end_date}:\n{absences_str}\n\nMaximum concurrent absences per team:\n{peaks_str}\n"
 
 
 def get_all_tools() -> list[BaseTool]:
@@ -301,14 +583,18 @@ def get_all_tools() -> list[BaseTool]:
         WelcomeEmailTool(),  # type: ignore
         HRPolicyEmailTool(),  # type: ignore
         SlackInviteTool(),  # type: ignore
+        FindCalendarSlotTool(),  # type: ignore
         CreateCalendarEventTool(),  # type: ignore
         HRPolicyQATool(),  # type: ignore
         AddEmployeeToHRTool(),  # type: ignore
         ModifyEmployeeTool(),  # type: ignore
+        ViewEmployeeTool(),  # type: ignore
+        FindEmployeeTool(),  # type: ignore
         ViewTimeOffRequestsTool(),  # type: ignore
         MakeTimeOffRequestTool(),  # type: ignore
         CancelTimeOffRequestTool(),  # type: ignore
         EstimateTimeOffBalanceTool(),  # type: ignore
+        WhosOutTool(),  # type: ignore
     ]
 
 
@@ -326,6 +612,6 @@ def get_all_tools() -> list[BaseTool]:
 
 # ViewTimeOffRequestsTool()._run(employee_id="215")
 
-# EstimateTimeOffBalanceTool()._run(employee_id="215")
+# EstimateTimeOffBalanceTool()._run(employee_ids_str="215,216")
 
 # CancelTimeOffRequestTool()._run(request_id="1650")
@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+
+class CassetteMiss(Exception):
+    """Raised when a replayed session makes a call that was not recorded."""
+
+
+@dataclass
+class Interaction:
+    """One recorded exchange with an upstream.
+
+    Attributes:
+        kind (str): upstream, e.g. "openai.chat", "bamboo" or "google"
+        key (str): request signature used to match replayed calls
+        response (Any): JSON-serialisable response
+        latency (float): seconds the upstream took to answer
+    """
+
+    kind: str
+    key: str
+    response: Any
+    latency: float
+    used: bool = field(default=False, compare=False)
+
+
+class Cassette:
+    """Recorded upstream exchanges of a session, stored as a JSON file.
+
+    While replaying, a call is answered with the first unused interaction of
+    the same kind and key. When `strict` is False and no key matches (e.g. the
+    prompt contains today's date, or concurrent tools ran in another order),
+    it falls back to the next unused interaction of the same kind.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        latency: str | float = "none",
+        strict: bool = False,
+    ) -> None:
+        """
+        Args:
+            path (str | Path): JSON file of the cassette
+            latency (str | float, optional): replay latency, "none", "recorded" or a fixed number of seconds. Defaults to "none".
+            strict (bool, optional): only replay interactions whose key matches. Defaults to False.
+        """
+        self.path = Path(path)
+        self.latency = latency
+        self.strict = strict
+        self.interactions: list[Interaction] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls, path: str | Path, latency: str | float = "none", strict: bool = False
+    ) -> "Cassette":
+        cassette = cls(path, latency=latency, strict=strict)
+        with open(cassette.path, encoding="utf-8") as handle:
+            cassette.interactions = [
+                Interaction(**interaction) for interaction in json.load(handle)
+            ]
+        return cassette
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as handle:
+            json.dump(
+                [
+                    {k: v for k, v in asdict(i).items() if k != "used"}
+                    for i in self.interactions
+                ],
+                handle,
+                indent=1,
+            )
+
+    def record(self, kind: str, key: str, response: Any, latency: float) -> None:
+        with self._lock:
+            self.interactions.append(Interaction(kind, key, response, latency))
+
+    def play(self, kind: str, key: str) -> Any:
+        """
+        Gets the recorded response of a call, sleeping for the configured latency
+
+        Args:
+            kind (str): upstream of the call
+            key (str): request signature
+
+        Raises:
+            CassetteMiss: if there is no unused matching interaction
+
+        Returns:
+            Any: the recorded response
+        """
+        with self._lock:
+            candidates = [i for i in self.interactions if i.kind == kind and not i.used]
+            match = next((i for i in candidates if i.key == key), None)
+            if match is None and not self.strict and candidates:
+                match = candidates[0]
+            if match is None:
+                raise CassetteMiss(f"No recorded {kind} interaction for {key[:200]}")
+            match.used = True
+
+        if self.latency == "recorded":
+            time.sleep(match.latency)
+        elif not isinstance(self.latency, str):
+            time.sleep(float(self.latency))
+        return match.response
+
+    def unused(self) -> list[Interaction]:
+        return [i for i in self.interactions if not i.used]
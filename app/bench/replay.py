@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Iterator
+from unittest import mock
+
+# Missing typed stubs
+import httplib2  # type: ignore
+import openai
+import requests
+from google_auth_httplib2 import AuthorizedHttp  # type: ignore
+from requests.structures import CaseInsensitiveDict
+
+from app.bench.cassette import Cassette
+from app.config import settings
+from app.integrations import google_auth
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+def _openai_key(kwargs: dict[str, Any]) -> str:
+    keys = ("model", "messages", "input", "stop")
+    return json.dumps({k: kwargs.get(k) for k in keys}, sort_keys=True, default=str)
+
+
+def _openai_handler(
+    cassette: Cassette, mode: str, kind: str, create: Callable[..., Any]
+) -> Callable[..., Any]:
+    """Replacement for the `create` method of an OpenAI API resource."""
+
+    def handler(**kwargs: Any) -> Any:
+        key = _openai_key(kwargs)
+        if mode == REPLAY:
+            response = cassette.play(kind, key)
+            return iter(response["stream"]) if kwargs.get("stream") else response
+
+        start = time.perf_counter()
+        response = create(**kwargs)
+        if kwargs.get("stream"):
+            chunks = [chunk.to_dict_recursive() for chunk in response]
+            recorded: Any = {"stream": chunks}
+            response = iter(chunks)
+        else:
+            recorded = response.to_dict_recursive()
+        cassette.record(kind, key, recorded, time.perf_counter() - start)
+        return response
+
+    return handler
+
+
+def _requests_handler(
+    cassette: Cassette, mode: str, request: Callable[..., Any]
+) -> Callable[..., Any]:
+    """Replacement for `requests.request`, used by `send_bamboo_request`."""
+
+    def handler(method: str, url: str, **kwargs: Any) -> Any:
+        path = url.replace(settings.BAMBOO_HR_BASE_URL, "")
+        key = json.dumps([method, path, kwargs.get("json")], default=str)
+        if mode == REPLAY:
+            recorded = cassette.play("bamboo", key)
+            response = requests.Response()
+            response.status_code = recorded["status_code"]
+            response.headers = CaseInsensitiveDict(recorded["headers"])
+            response._content = recorded["text"].encode()
+            response.encoding = "utf-8"
+            response.url = url
+            return response
+
+        start = time.perf_counter()
+        response = request(method, url, **kwargs)
+        cassette.record(
+            "bamboo",
+            key,
+            {
+                "status_code": response.status_code,
+                "headers": dict(response.headers),
+                "text": response.text,
+            },
+            time.perf_counter() - start,
+        )
+        return response
+
+    return handler
+
+
+class CassetteHttp:
+    """httplib2-compatible transport for the Google API client. Wraps an
+    authorized transport while recording, and stands in for it when replaying."""
+
+    def __init__(self, cassette: Cassette, http: Any = None) -> None:
+        self.cassette = cassette
+        self.http = http
+
+    def request(
+        self,
+        uri: str,
+        method: str = "GET",
+        body: Any = None,
+        headers: Any = None,
+        **kwargs: Any,
+    ) -> tuple[Any, bytes]:
+        # Bodies carry random MIME boundaries, so only the endpoint is matched
+        key = f"{method} {uri.split('?')[0]}"
+        if self.http is None:
+            recorded = self.cassette.play("google", key)
+            return httplib2.Response(recorded["headers"]), recorded["content"].encode()
+
+        start = time.perf_counter()
+        response, content = self.http.request(
+            uri, method=method, body=body, headers=headers, **kwargs
+        )
+        self.cassette.record(
+            "google",
+            key,
+            {
+                "headers": {**dict(response), "status": str(response.status)},
+                "content": content.decode("utf-8", "replace"),
+            },
+            time.perf_counter() - start,
+        )
+        return response, content
+
+
+def _google_build_handler(
+    cassette: Cassette, mode: str, build: Callable[..., Any]
+) -> Callable[..., Any]:
+    """Replacement for `googleapiclient.discovery.build` in `google_auth`."""
+
+    def handler(service_name: str, version: str, **kwargs: Any) -> Any:
+        credentials = kwargs.pop("credentials", None)
+        inner = None
+        if mode == RECORD:
+            inner = AuthorizedHttp(credentials, http=httplib2.Http())
+        return build(
+            service_name, version, http=CassetteHttp(cassette, inner), **kwargs
+        )
+
+    return handler
+
+
+@contextmanager
+def use_cassette(cassette: Cassette, mode: str) -> Iterator[Cassette]:
+    """
+    Routes the OpenAI, BambooHR and Google traffic of the process through a
+    cassette: real calls are recorded in `record` mode, and answered from the
+    cassette without any network access in `replay` mode.
+
+    Args:
+        cassette (Cassette): the cassette to record to or replay from
+        mode (str): "record" or "replay"
+
+    Yields:
+        Iterator[Cassette]: the cassette, saved on exit when recording
+    """
+    if mode not in (RECORD, REPLAY):
+        raise ValueError(f"Unknown cassette mode {mode}")
+
+    with ExitStack() as stack:
+        for resource, kind in (
+            (openai.ChatCompletion, "openai.chat"),
+            (openai.Embedding, "openai.embedding"),
+        ):
+            handler = _openai_handler(cassette, mode, kind, resource.create)
+            stack.enter_context(mock.patch.object(resource, "create", handler))
+
+        stack.enter_context(
+            mock.patch.object(
+                requests, "request", _requests_handler(cassette, mode, requests.request)
+            )
+        )
+        stack.enter_context(
+            mock.patch.object(
+                google_auth,
+                "build",
+                _google_build_handler(cassette, mode, google_auth.build),
+            )
+        )
+
+        if mode == REPLAY:
+            # No credentials are needed to replay, but the clients insist on having some
+            replay_credentials = object()
+            stack.enter_context(
+                mock.patch.object(
+                    google_auth.CREDENTIAL_STORE,
+                    "get_credentials",
+                    lambda *args, **kwargs: replay_credentials,
+                )
+            )
+            stack.enter_context(
+                mock.patch.dict(
+                    os.environ,
+                    {"OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "replay"},
+                )
+            )
+
+        yield cassette
+
+    if mode == RECORD:
+        cassette.save()
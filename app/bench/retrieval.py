@@ -0,0 +1,180 @@
+"""Benchmark of the policy retrieval re-ranking stage.
+
+Compares plain similarity search with the keyword re-scoring and the maximal
+marginal relevance selection on labelled questions: share of the expected
+handbook phrases retrieved, redundancy of the results and re-ranking latency.
+The question embeddings are recorded once and replayed offline:
+
+    python -m app.bench.retrieval --mode record
+    python -m app.bench.retrieval --mode replay
+
+`--synthetic` uses the opening words of indexed chunks as questions and their
+vectors as embeddings, which needs neither OpenAI nor a cassette.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import yaml
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.vectorstores import FAISS
+
+from app.bench.cassette import Cassette
+from app.bench.replay import REPLAY, use_cassette
+from app.config import settings
+from app.integrations.chunking import normalise_text
+from app.integrations.faiss import CompressedFAISS, build_index
+from app.integrations.rerank import RetrievalOptions, retrieve, search_candidates
+
+QUESTIONS_PATH = Path("./app/bench/questions/policies.yaml")
+CASSETTE_PATH = Path("./app/bench/cassettes/retrieval.json")
+
+CONFIGURATIONS: dict[str, dict[str, Any]] = {
+    "similarity": {"mmr_lambda": None, "lexical_weight": 0.0},
+    "lexical": {"mmr_lambda": None},
+    "mmr": {"lexical_weight": 0.0},
+    "mmr+lexical": {},
+}
+
+
+def load_questions(path: Path) -> list[dict[str, Any]]:
+    with open(path, encoding="utf-8") as handle:
+        return yaml.safe_load(handle)
+
+
+def embed_questions(
+    questions: list[dict[str, Any]], mode: str, cassette_path: Path
+) -> np.ndarray:
+    """Embeds the questions with OpenAI, through a recorded cassette."""
+    if mode == REPLAY:
+        cassette = Cassette.load(cassette_path)
+    else:
+        cassette = Cassette(cassette_path)
+    with use_cassette(cassette, mode):
+        vectors = OpenAIEmbeddings().embed_documents(
+            [question["question"] for question in questions]
+        )
+    return np.array(vectors, dtype=np.float32)
+
+
+def synthetic_questions(
+    index: FAISS | CompressedFAISS, n: int
+) -> tuple[list[dict[str, Any]], np.ndarray]:
+    """Opening words of evenly spread chunks, paired with the chunk vectors."""
+    if isinstance(index, CompressedFAISS):
+        documents, vectors = index.documents, np.asarray(index.vectors)
+    else:
+        vectors = index.index.reconstruct_n(0, index.index.ntotal)
+        documents = [
+            index.docstore.search(index.index_to_docstore_id[i])
+            for i in range(len(vectors))
+        ]
+
+    positions = np.linspace(0, len(documents) - 1, min(n, len(documents))).astype(int)
+    questions = []
+    for position in positions:
+        words = normalise_text(documents[position].page_content).split()
+        questions.append(
+            {"question": " ".join(words[:12]), "expected": [" ".join(words[:6])]}
+        )
+    return questions, vectors[positions]
+
+
+def redundancy(vectors: np.ndarray) -> float:
+    """Mean cosine similarity between the pairs of retrieved chunks."""
+    if len(vectors) < 2:
+        return 0.0
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarity = unit @ unit.T
+    return float(similarity[np.triu_indices(len(vectors), k=1)].mean())
+
+
+def benchmark_configuration(
+    index: FAISS | CompressedFAISS,
+    questions: list[dict[str, Any]],
+    vectors: np.ndarray,
+    options: RetrievalOptions,
+) -> dict[str, float]:
+    recalls, hits, redundancies, pages, latencies = [], [], [], [], []
+    for question, vector in zip(questions, vectors):
+        start = time.perf_counter()
+        documents = retrieve(index, question["question"], options, vector=vector)
+        latencies.append(time.perf_counter() - start)
+
+        texts = [normalise_text(doc.page_content).lower() for doc in documents]
+        found = [
+            any(phrase.lower() in text for text in texts)
+            for phrase in question["expected"]
+        ]
+        recalls.append(sum(found) / len(found))
+        hits.append(float(any(found)))
+        pages.append(len({doc.metadata.get("page") for doc in documents}))
+
+        # Vectors of the retrieved chunks, looked up among the fetched candidates
+        candidates, candidate_vectors = search_candidates(
+            index, vector, max(options.fetch_k, options.k)
+        )
+        rows = [candidates.index(doc) for doc in documents]
+        redundancies.append(redundancy(candidate_vectors[rows]))
+
+    return {
+        "phrase_recall": statistics.mean(recalls),
+        "hit_rate": statistics.mean(hits),
+        "redundancy": statistics.mean(redundancies),
+        "distinct_pages": statistics.mean(pages),
+        "latency_ms": 1000 * statistics.mean(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["record", "replay"], default=REPLAY)
+    parser.add_argument("--synthetic", action="store_true")
+    parser.add_argument("--n-synthetic", type=int, default=30)
+    parser.add_argument("--questions", type=Path, default=QUESTIONS_PATH)
+    parser.add_argument("--cassette", type=Path, default=CASSETTE_PATH)
+    parser.add_argument(
+        "--pdf", default=settings.POLICY_DOCUMENTS[settings.DEFAULT_POLICY_TENANT]
+    )
+    parser.add_argument("--k", type=int, default=settings.RETRIEVAL_K)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    index = build_index(args.pdf)
+    if args.synthetic:
+        questions, vectors = synthetic_questions(index, args.n_synthetic)
+    else:
+        if args.mode == REPLAY and not args.cassette.exists():
+            sys.exit(
+                f"No cassette at {args.cassette}, record it with --mode record "
+                "or use --synthetic"
+            )
+        questions = load_questions(args.questions)
+        vectors = embed_questions(questions, args.mode, args.cassette)
+
+    results = {
+        name: benchmark_configuration(
+            index,
+            questions,
+            vectors,
+            RetrievalOptions.from_dict({"k": args.k, **overrides}),
+        )
+        for name, overrides in CONFIGURATIONS.items()
+    }
+    baseline = results["similarity"]["latency_ms"]
+    for result in results.values():
+        result["latency_overhead_ms"] = result["latency_ms"] - baseline
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
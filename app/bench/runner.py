@@ -0,0 +1,190 @@
+"""Offline end-to-end benchmark of the agent loop.
+
+Record the cassettes once against the live APIs:
+
+    python -m app.bench.runner --mode record
+
+then replay them deterministically, e.g. in CI:
+
+    python -m app.bench.runner --mode replay --latency recorded
+"""
+import argparse
+import json
+import statistics
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+import yaml
+from langchain.callbacks import get_openai_callback
+
+from app.agent.cache import ToolCache
+from app.agent.executor import INIT_MESSAGE, init_agent_executor
+from app.agent.tool_selection import ToolSelector
+from app.agent.tools import get_all_tools
+from app.bench.cassette import Cassette
+from app.bench.replay import REPLAY, use_cassette
+from app.integrations.bamboo.absences import invalidate_absence_index
+from app.integrations.bamboo.projection import invalidate_opening_balances
+
+CORPUS_DIR = Path("./app/bench/corpus")
+CASSETTES_DIR = Path("./app/bench/cassettes")
+
+
+@dataclass
+class TurnResult:
+    conversation: str
+    turn: int
+    latency: float
+    steps: int
+    prompt_tokens: int
+    completion_tokens: int
+
+
+def load_conversation(path: Path) -> dict[str, Any]:
+    """
+    Loads a scripted conversation
+
+    Args:
+        path (Path): YAML file with a `name` and the list of user `turns`
+
+    Returns:
+        dict[str, Any]: the conversation
+    """
+    with open(path, encoding="utf-8") as handle:
+        return yaml.safe_load(handle)
+
+
+def run_conversation(
+    conversation: dict[str, Any], select_tools: bool = False
+) -> list[TurnResult]:
+    """
+    Plays the user turns of a conversation through a fresh agent session
+
+    Args:
+        conversation (dict[str, Any]): scripted conversation
+        select_tools (bool, optional): only describe the relevant tools in the prompt. Defaults to False.
+
+    Returns:
+        list[TurnResult]: latency, steps and token usage of each turn
+    """
+    # Process-wide caches would leak state between conversations
+    invalidate_absence_index()
+    invalidate_opening_balances()
+    tools = get_all_tools()
+    agent_executor = init_agent_executor(
+        tools,
+        tool_cache=ToolCache(),
+        tool_selector=ToolSelector(tools) if select_tools else None,
+    )
+    chat_history = [{"role": "assistant", "content": INIT_MESSAGE}]
+
+    results = []
+    for turn, user_input in enumerate(conversation["turns"]):
+        with get_openai_callback() as usage:
+            start = time.perf_counter()
+            result = agent_executor.invoke(
+                {"input": user_input, "chat_history": chat_history}
+            )
+            latency = time.perf_counter() - start
+
+        chat_history.append({"role": "user", "content": user_input})
+        chat_history.append({"role": "assistant", "content": result["output"]})
+        results.append(
+            TurnResult(
+                conversation=conversation["name"],
+                turn=turn,
+                latency=latency,
+                steps=len(result["intermediate_steps"]),
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+            )
+        )
+    return results
+
+
+def summarise(results: list[TurnResult]) -> dict[str, float]:
+    """
+    Aggregates the turn results of a benchmark run
+
+    Args:
+        results (list[TurnResult])
+
+    Returns:
+        dict[str, float]: latency percentiles, mean steps and token totals
+    """
+    latencies = sorted(r.latency for r in results)
+    return {
+        "turns": len(results),
+        "latency_p50": statistics.median(latencies),
+        "latency_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "latency_total": sum(latencies),
+        "steps_mean": statistics.mean(r.steps for r in results),
+        "prompt_tokens": sum(r.prompt_tokens for r in results),
+        "completion_tokens": sum(r.completion_tokens for r in results),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["record", "replay"], default=REPLAY)
+    parser.add_argument(
+        "--latency",
+        default="none",
+        help='replay latency: "none", "recorded" or a fixed number of seconds per call',
+    )
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--cassettes", type=Path, default=CASSETTES_DIR)
+    parser.add_argument(
+        "--select-tools",
+        action="store_true",
+        help="only describe the relevant tools in the prompt, record with the same flag",
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    latency = args.latency
+    if latency not in ("none", "recorded"):
+        latency = float(latency)
+
+    results: list[TurnResult] = []
+    for path in sorted(args.corpus.glob("*.yaml")):
+        conversation = load_conversation(path)
+        cassette_path = args.cassettes / f"{path.stem}.json"
+        if args.mode == REPLAY:
+            if not cassette_path.exists():
+                print(f"Skipping {path.stem}: no cassette at {cassette_path}")
+                continue
+            cassette = Cassette.load(cassette_path, latency=latency)
+        else:
+            cassette = Cassette(cassette_path)
+
+        with use_cassette(cassette, args.mode):
+            conversation_results = run_conversation(conversation, args.select_tools)
+        results.extend(conversation_results)
+
+        for r in conversation_results:
+            print(
+                f"{r.conversation} #{r.turn}: {r.latency:.2f}s, {r.steps} steps, "
+                f"{r.prompt_tokens} prompt + {r.completion_tokens} completion tokens"
+            )
+        if args.mode == REPLAY and cassette.unused():
+            print(f"Warning: {len(cassette.unused())} recorded calls were not replayed")
+
+    if not results:
+        return
+
+    summary = summarise(results)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(
+                {"summary": summary, "turns": [asdict(r) for r in results]},
+                handle,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
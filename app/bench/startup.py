@@ -0,0 +1,158 @@
+"""Cold start benchmark of the Streamlit app.
+
+Measures the import time of `app.main` per module with `python -X importtime`,
+and the time to the first render of the app in a fresh interpreter:
+
+    python -m app.bench.startup --repeat 5 --max-import 1.5 --max-render 3
+
+Exits with a non-zero status when a budget is exceeded, so it can gate CI.
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+APP_MODULE = "app.main"
+APP_SCRIPT = "app/main.py"
+
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+RENDER_SCRIPT = """
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({script!r}, default_timeout=60)
+app.run()
+if app.exception:
+    raise SystemExit(str(app.exception[0].value))
+print(time.perf_counter() - start)
+"""
+
+
+@dataclass
+class ModuleImport:
+    module: str
+    self_time: float
+    cumulative_time: float
+    depth: int
+
+
+def parse_importtime(output: str) -> list[ModuleImport]:
+    """
+    Parses the report of `python -X importtime`
+
+    Args:
+        output (str): stderr of the interpreter
+
+    Returns:
+        list[ModuleImport]: modules in import order, times in seconds
+    """
+    imports = []
+    for match in IMPORTTIME_PATTERN.finditer(output):
+        self_us, cumulative_us, indent, module = match.groups()
+        imports.append(
+            ModuleImport(
+                module=module,
+                self_time=int(self_us) / 1e6,
+                cumulative_time=int(cumulative_us) / 1e6,
+                depth=len(indent) // 2,
+            )
+        )
+    return imports
+
+
+def measure_import(module: str = APP_MODULE) -> list[ModuleImport]:
+    """Imports a module in a fresh interpreter, timing every module it pulls in."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(process.stderr)
+
+
+def measure_first_render(script: str = APP_SCRIPT) -> float:
+    """Seconds from a fresh interpreter to the first complete run of the app script."""
+    process = subprocess.run(
+        [sys.executable, "-c", RENDER_SCRIPT.format(script=script)],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise Exception(f"The app failed to render: {process.stderr.strip()}")
+    return float(process.stdout.strip().splitlines()[-1])
+
+
+def top_level_packages(imports: list[ModuleImport]) -> dict[str, float]:
+    """Cumulative import time of each top-level package, slowest first."""
+    totals: dict[str, float] = {}
+    for item in imports:
+        if item.depth == 1 or (item.depth == 0 and item.module != APP_MODULE):
+            package = item.module.split(".")[0]
+            totals[package] = totals.get(package, 0) + item.cumulative_time
+    return dict(sorted(totals.items(), key=lambda kv: kv[1], reverse=True))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules shown")
+    parser.add_argument("--max-import", type=float, help="budget in seconds")
+    parser.add_argument("--max-render", type=float, help="budget in seconds")
+    parser.add_argument("--skip-render", action="store_true")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    import_times, render_times = [], []
+    imports: list[ModuleImport] = []
+    for _ in range(args.repeat):
+        imports = measure_import()
+        import_times.append(
+            next(i.cumulative_time for i in imports if i.module == APP_MODULE)
+        )
+        if not args.skip_render:
+            render_times.append(measure_first_render())
+
+    print(f"Slowest modules imported by {APP_MODULE} (last run, self time):")
+    for item in sorted(imports, key=lambda i: i.self_time, reverse=True)[: args.top]:
+        print(f"  {item.self_time * 1000:8.1f}ms  {item.module}")
+    print("Slowest packages (cumulative):")
+    for package, seconds in list(top_level_packages(imports).items())[: args.top]:
+        print(f"  {seconds * 1000:8.1f}ms  {package}")
+
+    summary = {"import_median": statistics.median(import_times)}
+    if render_times:
+        summary["first_render_median"] = statistics.median(render_times)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(
+                {
+                    "summary": summary,
+                    "import_times": import_times,
+                    "render_times": render_times,
+                },
+                handle,
+                indent=2,
+            )
+
+    failures = []
+    if args.max_import is not None and summary["import_median"] > args.max_import:
+        failures.append(f"import took {summary['import_median']:.2f}s")
+    if (
+        args.max_render is not None
+        and render_times
+        and summary["first_render_median"] > args.max_render
+    ):
+        failures.append(f"first render took {summary['first_render_median']:.2f}s")
+    if failures:
+        sys.exit("Startup budget exceeded: " + ", ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
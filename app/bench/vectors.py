@@ -0,0 +1,208 @@
+"""Benchmark of the compressed policy index storages.
+
+Compares the float16, 8-bit and product-quantized indexes with the exact
+float32 search of the policy index, on the recall of its top results and on
+the resident memory per indexed document, and fails when a storage recalls
+less than --min-recall (0.95 by default) of the exact results:
+
+    python -m app.bench.vectors --k 5 --synthetic-documents 5000
+
+Queries are mixtures of indexed chunks by default, so no API call is made.
+`--queries` takes a text file with one question per line, embedded with OpenAI.
+
+The handbook only has a few dozen chunks, so re-ranking k * rerank_factor
+candidates is close to an exhaustive search and its recall says little about
+the compression. `--synthetic-documents` benchmarks a corpus of clustered random
+vectors of that size instead, and each result reports the fraction of the
+corpus re-ranked.
+"""
+import argparse
+import json
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain.embeddings import FakeEmbeddings
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.vectorstores import FAISS
+
+from app.config import settings
+from app.integrations.faiss import FLOAT16, FLOAT32, PQ, SQ8, CompressedFAISS
+
+INDEX_PATH = Path("./assets/HR_policies.pickle")
+# Dimension of the OpenAI embeddings
+EMBEDDING_DIMENSION = 1536
+# Results re-ranking more of the corpus than this say little about the storage
+MAX_CANDIDATE_FRACTION = 0.25
+
+
+def synthetic_store(
+    n_documents: int,
+    dimension: int = EMBEDDING_DIMENSION,
+    n_clusters: int = 64,
+    seed: int = 0,
+) -> FAISS:
+    """Store of clustered random unit vectors, standing in for a large handbook."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dimension))
+    vectors = centres[rng.integers(0, n_clusters, size=n_documents)]
+    vectors += rng.normal(scale=0.5, size=vectors.shape)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return FAISS.from_embeddings(
+        [(f"chunk {i}", vector.tolist()) for i, vector in enumerate(vectors)],
+        FakeEmbeddings(size=dimension),
+    )
+
+
+def synthetic_queries(vectors: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    """Normalised sums of two random indexed vectors, slightly perturbed."""
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(vectors), size=(n, 2))
+    queries = vectors[pairs[:, 0]] + vectors[pairs[:, 1]]
+    queries += rng.normal(scale=0.01, size=queries.shape)
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def benchmark_storage(
+    store: FAISS,
+    storage: str,
+    queries: np.ndarray,
+    k: int,
+    rerank_factor: int,
+    directory: Path,
+) -> dict[str, float]:
+    """
+    Measures a storage against the exact float32 search
+
+    Args:
+        store (FAISS): full-precision policy index
+        storage (str): "float32", "float16", "sq8" or "pq"
+        queries (np.ndarray): (Q, D) query vectors
+        k (int): results per query
+        rerank_factor (int): candidates re-ranked per result
+        directory (Path): where the compressed files are written
+
+    Returns:
+        dict[str, float]: recall@k, latency, memory per document and fraction of
+            the corpus re-ranked per query
+    """
+    _, exact = store.index.search(queries, k)
+    documents_bytes = sum(
+        len(doc.page_content.encode()) for doc in store.docstore._dict.values()
+    )
+
+    if storage == FLOAT32:
+        index_bytes = store.index.ntotal * store.index.d * 4
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = store.index.search(query[None], k)
+            latencies.append(time.perf_counter() - start)
+            found.append(ids[0])
+    else:
+        compressed = CompressedFAISS.from_faiss(store, directory / "index", storage)
+        compressed.rerank_factor = rerank_factor
+        index_bytes = compressed.memory_bytes()["vectors"]
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            ids, _ = compressed.search(query, k)
+            latencies.append(time.perf_counter() - start)
+            found.append(ids)
+
+    recall = statistics.mean(
+        len(set(f) & set(e)) / k for f, e in zip(found, exact.tolist())
+    )
+    n_documents = store.index.ntotal
+    candidates = n_documents if storage == FLOAT32 else k * rerank_factor
+    return {
+        "recall": recall,
+        "candidate_fraction": min(1.0, candidates / n_documents),
+        "latency_ms": 1000 * statistics.mean(latencies),
+        "vector_bytes_per_document": index_bytes / n_documents,
+        "bytes_per_document": (index_bytes + documents_bytes) / n_documents,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", type=Path, default=INDEX_PATH)
+    parser.add_argument("--queries", type=Path, help="one question per line")
+    parser.add_argument(
+        "--synthetic-documents",
+        type=int,
+        help="benchmark a corpus of this many random vectors instead of the index",
+    )
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument(
+        "--rerank-factors",
+        type=lambda value: [int(f) for f in value.split(",")],
+        default=[settings.VECTOR_RERANK_FACTOR],
+        help="comma-separated candidates re-ranked per result",
+    )
+    parser.add_argument(
+        "--min-recall", type=float, default=0.95, help="fail below this recall"
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    store: FAISS
+    if args.synthetic_documents:
+        store = synthetic_store(args.synthetic_documents)
+    else:
+        with open(args.index, "rb") as handle:
+            store = pickle.load(handle)
+
+    if args.queries:
+        text = args.queries.read_text(encoding="utf-8")
+        questions = [q for q in text.splitlines() if q.strip()]
+        queries = np.array(
+            OpenAIEmbeddings().embed_documents(questions), dtype=np.float32
+        )
+    else:
+        vectors = store.index.reconstruct_n(0, store.index.ntotal)
+        queries = synthetic_queries(vectors, args.n_queries)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        results[FLOAT32] = benchmark_storage(
+            store, FLOAT32, queries, args.k, 1, Path(directory)
+        )
+        for storage in (FLOAT16, SQ8, PQ):
+            for factor in args.rerank_factors:
+                results[f"{storage}@{factor}"] = benchmark_storage(
+                    store, storage, queries, args.k, factor, Path(directory)
+                )
+
+    baseline = results[FLOAT32]["bytes_per_document"]
+    for result in results.values():
+        result["compression"] = baseline / result["bytes_per_document"]
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+    trivial = [
+        s
+        for s, r in results.items()
+        if s != FLOAT32 and r["candidate_fraction"] > MAX_CANDIDATE_FRACTION
+    ]
+    if trivial:
+        print(
+            f"Warning: {', '.join(trivial)} re-rank more than {MAX_CANDIDATE_FRACTION:.0%} "
+            "of the corpus, use --synthetic-documents or lower --rerank-factors",
+            file=sys.stderr,
+        )
+
+    failing = [s for s, r in results.items() if r["recall"] < args.min_recall]
+    if failing:
+        sys.exit(f"Recall below {args.min_recall} for {', '.join(failing)}")
+
+
+if __name__ == "__main__":
+    main()
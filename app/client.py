@@ -0,0 +1,74 @@
+import json
+from typing import Any, Iterator
+
+import requests
+
+from app.config import settings
+
+
+class AgentServiceClient:
+    """Client of the headless agent service, see app/service.py."""
+
+    def __init__(
+        self,
+        base_url: str = settings.AGENT_SERVICE_URL,
+        timeout: float = 10,
+        turn_timeout: float = 300,
+    ) -> None:
+        """
+        Args:
+            base_url (str, optional): address of the service. Defaults to settings.AGENT_SERVICE_URL.
+            timeout (float, optional): seconds to wait for the service to connect or to answer. Defaults to 10.
+            turn_timeout (float, optional): seconds to wait between the events of a turn, as a tool may take a while. Defaults to 300.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.turn_timeout = turn_timeout
+        self._session = requests.Session()
+
+    def _request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        response = self._session.request(
+            method, f"{self.base_url}{path}", **{"timeout": self.timeout, **kwargs}
+        )
+        if not response.ok:
+            try:
+                detail = response.json()["detail"]
+            except (ValueError, KeyError):
+                detail = response.text
+            raise Exception(detail)
+        return response
+
+    def get_session(self, session_id: str, logs: bool = False) -> dict[str, Any]:
+        """Messages and onboarding status of a session, created if unknown."""
+        return self._request(
+            "GET", f"/sessions/{session_id}", params={"logs": logs}
+        ).json()
+
+    def reset_session(self, session_id: str) -> dict[str, Any]:
+        """Starts the conversation of a session over."""
+        return self._request("DELETE", f"/sessions/{session_id}").json()
+
+    def send_message(self, session_id: str, content: str) -> Iterator[dict[str, Any]]:
+        """
+        Sends a user message and yields the events of the turn as they arrive
+
+        Args:
+            session_id (str)
+            content (str): the user message
+
+        Raises:
+            Exception: the service refused the message
+
+        Returns:
+            Iterator[dict[str, Any]]: "step" and "token" events, then "done" or "error"
+        """
+        with self._request(
+            "POST",
+            f"/sessions/{session_id}/messages",
+            json={"content": content},
+            stream=True,
+            timeout=(self.timeout, self.turn_timeout),
+        ) as response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
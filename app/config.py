@@ -1,7 +1,7 @@
+import json
 import os
 from dataclasses import dataclass, field
 
-import openai
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,6 +17,139 @@ class _Settings:
     BAMBOO_HR_API_KEY: str = os.getenv("BAMBOO_HR_API_KEY", "")
     BAMBOO_HR_BASE_URL: str = "https://api.bamboohr.com/api/gateway.php/stackonetest/v1"
 
+    # Seconds before the bulk time off index is reloaded, and days it covers around today
+    ABSENCE_INDEX_TTL: int = 300
+    ABSENCE_INDEX_WINDOW_DAYS: int = 365
+    # Seconds the time off balances held by BambooHR are reused, and calls fetching
+    # the missing ones at once
+    BALANCE_CACHE_TTL: int = 300
+    BALANCE_FETCH_MAX_WORKERS: int = 4
+
+    # Seconds read-only tool outputs are reused within a session, and entries kept per session
+    TOOL_CACHE_TTL: int = 300
+    TOOL_CACHE_MAX_ENTRIES: int = 256
+
+    # Local SQLite mirror of the employee profiles, synced with the changes made in
+    # BambooHR at most every EMPLOYEE_MIRROR_SYNC_INTERVAL seconds when read, and pulled
+    # again in full every EMPLOYEE_MIRROR_FULL_SYNC_INTERVAL seconds. It holds personal
+    # data, so it defaults to the user cache directory rather than the working directory
+    EMPLOYEE_MIRROR_PATH: str = os.getenv(
+        "EMPLOYEE_MIRROR_PATH",
+        os.path.join(
+            os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+            "hr-agent",
+            "employees.sqlite3",
+        ),
+    )
+    EMPLOYEE_MIRROR_SYNC_INTERVAL: int = 300
+    EMPLOYEE_MIRROR_FULL_SYNC_INTERVAL: int = 24 * 3600
+
+    # Background threads, shared by the sessions, warming the tool cache when an
+    # employee_id shows up
+    PREFETCH_MAX_WORKERS: int = 2
+
+    # Tools described in the prompt besides the respond, onboarding and already used ones
+    TOOL_SELECTION_K: int = 4
+
+    # Policy chunks are cut along the handbook sections to CHUNK_MAX_TOKENS, and the
+    # chunks retrieved for a question are merged and packed into QA_CONTEXT_MAX_TOKENS
+    CHUNK_MAX_TOKENS: int = 200
+    CHUNK_OVERLAP_TOKENS: int = 30
+    QA_CONTEXT_MAX_TOKENS: int = 800
+
+    # Policy chunks retrieved per question: RETRIEVAL_FETCH_K candidates are re-scored
+    # with a keyword match and diversified with maximal marginal relevance
+    RETRIEVAL_K: int = 5
+    RETRIEVAL_FETCH_K: int = 20
+    RETRIEVAL_MMR_LAMBDA: float = 0.7
+    RETRIEVAL_LEXICAL_WEIGHT: float = 0.3
+
+    # Policy index vectors: "float32", "float16", "sq8" (8-bit scalar quantized, 4x smaller)
+    # or "pq" (product-quantized, 16x smaller with 384 sub-quantizers of the 1536 dimensions).
+    # Compressed indexes re-rank VECTOR_RERANK_FACTOR candidates per result with the float32 vectors
+    VECTOR_STORAGE: str = os.getenv("VECTOR_STORAGE", "float32")
+    VECTOR_PQ_SUBQUANTIZERS: int = 384
+    VECTOR_RERANK_FACTOR: int = 8
+
+    # HR policy handbook of each tenant (legal entity), as a JSON object of PDF paths.
+    # Employees are mapped to a tenant by their BambooHR location
+    POLICY_DOCUMENTS: dict[str, str] = field(
+        default_factory=lambda: json.loads(
+            os.getenv("POLICY_DOCUMENTS", '{"default": "./assets/HR_policies.pdf"}')
+        )
+    )
+    POLICY_LOCATION_TENANTS: dict[str, str] = field(
+        default_factory=lambda: json.loads(os.getenv("POLICY_LOCATION_TENANTS", "{}"))
+    )
+    DEFAULT_POLICY_TENANT: str = os.getenv("DEFAULT_POLICY_TENANT", "default")
+    # Resident size of the loaded policy indexes before the least recently used is evicted
+    POLICY_INDEX_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # Timezone and working hours used to find meeting slots
+    CALENDAR_TIMEZONE: str = os.getenv("CALENDAR_TIMEZONE", "Europe/London")
+    CALENDAR_WORKING_HOURS: tuple[int, int] = (9, 17)
+    CALENDAR_SLOT_WINDOW_DAYS: int = 14
+
+    # Client-side rate limits of the upstream APIs: "rate" per second and "capacity"
+    # (burst), overridden per upstream by the RATE_LIMITS JSON env. The "openai" bucket
+    # counts prompt tokens, the others calls. With RATE_LIMIT_STATE_DIR set, the worker
+    # processes of the host share the buckets through lock files in that directory
+    RATE_LIMITS: dict[str, dict[str, float]] = field(
+        default_factory=lambda: {
+            "bamboo": {"rate": 5, "capacity": 10},
+            "google.calendar": {"rate": 5, "capacity": 10},
+            "google.gmail": {"rate": 2, "capacity": 5},
+            "openai": {"rate": 10000 / 60, "capacity": 10000},
+            **json.loads(os.getenv("RATE_LIMITS", "{}")),
+        }
+    )
+    RATE_LIMIT_STATE_DIR: str | None = os.getenv("RATE_LIMIT_STATE_DIR")
+    # Seconds a call waits for the rate limit before failing
+    RATE_LIMIT_MAX_WAIT: float = 30
+
+    # Circuit breakers of the upstream APIs: a breaker opens when CIRCUIT_FAILURE_RATIO of
+    # the last CIRCUIT_WINDOW calls (at least CIRCUIT_MIN_CALLS) failed or took longer than
+    # CIRCUIT_SLOW_CALL_SECONDS, fails calls fast for CIRCUIT_OPEN_SECONDS, then lets
+    # CIRCUIT_HALF_OPEN_PROBES calls through to decide whether to close
+    CIRCUIT_WINDOW: int = 20
+    CIRCUIT_MIN_CALLS: int = 5
+    CIRCUIT_FAILURE_RATIO: float = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS: float = 5
+    CIRCUIT_OPEN_SECONDS: float = 30
+    CIRCUIT_HALF_OPEN_PROBES: int = 1
+
+    # Connect and read timeouts of the BambooHR calls, in seconds
+    BAMBOO_TIMEOUT: tuple[float, float] = (3.05, 10)
+    # Seconds before an idempotent BambooHR GET is sent a second time, the first answer
+    # winning, e.g. the p95 latency. Hedging is off when not set
+    BAMBOO_HEDGE_AFTER: float | None = (
+        float(os.environ["BAMBOO_HEDGE_AFTER"])
+        if os.getenv("BAMBOO_HEDGE_AFTER")
+        else None
+    )
+    # Threads running the first attempts of the hedged calls, and as many for the second
+    HEDGE_MAX_WORKERS: int = 8
+
+    # Headless agent service: turns running at once, turns waiting for a slot before
+    # new ones are refused, and the address the Streamlit app reaches it at
+    SERVICE_HOST: str = os.getenv("SERVICE_HOST", "127.0.0.1")
+    SERVICE_PORT: int = int(os.getenv("SERVICE_PORT", "8000"))
+    SERVICE_MAX_CONCURRENT_TURNS: int = 8
+    SERVICE_MAX_QUEUED_TURNS: int = 32
+    SERVICE_RETRY_AFTER_SECONDS: int = 5
+    AGENT_SERVICE_URL: str = os.getenv("AGENT_SERVICE_URL", "http://127.0.0.1:8000")
+
+    # Session store: SQLite file the sessions are saved to, else they are kept encoded
+    # in memory, at most SESSION_MEMORY_MAX_SESSIONS of them. At most SESSION_MAX_LIVE
+    # sessions are loaded at once, the least recently used idle ones being evicted.
+    # The agent log of each answer is cut to SESSION_LOG_MAX_LINES lines of at most
+    # SESSION_LOG_MAX_LINE_CHARS characters
+    SESSION_STORE_PATH: str | None = os.getenv("SESSION_STORE_PATH") or None
+    SESSION_MAX_LIVE: int = int(os.getenv("SESSION_MAX_LIVE", "256"))
+    SESSION_MEMORY_MAX_SESSIONS: int = 10_000
+    SESSION_LOG_MAX_LINES: int = 200
+    SESSION_LOG_MAX_LINE_CHARS: int = 1000
+
     # Slack invite URL
     SLACK_INVITE_URL: str = os.getenv("SLACK_INVITE_URL", "")
 
@@ -38,6 +171,7 @@ class _Settings:
         "GOOGLE_AUTH_PROVIDER_X509_CERT_URL", ""
     )
     GOOGLE_REDIRECT_URIS: str = os.getenv("GOOGLE_REDIRECT_URIS", "")
+    GOOGLE_TOKEN_PATH: str = os.getenv("GOOGLE_TOKEN_PATH", "token.pickle")
 
     @property
     def GOOGLE_CLIENT_CONFIG(self) -> dict[str, dict[str, str | list[str]]]:
@@ -56,6 +190,4 @@ class _Settings:
 
 settings = _Settings()
 
-openai.api_key = settings.OPENAI_API_KEY
-
 __all__ = ["settings"]
@@ -0,0 +1,198 @@
+import datetime
+import threading
+import time
+from typing import Any
+
+import numpy as np
+
+from app.config import settings
+from app.integrations.bamboo.balance import COUNTED_STATUSES
+from app.integrations.bamboo.directory import get_employee_mirror
+from app.integrations.bamboo.time_off import get_all_time_off_requests
+
+NO_TEAM = "No team"
+
+
+class AbsenceIndex:
+    """In-memory interval index over time off requests.
+
+    Requests are stored as parallel arrays sorted by start date. An overlap
+    query bisects the starts to drop every request beginning after the range
+    and filters the remaining prefix on its end dates, so queries are a binary
+    search plus one vectorised comparison.
+    """
+
+    def __init__(
+        self,
+        requests: list[dict[str, Any]],
+        teams: dict[str, str] | None = None,
+    ) -> None:
+        """
+        Args:
+            requests (list[dict[str, Any]]): BambooHR time off request JSON objects
+            teams (dict[str, str] | None, optional): team of each employee ID. Defaults to None.
+        """
+        self.teams = teams or {}
+        requests = [
+            request
+            for request in requests
+            if request.get("status", {}).get("status") in COUNTED_STATUSES
+        ]
+        requests.sort(key=lambda request: request["start"])
+
+        self.requests = requests
+        self.starts = np.array([r["start"] for r in requests], dtype="datetime64[D]")
+        self.ends = np.array([r["end"] for r in requests], dtype="datetime64[D]")
+        self.employee_ids = np.array([str(r["employeeId"]) for r in requests])
+        self.team_names, self.team_codes = np.unique(
+            np.array(
+                [self.teams.get(e, NO_TEAM) for e in self.employee_ids], dtype=str
+            ),
+            return_inverse=True,
+        )
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def _overlapping_positions(self, start_date: str, end_date: str) -> np.ndarray:
+        start, end = np.datetime64(start_date, "D"), np.datetime64(end_date, "D")
+        candidates = np.searchsorted(self.starts, end, side="right")
+        return np.flatnonzero(self.ends[:candidates] >= start)
+
+    def overlapping(
+        self, start_date: str, end_date: str, employee_id: str | None = None
+    ) -> list[dict[str, Any]]:
+        """
+        Gets the requests overlapping a date range, both ends inclusive
+
+        Args:
+            start_date (str): Date in format YYYY-MM-DD
+            end_date (str): Date in format YYYY-MM-DD
+            employee_id (str | None, optional): only return this employee's requests. Defaults to None.
+
+        Returns:
+            list[dict[str, Any]]: overlapping time off requests
+        """
+        positions = self._overlapping_positions(start_date, end_date)
+        if employee_id is not None:
+            positions = positions[self.employee_ids[positions] == str(employee_id)]
+        return [self.requests[i] for i in positions]
+
+    def employees_off(self, start_date: str, end_date: str) -> list[str]:
+        """
+        Gets the employees with time off between two dates
+
+        Args:
+            start_date (str): Date in format YYYY-MM-DD
+            end_date (str): Date in format YYYY-MM-DD
+
+        Returns:
+            list[str]: employee IDs
+        """
+        positions = self._overlapping_positions(start_date, end_date)
+        return np.unique(self.employee_ids[positions]).tolist()
+
+    def max_concurrent_absences(
+        self, start_date: str, end_date: str
+    ) -> dict[str, tuple[int, str | None]]:
+        """
+        Gets the peak number of employees off at the same time per team
+
+        Args:
+            start_date (str): Date in format YYYY-MM-DD
+            end_date (str): Date in format YYYY-MM-DD
+
+        Returns:
+            dict[str, tuple[int, str | None]]: peak number of absences and first date it is reached, per team
+        """
+        positions = self._overlapping_positions(start_date, end_date)
+        start, end = np.datetime64(start_date, "D"), np.datetime64(end_date, "D")
+        starts = np.maximum(self.starts[positions], start)
+        # Absences stop counting the day after their inclusive end date
+        stops = np.minimum(self.ends[positions], end) + np.timedelta64(1, "D")
+        teams = self.team_codes[positions]
+
+        result: dict[str, tuple[int, str | None]] = {}
+        for team in np.unique(teams):
+            in_team = teams == team
+            # Sweep over +1/-1 events, closing before opening on the same day
+            days = np.concatenate([stops[in_team], starts[in_team]])
+            deltas = np.concatenate(
+                [-np.ones(in_team.sum(), int), np.ones(in_team.sum(), int)]
+            )
+            order = np.lexsort((deltas, days))
+            running = np.cumsum(deltas[order])
+            peak = int(running.argmax())
+            result[str(self.team_names[team])] = (
+                int(running[peak]),
+                str(days[order][peak]),
+            )
+        return result
+
+
+_index: AbsenceIndex | None = None
+_index_window: tuple[str, str] = ("", "")
+_index_loaded_at = 0.0
+_index_lock = threading.Lock()
+
+
+def load_absence_index(start_date: str, end_date: str) -> AbsenceIndex:
+    """
+    Fetches every time off request in a date range in bulk, with the employee
+    teams from the local mirror
+
+    Args:
+        start_date (str): Date in format YYYY-MM-DD
+        end_date (str): Date in format YYYY-MM-DD
+
+    Returns:
+        AbsenceIndex: the index over the fetched requests
+    """
+    requests = get_all_time_off_requests(start_date=start_date, end_date=end_date)
+    teams = {
+        str(employee["id"]): employee.get("department") or NO_TEAM
+        for employee in get_employee_mirror().all()
+    }
+    return AbsenceIndex(requests, teams)
+
+
+def get_absence_index(
+    start_date: str | None = None, end_date: str | None = None
+) -> AbsenceIndex:
+    """
+    Gets the shared absence index, reloading it when it is stale or does not
+    cover the requested range. Defaults to a window of a year around today.
+
+    Args:
+        start_date (str | None, optional): Date in format YYYY-MM-DD. Defaults to None.
+        end_date (str | None, optional): Date in format YYYY-MM-DD. Defaults to None.
+
+    Returns:
+        AbsenceIndex: index covering at least the requested range
+    """
+    global _index, _index_window, _index_loaded_at
+
+    today = datetime.date.today()
+    window_days = datetime.timedelta(days=settings.ABSENCE_INDEX_WINDOW_DAYS)
+    start_date = start_date or (today - window_days).strftime("%Y-%m-%d")
+    end_date = end_date or (today + window_days).strftime("%Y-%m-%d")
+
+    with _index_lock:
+        fresh = time.monotonic() - _index_loaded_at < settings.ABSENCE_INDEX_TTL
+        covered = _index_window[0] <= start_date and end_date <= _index_window[1]
+        if _index is None or not fresh or not covered:
+            window = (
+                min(start_date, (today - window_days).strftime("%Y-%m-%d")),
+                max(end_date, (today + window_days).strftime("%Y-%m-%d")),
+            )
+            _index = load_absence_index(*window)
+            _index_window = window
+            _index_loaded_at = time.monotonic()
+        return _index
+
+
+def invalidate_absence_index() -> None:
+    """Drops the shared absence index so the next query reloads it."""
+    global _index
+    with _index_lock:
+        _index = None
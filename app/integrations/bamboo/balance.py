@@ -0,0 +1,224 @@
+import datetime
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from app.integrations.bamboo.leave import HOURS_PER_WORKING_DAY, get_leave_calendar
+
+# Request statuses that consume balance, see https://documentation.bamboohr.com/reference/get-time-off-requests-1
+COUNTED_STATUSES = {"approved", "requested"}
+
+
+@dataclass(frozen=True)
+class TimeOffPolicy:
+    """Local copy of a BambooHR time off policy.
+
+    Attributes:
+        time_off_type_id (str): BambooHR time off type the policy applies to
+        grant_hours (float): balance granted when the policy is assigned, and
+            at the start of every policy (calendar) year
+        carryover_hours (float): unused hours carried into the next policy year, at most
+    """
+
+    time_off_type_id: str
+    grant_hours: float
+    carryover_hours: float = 0
+
+
+# Manual Vacation Policy: 25 days of vacation per year from HR policy PDF, units in hours
+VACATION_POLICY = TimeOffPolicy(
+    time_off_type_id="78", grant_hours=25 * HOURS_PER_WORKING_DAY
+)
+
+
+@dataclass
+class RequestArrays:
+    """Time off requests of many employees as parallel arrays.
+
+    Attributes:
+        employee_idx (np.ndarray): index of the employee each request belongs to
+        starts (np.ndarray): start dates (datetime64[D])
+        ends (np.ndarray): end dates, inclusive (datetime64[D])
+    """
+
+    employee_idx: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+
+    @classmethod
+    def from_bamboo(
+        cls,
+        requests: list[dict[str, Any]],
+        employee_ids: list[str],
+        policy: TimeOffPolicy = VACATION_POLICY,
+    ) -> "RequestArrays":
+        """
+        Builds the arrays from BambooHR time off request JSON objects, keeping
+        only the requests of the given employees that consume the policy balance
+
+        Args:
+            requests (list[dict[str, Any]]): JSON response from BambooHR API
+            employee_ids (list[str]): employees to keep, in output order
+            policy (TimeOffPolicy, optional): policy whose balance is projected. Defaults to VACATION_POLICY.
+
+        Returns:
+            RequestArrays: the parsed requests
+        """
+        positions = {employee_id: i for i, employee_id in enumerate(employee_ids)}
+        employee_idx, starts, ends = [], [], []
+        for request in requests:
+            position = positions.get(str(request.get("employeeId")))
+            if position is None:
+                continue
+            if str(request.get("type", {}).get("id")) != policy.time_off_type_id:
+                continue
+            if request.get("status", {}).get("status") not in COUNTED_STATUSES:
+                continue
+            employee_idx.append(position)
+            starts.append(request["start"])
+            ends.append(request["end"])
+
+        return cls(
+            employee_idx=np.array(employee_idx, dtype=np.int64),
+            starts=np.array(starts, dtype="datetime64[D]"),
+            ends=np.array(ends, dtype="datetime64[D]"),
+        )
+
+
+def project_balances(
+    initial_balances: np.ndarray,
+    requests: RequestArrays,
+    dates: np.ndarray | list[str],
+    as_of: str | datetime.date | np.datetime64,
+    location: str | None = None,
+) -> np.ndarray:
+    """
+    Projects the time off balance of many employees on many dates.
+
+    The balance on a date is the initial balance minus the working hours of every
+    counted request between `as_of` and that date, both inclusive. Requests that
+    straddle a date are only charged for the days up to it.
+
+    Args:
+        initial_balances (np.ndarray): balance in hours of each employee on `as_of`
+        requests (RequestArrays): time off requests of the employees
+        dates (np.ndarray | list[str]): dates to project the balance on
+        as_of (str | datetime.date | np.datetime64): date of the initial balances
+        location (str | None, optional): location whose calendar to use. Defaults to None.
+
+    Returns:
+        np.ndarray: projected balances with shape (employees, dates)
+    """
+    calendar = get_leave_calendar(location)
+    initial_balances = np.asarray(initial_balances, dtype=np.float64)
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    origin = np.datetime64(as_of, "D")
+
+    # (requests, dates) matrix of working days consumed by each request up to each date
+    starts = np.maximum(requests.starts, origin)[:, None]
+    ends = np.minimum(requests.ends[:, None], dates[None, :]) + np.timedelta64(1, "D")
+    used_days = np.busday_count(
+        starts, np.maximum(ends, starts), busdaycal=calendar.busdaycalendar
+    )
+
+    used_hours = np.zeros((len(initial_balances), len(dates)))
+    np.add.at(used_hours, requests.employee_idx, used_days * calendar.hours_per_day)
+
+    return initial_balances[:, None] - used_hours
+
+
+def project_policy_balances(
+    initial_balances: np.ndarray,
+    requests: RequestArrays,
+    dates: np.ndarray | list[str],
+    as_of: str | datetime.date,
+    policy: TimeOffPolicy = VACATION_POLICY,
+    location: str | None = None,
+) -> np.ndarray:
+    """
+    Projects the time off balance of many employees on many dates, across
+    policy years. The initial balances are those of the policy year of `as_of`;
+    each following year opens with the policy grant plus the hours carried over,
+    or minus the hours overdrawn, at the end of the previous one.
+
+    Args:
+        initial_balances (np.ndarray): balance in hours of each employee on `as_of`
+        requests (RequestArrays): time off requests of the employees
+        dates (np.ndarray | list[str]): dates to project the balance on
+        as_of (str | datetime.date): date of the initial balances
+        policy (TimeOffPolicy, optional): Defaults to VACATION_POLICY.
+        location (str | None, optional): location whose calendar to use. Defaults to None.
+
+    Returns:
+        np.ndarray: projected balances with shape (employees, dates)
+    """
+    opening = np.asarray(initial_balances, dtype=np.float64)
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    origin = np.datetime64(as_of, "D")
+    # Dates before `as_of` belong to its year, as in `project_balances`
+    years = np.maximum(dates.astype("datetime64[Y]"), origin.astype("datetime64[Y]"))
+
+    balances = np.empty((len(opening), len(dates)))
+    year = origin.astype("datetime64[Y]")
+    year_start = origin
+    while True:
+        in_year = years == year
+        year_end = (year + 1).astype("datetime64[D]") - np.timedelta64(1, "D")
+        projected = project_balances(
+            initial_balances=opening,
+            requests=requests,
+            dates=np.append(dates[in_year], year_end),
+            as_of=year_start,
+            location=location,
+        )
+        balances[:, in_year] = projected[:, :-1]
+        if not (years > year).any():
+            return balances
+        opening = policy.grant_hours + np.minimum(
+            projected[:, -1], policy.carryover_hours
+        )
+        year += 1
+        year_start = year.astype("datetime64[D]")
+
+
+def project_team_balances(
+    employee_ids: list[str],
+    requests: list[dict[str, Any]],
+    dates: list[str],
+    as_of: str | datetime.date,
+    initial_balances: dict[str, float] | None = None,
+    policy: TimeOffPolicy = VACATION_POLICY,
+    location: str | None = None,
+) -> dict[str, dict[str, float]]:
+    """
+    Projects the time off balances of a team without calling BambooHR
+
+    Args:
+        employee_ids (list[str])
+        requests (list[dict[str, Any]]): BambooHR time off requests of the team
+        dates (list[str]): dates in format YYYY-MM-DD
+        as_of (str | datetime.date): date of the initial balances
+        initial_balances (dict[str, float] | None, optional): balance in hours per employee on `as_of`. Defaults to the policy grant.
+        policy (TimeOffPolicy, optional): Defaults to VACATION_POLICY.
+        location (str | None, optional): Defaults to None.
+
+    Returns:
+        dict[str, dict[str, float]]: balance in hours per employee and date
+    """
+    initial_balances = initial_balances or {}
+    initial = np.array(
+        [initial_balances.get(i, policy.grant_hours) for i in employee_ids]
+    )
+    balances = project_policy_balances(
+        initial_balances=initial,
+        requests=RequestArrays.from_bamboo(requests, employee_ids, policy),
+        dates=dates,
+        as_of=as_of,
+        policy=policy,
+        location=location,
+    )
+    return {
+        employee_id: dict(zip(dates, row.tolist()))
+        for employee_id, row in zip(employee_ids, balances)
+    }
@@ -0,0 +1,259 @@
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+
+from app.config import settings
+from app.integrations.bamboo.employees import (
+    fetch_changed_employees,
+    fetch_employee,
+    fetch_employees_report,
+)
+from app.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Profile fields kept for every employee
+MIRROR_FIELDS = [
+    "firstName",
+    "lastName",
+    "preferredName",
+    "homeEmail",
+    "workEmail",
+    "jobTitle",
+    "department",
+    "location",
+    "hireDate",
+    "supervisorEId",
+    "status",
+]
+# Changed employees fetched one by one in a delta sync, beyond that the whole
+# report is pulled again in one call
+MAX_DELTA_LOOKUPS = 25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+class EmployeeMirror:
+    """Local SQLite copy of the employee profiles of BambooHR.
+
+    The mirror is filled by a bulk report of every employee, then kept fresh
+    by delta syncs that only fetch the employees changed since the previous
+    sync. Reads sync first when the last sync is older than `sync_interval`;
+    while a sync runs, the other readers are served the current data. Changes
+    made through the API are written through, see `update`.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        sync_interval: float = settings.EMPLOYEE_MIRROR_SYNC_INTERVAL,
+        full_sync_interval: float = settings.EMPLOYEE_MIRROR_FULL_SYNC_INTERVAL,
+    ) -> None:
+        """
+        Args:
+            path (str | Path): SQLite database file
+            sync_interval (float, optional): seconds between delta syncs. Defaults to settings.EMPLOYEE_MIRROR_SYNC_INTERVAL.
+            full_sync_interval (float, optional): seconds between full syncs, which also catch changes missed by the deltas. Defaults to settings.EMPLOYEE_MIRROR_FULL_SYNC_INTERVAL.
+        """
+        self.path = Path(path)
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self._checked_at: float | None = None
+        self._sync_lock = threading.Lock()
+        self._initialised = False
+        # Bumped on every change of the mirrored data, for the indexes built from it
+        self.generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per operation, so the mirror can be used from any thread
+        if not self._initialised:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialised:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._initialised = True
+        return connection
+
+    def _get_state(self, connection: sqlite3.Connection, key: str) -> str | None:
+        row = connection.execute(
+            "SELECT value FROM sync_state WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, connection: sqlite3.Connection, key: str, value: str) -> None:
+        connection.execute(
+            "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+    def _upsert(
+        self, connection: sqlite3.Connection, employees: list[dict[str, Any]]
+    ) -> None:
+        now = time.time()
+        connection.executemany(
+            "INSERT OR REPLACE INTO employees (id, data, synced_at) VALUES (?, ?, ?)",
+            [
+                (str(e["id"]), json.dumps({**e, "id": str(e["id"])}), now)
+                for e in employees
+            ],
+        )
+
+    def full_sync(self) -> int:
+        """
+        Replaces the mirror with a report of every employee
+
+        Returns:
+            int: employees mirrored
+        """
+        # Changes made during the pull are picked up by the next delta
+        started = _now_iso()
+        employees = fetch_employees_report(MIRROR_FIELDS)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM employees")
+            self._upsert(connection, employees)
+            self._set_state(connection, "changed_since", started)
+            self._set_state(connection, "full_sync_at", str(time.time()))
+        self.generation += 1
+        METRICS.increment("employee_mirror.full_syncs")
+        METRICS.set_gauge("employee_mirror.employees", len(employees))
+        return len(employees)
+
+    def delta_sync(self, since: str) -> int:
+        """
+        Applies the changes made in BambooHR since the previous sync
+
+        Args:
+            since (str): ISO 8601 timestamp of the previous sync
+
+        Returns:
+            int: employees changed
+        """
+        changes, latest = fetch_changed_employees(since)
+        changed = [i for i, action in changes.items() if action != "Deleted"]
+        if len(changed) > MAX_DELTA_LOOKUPS:
+            return self.full_sync()
+
+        employees = [fetch_employee(i, MIRROR_FIELDS) for i in changed]
+        deleted = [(i,) for i, action in changes.items() if action == "Deleted"]
+        with closing(self._connect()) as connection, connection:
+            self._upsert(connection, employees)
+            connection.executemany("DELETE FROM employees WHERE id = ?", deleted)
+            self._set_state(connection, "changed_since", latest)
+        if changes:
+            self.generation += 1
+        METRICS.increment("employee_mirror.delta_syncs")
+        METRICS.increment("employee_mirror.changed_employees", len(changes))
+        return len(changes)
+
+    def sync(self, full: bool = False) -> int:
+        """
+        Syncs the mirror, with a full sync if it was never synced or the last
+        full sync is older than `full_sync_interval`, else with a delta
+
+        Args:
+            full (bool, optional): force a full sync. Defaults to False.
+
+        Returns:
+            int: employees mirrored or changed
+        """
+        with closing(self._connect()) as connection:
+            since = self._get_state(connection, "changed_since")
+            full_sync_at = float(self._get_state(connection, "full_sync_at") or 0)
+        if (
+            full
+            or since is None
+            or time.time() - full_sync_at > self.full_sync_interval
+        ):
+            return self.full_sync()
+        return self.delta_sync(since)
+
+    def ensure_fresh(self) -> None:
+        """Syncs if the last sync is older than `sync_interval`. Sync errors are
+        logged and the mirrored data kept, as long as there is some."""
+        checked_at = self._checked_at
+        if (
+            checked_at is not None
+            and time.monotonic() - checked_at < self.sync_interval
+        ):
+            return
+
+        # Single flight: a reader finding a sync in progress uses the current data,
+        # unless there is none yet
+        if not self._sync_lock.acquire(blocking=self._checked_at is None):
+            return
+        try:
+            if self._checked_at == checked_at:
+                try:
+                    self.sync()
+                except Exception:
+                    METRICS.increment("employee_mirror.sync_errors")
+                    logger.warning("Employee mirror sync failed", exc_info=True)
+                self._checked_at = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def get(self, employee_id: str) -> dict[str, Any] | None:
+        """Mirrored profile of an employee, None if unknown."""
+        self.ensure_fresh()
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT data FROM employees WHERE id = ?", (str(employee_id),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self) -> list[dict[str, Any]]:
+        """Mirrored profiles of every employee."""
+        self.ensure_fresh()
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT data FROM employees").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def update(self, employee_id: str, changes: dict[str, Any]) -> None:
+        """
+        Merges changes made through the API into the profile of an employee
+
+        Args:
+            employee_id (str)
+            changes (dict[str, Any]): changed fields
+        """
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT data FROM employees WHERE id = ?", (str(employee_id),)
+            ).fetchone()
+            employee = json.loads(row[0]) if row else {}
+            self._upsert(connection, [{**employee, **changes, "id": employee_id}])
+        self.generation += 1
+
+
+_mirror: EmployeeMirror | None = None
+_mirror_lock = threading.Lock()
+
+
+def get_employee_mirror() -> EmployeeMirror:
+    """The process-wide employee mirror, at settings.EMPLOYEE_MIRROR_PATH."""
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = EmployeeMirror(settings.EMPLOYEE_MIRROR_PATH)
+        return _mirror
@@ -1,8 +1,41 @@
+import logging
 from typing import Any
 from urllib.parse import urlencode
 
+from app.config import settings
 from app.integrations.bamboo.utils import RequestMethods, send_bamboo_request
 
+logger = logging.getLogger(__name__)
+
+
+def fetch_employee(employee_id: str, fields: list[str]) -> dict[str, Any]:
+    """
+    Gets an employee from Bamboo HR, bypassing the local mirror
+
+    Args:
+        employee_id (str)
+        fields (list[str]): Fields to be retrieved from the employee profile
+
+    Raises:
+        Exception: Error getting employee
+
+    Returns:
+        dict[str, Any]: Employee profile JSON object with requested fields
+    """
+    fields_str = ",".join(fields)
+    encoded_fields = urlencode({"fields": fields_str})
+
+    res = send_bamboo_request(
+        url_path=f"/employees/{employee_id}/?{encoded_fields}",
+        method=RequestMethods.GET,
+        hedge_after=settings.BAMBOO_HEDGE_AFTER,
+    )
+
+    if res.status_code != 200:
+        raise Exception("Error getting employee")
+
+    return res.json()
+
 
 def get_employee(
     employee_id: str,
@@ -15,7 +48,8 @@ def get_employee(
     ],
 ) -> dict[str, Any]:
     """
-    Gets an employee from Bamboo HR
+    Gets an employee, from the local mirror of the directory when it has the
+    employee and the fields, else from Bamboo HR
 
     Args:
         employee_id (str)
@@ -27,18 +61,88 @@ def get_employee(
     Returns:
         dict[str, Any]: Employee profile JSON object with requested fields
     """
-    fields_str = ",".join(fields)
-    encoded_fields = urlencode({"fields": fields_str})
+    from app.integrations.bamboo.directory import get_employee_mirror
+
+    employee = get_employee_mirror().get(employee_id)
+    if employee is not None and all(field in employee for field in fields):
+        return {"id": employee["id"], **{field: employee[field] for field in fields}}
+
+    return fetch_employee(employee_id, fields)
 
+
+def fetch_employees_report(fields: list[str]) -> list[dict[str, Any]]:
+    """
+    Gets some fields of every employee, former ones included, in a single call
+
+    Args:
+        fields (list[str]): Fields to be retrieved from the employee profiles
+
+    Raises:
+        Exception: Error getting employees report
+
+    Returns:
+        list[dict[str, Any]]: Employee profile JSON objects with an "id" and the requested fields
+    """
     res = send_bamboo_request(
-        url_path=f"/employees/{employee_id}/?{encoded_fields}",
+        url_path="/reports/custom?format=JSON&onlyCurrent=false",
+        method=RequestMethods.POST,
+        data={"fields": fields},
+    )
+
+    if res.status_code != 200:
+        raise Exception("Error getting employees report")
+
+    return res.json()["employees"]
+
+
+def fetch_changed_employees(since: str) -> tuple[dict[str, str], str]:
+    """
+    Gets the employees inserted, updated or deleted since a time
+
+    Args:
+        since (str): ISO 8601 timestamp
+
+    Raises:
+        Exception: Error getting changed employees
+
+    Returns:
+        tuple[dict[str, str], str]: action ("Inserted", "Updated" or "Deleted") per employee ID, and the timestamp to ask for the next changes from
+    """
+    res = send_bamboo_request(
+        url_path=f"/employees/changed/?{urlencode({'since': since})}",
         method=RequestMethods.GET,
     )
 
     if res.status_code != 200:
-        raise Exception("Error getting employee")
+        raise Exception("Error getting changed employees")
 
-    return res.json()
+    body = res.json()
+    changes = {
+        str(employee_id): change.get("action", "Updated")
+        for employee_id, change in (body.get("employees") or {}).items()
+    }
+    return changes, body["latest"]
+
+
+def get_employee_directory() -> list[dict[str, Any]]:
+    """
+    Gets the company directory from Bamboo HR in a single call
+
+    Raises:
+        Exception: Error getting employee directory
+
+    Returns:
+        list[dict[str, Any]]: Employee directory entries (id, displayName, department, location...)
+    """
+    res = send_bamboo_request(
+        url_path="/employees/directory",
+        method=RequestMethods.GET,
+    )
+
+    if res.status_code != 200:
+        raise Exception("Error getting employee directory")
+
+    return res.json()["employees"]
 
 
 def add_employee(
@@ -74,6 +178,16 @@ def add_employee(
         raise Exception("Error creating employee")
 
     employee_id = res.headers["Location"].split("/")[-1]
+    _update_mirror(
+        employee_id,
+        {
+            "firstName": first_name,
+            "lastName": last_name,
+            "homeEmail": email_address,
+            "location": "London, UK",
+            "hireDate": hire_date,
+        },
+    )
     return employee_id
 
 
@@ -116,6 +230,20 @@ def edit_employee(
     if res.status_code != 200:
         raise Exception("Error editing employee")
 
+    _update_mirror(employee_id, data)
+
+
+def _update_mirror(employee_id: str, changes: dict[str, Any]) -> None:
+    """Writes a change made through the API to the local mirror, so it is seen
+    before the next sync."""
+    from app.integrations.bamboo.directory import get_employee_mirror
+
+    try:
+        get_employee_mirror().update(employee_id, changes)
+    except Exception:
+        # The next sync will catch up
+        logger.warning("Could not update employee %s in the mirror", employee_id)
+
 
 # Employee useful fields
 # useful_fields = [
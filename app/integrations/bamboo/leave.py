@@ -0,0 +1,214 @@
+import datetime
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+HOURS_PER_WORKING_DAY = 8
+
+DEFAULT_LOCATION = "London, UK"
+
+# England and Wales bank holidays, see https://www.gov.uk/bank-holidays. They
+# follow fixed rules, except for the days moved or added by royal proclamation
+UK_BANK_HOLIDAY_CHANGES = {
+    # Early May bank holiday moved for VE day
+    "1995-05-08": "1995-05-05",
+    "2020-05-04": "2020-05-08",
+    # Spring bank holiday moved for the Golden, Diamond and Platinum jubilees
+    "2002-05-27": "2002-06-04",
+    "2012-05-28": "2012-06-04",
+    "2022-05-30": "2022-06-02",
+}
+UK_EXTRA_BANK_HOLIDAYS = [
+    "1999-12-31",
+    "2002-06-03",
+    "2011-04-29",
+    "2012-06-05",
+    "2022-06-03",
+    "2022-09-19",
+    "2023-05-08",
+]
+# Years the leave calendars cover
+CALENDAR_YEARS = range(1990, 2100)
+
+
+def easter_sunday(year: int) -> datetime.date:
+    """Date of Easter Sunday, with the anonymous Gregorian algorithm."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _monday_on_or_after(date: datetime.date) -> datetime.date:
+    return date + datetime.timedelta(days=-date.weekday() % 7)
+
+
+def _weekday_on_or_after(date: datetime.date) -> datetime.date:
+    return date + datetime.timedelta(
+        days=7 - date.weekday() if date.weekday() >= 5 else 0
+    )
+
+
+def _last_monday(year: int, month: int) -> datetime.date:
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(1)
+    return last - datetime.timedelta(days=last.weekday())
+
+
+def uk_bank_holidays(year: int) -> list[str]:
+    """
+    Gets the England and Wales bank holidays of a year, with the substitute
+    days of those falling on a weekend
+
+    Args:
+        year (int)
+
+    Returns:
+        list[str]: dates in format YYYY-MM-DD, sorted
+    """
+    easter = easter_sunday(year)
+    christmas = datetime.date(year, 12, 25)
+    # Christmas and Boxing day falling on a weekend move to the next free weekdays
+    christmas_days = [christmas, christmas + datetime.timedelta(1)]
+    substitutes = []
+    for day in christmas_days:
+        substitute = day
+        while substitute.weekday() >= 5 or substitute in substitutes:
+            substitute += datetime.timedelta(1)
+        substitutes.append(substitute)
+
+    dates = [
+        _weekday_on_or_after(datetime.date(year, 1, 1)),
+        easter - datetime.timedelta(2),
+        easter + datetime.timedelta(1),
+        _monday_on_or_after(datetime.date(year, 5, 1)),
+        _last_monday(year, 5),
+        _last_monday(year, 8),
+        *substitutes,
+    ]
+    holidays = [
+        UK_BANK_HOLIDAY_CHANGES.get(d.isoformat(), d.isoformat()) for d in dates
+    ]
+    holidays += [d for d in UK_EXTRA_BANK_HOLIDAYS if d.startswith(f"{year}-")]
+    return sorted(holidays)
+
+
+@dataclass(frozen=True)
+class LeaveCalendar:
+    """Working-day calendar of a location.
+
+    Attributes:
+        weekmask (str): working days of the week, Monday first, as accepted by NumPy (e.g. "1111100")
+        holidays (tuple[str, ...]): public holidays in format YYYY-MM-DD
+        hours_per_day (float): hours charged per working day of leave
+        years (range | None): years the holidays are known for, any year if None
+    """
+
+    weekmask: str = "1111100"
+    holidays: tuple[str, ...] = ()
+    hours_per_day: float = HOURS_PER_WORKING_DAY
+    years: range | None = None
+
+    def check_years(self, *dates: np.ndarray) -> None:
+        """
+        Raises:
+            Exception: a date is outside the years the holidays are known for
+        """
+        if self.years is None:
+            return
+        for array in dates:
+            if array.size == 0:
+                continue
+            years = array.astype("datetime64[Y]").astype(int) + 1970
+            if years.min() < self.years.start or years.max() >= self.years.stop:
+                raise Exception(
+                    f"Holidays are only known from {self.years.start} to {self.years.stop - 1}"
+                )
+
+    @cached_property
+    def holiday_set(self) -> frozenset[str]:
+        return frozenset(self.holidays)
+
+    @cached_property
+    def busdaycalendar(self) -> np.busdaycalendar:
+        return np.busdaycalendar(
+            weekmask=self.weekmask,
+            holidays=np.array(self.holidays, dtype="datetime64[D]"),
+        )
+
+
+LOCATION_CALENDARS: dict[str, LeaveCalendar] = {
+    "London, UK": LeaveCalendar(
+        holidays=tuple(d for year in CALENDAR_YEARS for d in uk_bank_holidays(year)),
+        years=CALENDAR_YEARS,
+    ),
+}
+
+
+def get_leave_calendar(location: str | None = None) -> LeaveCalendar:
+    """
+    Gets the leave calendar of a location, falling back to the default location
+
+    Args:
+        location (str | None, optional): BambooHR location name. Defaults to None.
+
+    Returns:
+        LeaveCalendar: working-day calendar of the location
+    """
+    return LOCATION_CALENDARS.get(
+        location or DEFAULT_LOCATION, LOCATION_CALENDARS[DEFAULT_LOCATION]
+    )
+
+
+def count_working_days(
+    start_dates: str | np.ndarray | list[str],
+    end_dates: str | np.ndarray | list[str],
+    location: str | None = None,
+) -> np.ndarray:
+    """
+    Counts the working days between start and end dates, both inclusive.
+    Accepts single dates or arrays of dates, which are broadcast against each other.
+
+    Args:
+        start_dates (str | np.ndarray | list[str]): Start date(s) in format YYYY-MM-DD
+        end_dates (str | np.ndarray | list[str]): End date(s) in format YYYY-MM-DD
+        location (str | None, optional): location whose calendar to use. Defaults to None.
+
+    Raises:
+        Exception: a date is outside the years covered by the calendar
+
+    Returns:
+        np.ndarray: number of working days, zero where the end precedes the start
+    """
+    calendar = get_leave_calendar(location)
+    starts = np.asarray(start_dates, dtype="datetime64[D]")
+    ends = np.asarray(end_dates, dtype="datetime64[D]") + np.timedelta64(1, "D")
+    calendar.check_years(starts, ends - np.timedelta64(1, "D"))
+    days = np.busday_count(starts, ends, busdaycal=calendar.busdaycalendar)
+    return np.maximum(days, 0)
+
+
+def calculate_leave_hours(
+    start_dates: str | np.ndarray | list[str],
+    end_dates: str | np.ndarray | list[str],
+    location: str | None = None,
+) -> np.ndarray:
+    """
+    Calculates the hours of leave charged for one or many time off requests
+
+    Args:
+        start_dates (str | np.ndarray | list[str]): Start date(s) in format YYYY-MM-DD
+        end_dates (str | np.ndarray | list[str]): End date(s) in format YYYY-MM-DD
+        location (str | None, optional): location whose calendar to use. Defaults to None.
+
+    Returns:
+        np.ndarray: hours of leave per request
+    """
+    calendar = get_leave_calendar(location)
+    return count_working_days(start_dates, end_dates, location) * calendar.hours_per_day
@@ -0,0 +1,152 @@
+import bisect
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any
+
+from app.integrations.bamboo.directory import get_employee_mirror
+
+EMAIL_FIELDS = ("homeEmail", "workEmail")
+NAME_FIELDS = ("firstName", "preferredName", "lastName")
+# Matches below this trigram similarity are dropped, unless they match by prefix
+MIN_SIMILARITY = 0.3
+
+
+def normalise_name(name: str) -> str:
+    """Lower-cased name without accents or punctuation, e.g. "José-Luis" -> "jose luis"."""
+    decomposed = unicodedata.normalize("NFKD", name)
+    letters = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join("".join(c if c.isalnum() else " " for c in letters.lower()).split())
+
+
+def trigrams(text: str) -> set[str]:
+    """Character trigrams of the padded words of a text."""
+    return {
+        padded[i : i + 3]
+        for word in text.split()
+        for padded in [f"  {word} "]
+        for i in range(len(padded) - 2)
+    }
+
+
+class EmployeeLookup:
+    """In-memory index resolving a person to an employee ID.
+
+    Emails are matched exactly through a hash map. Names are matched by word
+    prefix ("ali smi" finds Alice Smith) through a sorted list of the name
+    words, and approximately ("Alise") through an inverted index of the name
+    trigrams scored with the Dice coefficient.
+    """
+
+    def __init__(self, employees: list[dict[str, Any]]) -> None:
+        """
+        Args:
+            employees (list[dict[str, Any]]): employee profiles with an "id", names and emails
+        """
+        self.employees = {str(e["id"]): e for e in employees}
+        self._emails: dict[str, str] = {}
+        self._names: dict[str, str] = {}
+        self._words: list[tuple[str, str]] = []
+        self._trigrams: dict[str, list[str]] = {}
+        self._trigram_counts: dict[str, int] = {}
+
+        for employee_id, employee in self.employees.items():
+            for field in EMAIL_FIELDS:
+                if employee.get(field):
+                    self._emails[employee[field].strip().lower()] = employee_id
+
+            name = normalise_name(
+                " ".join(str(employee.get(f) or "") for f in NAME_FIELDS)
+            )
+            if not name:
+                continue
+            self._names[employee_id] = name
+            self._words.extend((word, employee_id) for word in set(name.split()))
+            grams = trigrams(name)
+            self._trigram_counts[employee_id] = len(grams)
+            for gram in grams:
+                self._trigrams.setdefault(gram, []).append(employee_id)
+        self._words.sort()
+
+    def by_email(self, email: str) -> str | None:
+        """Employee ID with this home or work email, None if unknown."""
+        return self._emails.get(email.strip().lower())
+
+    def _prefix_matches(self, word: str) -> set[str]:
+        start = bisect.bisect_left(self._words, (word, ""))
+        matches = set()
+        for candidate, employee_id in self._words[start:]:
+            if not candidate.startswith(word):
+                break
+            matches.add(employee_id)
+        return matches
+
+    def search(self, query: str, limit: int = 5) -> list[tuple[str, float]]:
+        """
+        Finds the employees matching a name or an email
+
+        Args:
+            query (str): email, full name, first or last name, or the start of them
+            limit (int, optional): maximum matches. Defaults to 5.
+
+        Returns:
+            list[tuple[str, float]]: employee IDs with a score in [0, 1], best first
+        """
+        if "@" in query:
+            employee_id = self.by_email(query)
+            return [(employee_id, 1.0)] if employee_id else []
+
+        name = normalise_name(query)
+        if not name:
+            return []
+
+        # Every word of the query starts a word of the name
+        words = name.split()
+        prefixed = self._prefix_matches(words[0])
+        for word in words[1:]:
+            prefixed &= self._prefix_matches(word)
+
+        grams = trigrams(name)
+        shared: Counter[str] = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+
+        scores = {
+            employee_id: 2 * count / (len(grams) + self._trigram_counts[employee_id])
+            for employee_id, count in shared.items()
+        }
+        for employee_id in prefixed:
+            # A prefix match is at least a half match, closer names score higher
+            scores[employee_id] = 0.5 + 0.5 * scores.get(employee_id, 0.0)
+        matches = [
+            (employee_id, round(min(score, 1.0), 3))
+            for employee_id, score in scores.items()
+            if score >= MIN_SIMILARITY or employee_id in prefixed
+        ]
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
+
+
+_lookup: EmployeeLookup | None = None
+_lookup_generation = -1
+_lookup_lock = threading.Lock()
+
+
+def get_employee_lookup() -> EmployeeLookup:
+    """
+    Gets the shared lookup index, rebuilt from the employee mirror whenever
+    the mirrored data changed
+
+    Returns:
+        EmployeeLookup: index over the mirrored employees
+    """
+    global _lookup, _lookup_generation
+
+    mirror = get_employee_mirror()
+    mirror.ensure_fresh()
+    with _lookup_lock:
+        if _lookup is None or _lookup_generation != mirror.generation:
+            generation = mirror.generation
+            _lookup = EmployeeLookup(mirror.all())
+            _lookup_generation = generation
+        return _lookup
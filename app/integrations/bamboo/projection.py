@@ -0,0 +1,136 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+from app.integrations.bamboo.absences import get_absence_index
+from app.integrations.bamboo.balance import (
+    VACATION_POLICY,
+    TimeOffPolicy,
+    project_team_balances,
+)
+from app.integrations.bamboo.time_off import get_time_off_balance
+from app.utils import submit_in_context
+
+# Balance held by BambooHR per (employee ID, date, time off type), with the time it
+# was fetched. `_openings_generation` changes on every invalidation, so a balance
+# fetched before one is not stored after it
+_openings: dict[tuple[str, str, str], tuple[float | None, float]] = {}
+_openings_generation = 0
+_openings_lock = threading.Lock()
+
+
+def get_opening_balances(
+    employee_ids: list[str], date: str, policy: TimeOffPolicy = VACATION_POLICY
+) -> dict[str, float | None]:
+    """
+    Gets the balances BambooHR holds on a date, with the carryover, accruals and
+    adjustments of each employee. They are cached for settings.BALANCE_CACHE_TTL
+    seconds, and the missing ones are fetched concurrently.
+
+    Args:
+        employee_ids (list[str])
+        date (str): Date in format YYYY-MM-DD
+        policy (TimeOffPolicy, optional): Defaults to VACATION_POLICY.
+
+    Returns:
+        dict[str, float | None]: balance in hours per employee, None if the employee has no such time off type
+    """
+    employee_ids = [str(employee_id) for employee_id in employee_ids]
+    balances: dict[str, float | None] = {}
+    with _openings_lock:
+        now = time.monotonic()
+        for employee_id in employee_ids:
+            cached = _openings.get((employee_id, date, policy.time_off_type_id))
+            if cached is not None and now - cached[1] < settings.BALANCE_CACHE_TTL:
+                balances[employee_id] = cached[0]
+        generation = _openings_generation
+
+    missing = [e for e in dict.fromkeys(employee_ids) if e not in balances]
+    if missing:
+        workers = min(len(missing), settings.BALANCE_FETCH_MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                employee_id: submit_in_context(
+                    pool,
+                    get_time_off_balance,
+                    employee_id,
+                    date,
+                    policy.time_off_type_id,
+                )
+                for employee_id in missing
+            }
+        fetched = {
+            employee_id: future.result() for employee_id, future in futures.items()
+        }
+        balances.update(fetched)
+
+        with _openings_lock:
+            now = time.monotonic()
+            for key in [
+                key
+                for key, (_, loaded_at) in _openings.items()
+                if now - loaded_at >= settings.BALANCE_CACHE_TTL
+            ]:
+                del _openings[key]
+            if generation == _openings_generation:
+                for employee_id, hours in fetched.items():
+                    _openings[(employee_id, date, policy.time_off_type_id)] = (
+                        hours,
+                        now,
+                    )
+
+    return {employee_id: balances[employee_id] for employee_id in employee_ids}
+
+
+def invalidate_opening_balances(employee_id: str | None = None) -> None:
+    """Drops the cached balances of an employee, or of every employee if None."""
+    global _openings_generation
+    with _openings_lock:
+        _openings_generation += 1
+        for key in list(_openings):
+            if employee_id is None or key[0] == str(employee_id):
+                del _openings[key]
+
+
+def estimate_balances(
+    employee_ids: list[str],
+    dates: list[str],
+    policy: TimeOffPolicy = VACATION_POLICY,
+    location: str | None = None,
+) -> dict[str, dict[str, float]]:
+    """
+    Projects the time off balances of many employees on many dates from the
+    cached BambooHR balances of today and the requests of the shared absence
+    index, so a warm team report makes no BambooHR call. Employees without a
+    BambooHR balance start from the policy grant.
+
+    Args:
+        employee_ids (list[str])
+        dates (list[str]): dates in format YYYY-MM-DD
+        policy (TimeOffPolicy, optional): Defaults to VACATION_POLICY.
+        location (str | None, optional): Defaults to None.
+
+    Returns:
+        dict[str, dict[str, float]]: balance in hours per employee and date
+    """
+    employee_ids = [str(employee_id) for employee_id in employee_ids]
+    today = datetime.date.today()
+    # BambooHR counts the requests up to today, the later ones are deducted locally
+    as_of = (today + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    end_date = max([as_of, *dates])
+
+    openings = get_opening_balances(employee_ids, today.strftime("%Y-%m-%d"), policy)
+    requests = get_absence_index(as_of, end_date).overlapping(as_of, end_date)
+    return project_team_balances(
+        employee_ids=employee_ids,
+        requests=requests,
+        dates=dates,
+        as_of=as_of,
+        initial_balances={
+            e: hours for e, hours in openings.items() if hours is not None
+        },
+        policy=policy,
+        location=location,
+    )
@@ -2,6 +2,9 @@ import datetime
 from typing import Any
 from urllib.parse import urlencode
 
+from app.config import settings
+from app.integrations.bamboo.balance import VACATION_POLICY
+from app.integrations.bamboo.leave import HOURS_PER_WORKING_DAY, calculate_leave_hours
 from app.integrations.bamboo.utils import RequestMethods, send_bamboo_request
 
 ##################### TO SET UP USER TIME OFF POLICIES #####################
@@ -51,8 +54,7 @@ def add_time_off_balance(employee_id: str) -> None:
         data={
             "timeOffTypeId": 78,  # Manual Vacation Policy See https://documentation.bamboohr.com/reference/get-time-off-policies
             "date": datetime.date.today().strftime("%Y-%m-%d"),
-            "amount": 25
-            * 8,  # 25 days of vacation per year from HR policy PDF, units in hours
+            "amount": VACATION_POLICY.grant_hours,  # 25 days of vacation per year from HR policy PDF, units in hours
         },
     )
 
@@ -63,50 +65,83 @@ def add_time_off_balance(employee_id: str) -> None:
 ##################### TO INTERACT WITH TIME OFF REQUESTS #####################
 
 
-def get_time_off_requests(employee_id: str) -> dict[str, Any]:
+def get_time_off_requests(
+    employee_id: str, start_date: str | None = None, end_date: str | None = None
+) -> list[dict[str, Any]]:
     """
     Gets all time off requests for an employee
 
     Args:
         employee_id (str)
+        start_date (str | None, optional): Date in format YYYY-MM-DD. Defaults to today.
+        end_date (str | None, optional): Date in format YYYY-MM-DD. Defaults to a year from today.
 
     Returns:
-        dict[str, Any]: JSON response from BambooHR API
+        list[dict[str, Any]]: JSON response from BambooHR API
     """
-    start_date = datetime.date.today().strftime("%Y-%m-%d")
-    end_date = (datetime.date.today() + datetime.timedelta(days=365)).strftime(
-        "%Y-%m-%d"
-    )
+    start_date = start_date or datetime.date.today().strftime("%Y-%m-%d")
+    end_date = end_date or (
+        datetime.date.today() + datetime.timedelta(days=365)
+    ).strftime("%Y-%m-%d")
     params = {"start": start_date, "end": end_date, "employeeId": employee_id}
     encoded_params = urlencode(params)
     res = send_bamboo_request(
         url_path=f"/time_off/requests/?{encoded_params}",
         method=RequestMethods.GET,
+        hedge_after=settings.BAMBOO_HEDGE_AFTER,
     )
 
     return res.json()
 
 
-def add_time_off_request(employee_id: str, start_date: str, end_date: str) -> str:
+def get_all_time_off_requests(start_date: str, end_date: str) -> list[dict[str, Any]]:
+    """
+    Gets the time off requests of every employee overlapping a date range in a single call
+
+    Args:
+        start_date (str): Date in format YYYY-MM-DD
+        end_date (str): Date in format YYYY-MM-DD
+
+    Raises:
+        Exception: Error getting time off requests
+
+    Returns:
+        list[dict[str, Any]]: JSON response from BambooHR API
+    """
+    encoded_params = urlencode({"start": start_date, "end": end_date})
+    res = send_bamboo_request(
+        url_path=f"/time_off/requests/?{encoded_params}",
+        method=RequestMethods.GET,
+    )
+
+    if res.status_code != 200:
+        raise Exception("Error getting time off requests")
+
+    return res.json()
+
+
+def add_time_off_request(
+    employee_id: str, start_date: str, end_date: str, location: str | None = None
+) -> str:
     """
     Adds a time off request for an employee
 
     Args:
         employee_id (str):
         start_date (str): Start date in format YYYY-MM-DD
-        end_date (str): End date in format YYYY-MM-DD
+        end_date (str): End date in format YYYY-MM-DD (inclusive)
+        location (str | None, optional): Employee location, selects the holiday calendar. Defaults to None.
 
     Returns:
         str: Request ID
     """
-    time_diff = datetime.datetime.strptime(
-        end_date, "%Y-%m-%d"
-    ) - datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    # Working days only, excluding weekends and public holidays (units are given in hours)
+    amount = float(calculate_leave_hours(start_date, end_date, location))
     data = {
         "status": "requested",  # Options: "approved", "denied" (or "declined"), "requested"
         "start": start_date,
         "end": end_date,
-        "amount": 8 * time_diff.days,  # 8h per working day (units are given in hours)
+        "amount": amount,
         "timeOffTypeId": 78,  # Indicates vacation, see: https://documentation.bamboohr.com/reference/get-time-off-types
     }
 
@@ -144,7 +179,9 @@ def cancel_time_off_request(request_id: str) -> None:
         raise Exception("Error cancelling time off request")
 
 
-def get_time_off_balance_estimate(employee_id: str, end_date: str) -> dict[str, Any]:
+def get_time_off_balance_estimate(
+    employee_id: str, end_date: str
+) -> list[dict[str, Any]]:
     """
     Estimates the time off balance for an employee
 
@@ -156,15 +193,42 @@ def get_time_off_balance_estimate(employee_id: str, end_date: str) -> dict[str,
         Exception: Error getting time off balance
 
     Returns:
-        dict[str, Any]: JSON response from BambooHR API
+        list[dict[str, Any]]: JSON response from BambooHR API, a balance per time off type
     """
     params_encoded = urlencode({"end": end_date})
     res = send_bamboo_request(
         url_path=f"/employees/{employee_id}/time_off/calculator/?{params_encoded}",
         method=RequestMethods.GET,
+        hedge_after=settings.BAMBOO_HEDGE_AFTER,
     )
 
     if res.status_code != 200:
         raise Exception("Error getting time off balance")
 
     return res.json()
+
+
+def get_time_off_balance(
+    employee_id: str,
+    date: str,
+    time_off_type_id: str = VACATION_POLICY.time_off_type_id,
+) -> float | None:
+    """
+    Gets the balance of a time off type on a date, as BambooHR computes it
+    with the carryover and adjustments of the employee
+
+    Args:
+        employee_id (str)
+        date (str): Date in format YYYY-MM-DD
+        time_off_type_id (str, optional): Defaults to the vacation policy type.
+
+    Returns:
+        float | None: balance in hours, None if the employee has no such time off type
+    """
+    for balance in get_time_off_balance_estimate(employee_id, date):
+        if str(balance.get("timeOffType")) == time_off_type_id:
+            hours = float(balance["balance"])
+            if balance.get("units") == "days":
+                hours *= HOURS_PER_WORKING_DAY
+            return hours
+    return None
@@ -2,10 +2,11 @@ import base64
 from dataclasses import dataclass
 from typing import Any
 
-import numpy as np
 import requests
 
 from app.config import settings
+from app.ratelimit import RATE_LIMITER
+from app.resilience import get_breaker, hedged
 
 
 @dataclass
@@ -15,7 +16,42 @@ class RequestMethods:
     PUT: str = "PUT"
 
 
-def send_bamboo_request(url_path: str, method: str, data: Any = None) -> Any:
+def _is_failure(response: requests.Response) -> bool:
+    """Server errors and throttling count against the breaker, client errors do not."""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def _send(method: str, url: str, headers: dict[str, str], data: Any) -> Any:
+    RATE_LIMITER.acquire("bamboo")
+    return get_breaker("bamboo").call(
+        requests.request,
+        method,
+        url,
+        headers=headers,
+        json=data,
+        timeout=settings.BAMBOO_TIMEOUT,
+        is_failure=_is_failure,
+    )
+
+
+def send_bamboo_request(
+    url_path: str, method: str, data: Any = None, hedge_after: float | None = None
+) -> Any:
+    """
+    Sends a request to the BambooHR API, through its rate limit and circuit breaker
+
+    Args:
+        url_path (str): path from the API base URL
+        method (str): HTTP method
+        data (Any, optional): JSON body. Defaults to None.
+        hedge_after (float | None, optional): seconds before a GET is sent again, only for idempotent calls. Defaults to no hedging.
+
+    Raises:
+        Exception: BambooHR is unavailable (open breaker)
+
+    Returns:
+        Any: the response
+    """
     headers = {
         "Authorization": "Basic "
         + base64.b64encode(f"{settings.BAMBOO_HR_API_KEY}:x".encode()).decode(),
@@ -24,21 +60,6 @@ def send_bamboo_request(url_path: str, method: str, data: Any = None) -> Any:
 
     url = settings.BAMBOO_HR_BASE_URL + url_path
 
-    response = requests.request(method, url, headers=headers, json=data)
-    return response
-
-
-def count_working_days(start_date: str, end_date: str) -> int:
-    # Convert the dates to numpy datetime64
-    start_date = np.datetime64(start_date)  # type: ignore
-    end_date = np.datetime64(end_date)  # type: ignore
-
-    # Get the total days array between start_date and end_date
-    total_days: np.ndarray = np.arange(start_date, end_date)
-
-    # Count the weekdays (monday to friday) only
-    weekdays = np.isin(
-        total_days.astype("datetime64[D]").view("int64") % 7, [0, 1, 2, 3, 4]
-    )
-
-    return np.count_nonzero(weekdays)
+    if hedge_after is not None and method == RequestMethods.GET:
+        return hedged(lambda: _send(method, url, headers, data), hedge_after, "bamboo")
+    return _send(method, url, headers, data)
@@ -0,0 +1,103 @@
+import datetime
+
+import numpy as np
+
+from app.integrations.bamboo.absences import AbsenceIndex, get_absence_index
+from app.integrations.bamboo.balance import (
+    VACATION_POLICY,
+    RequestArrays,
+    TimeOffPolicy,
+    project_policy_balances,
+)
+from app.integrations.bamboo.leave import calculate_leave_hours
+from app.integrations.bamboo.projection import get_opening_balances
+
+
+def validate_time_off_request(
+    employee_id: str,
+    start_date: str,
+    end_date: str,
+    location: str | None = None,
+    index: AbsenceIndex | None = None,
+    policy: TimeOffPolicy = VACATION_POLICY,
+) -> str | None:
+    """
+    Checks a time off request against the cached requests and the balance
+    projected from the cached BambooHR one before it is sent to BambooHR. The
+    cheap checks come first, so an overlap is rejected without a balance
+
+    Args:
+        employee_id (str)
+        start_date (str): Start date in format YYYY-MM-DD
+        end_date (str): End date in format YYYY-MM-DD (inclusive)
+        location (str | None, optional): Employee location, selects the holiday calendar. Defaults to None.
+        index (AbsenceIndex | None, optional): Index of existing requests. Defaults to the shared absence index.
+        policy (TimeOffPolicy, optional): Defaults to VACATION_POLICY.
+
+    Returns:
+        str | None: reason why the request is invalid, or None if it is valid
+    """
+    try:
+        start = datetime.date.fromisoformat(start_date)
+        end = datetime.date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        return f"The dates {start_date} and {end_date} must be valid dates in format YYYY-MM-DD"
+
+    if end < start:
+        return f"The end date {end_date} is before the start date {start_date}"
+
+    requested_hours = float(calculate_leave_hours(start_date, end_date, location))
+    if requested_hours == 0:
+        return f"There are no working days between {start_date} and {end_date}, they are weekends or public holidays"
+
+    # The shared index covers a year around today, so this is usually no call
+    today = datetime.date.today()
+    year_start = min(today, start).replace(month=1, day=1)
+    if index is None:
+        index = get_absence_index(year_start.strftime("%Y-%m-%d"), end_date)
+    overlapping = index.overlapping(start_date, end_date, employee_id=employee_id)
+    if overlapping:
+        existing = ", ".join(
+            f"request {request['id']} from {request['start']} to {request['end']}"
+            for request in overlapping
+        )
+        return f"The request overlaps existing time off requests of employee {employee_id}: {existing}"
+
+    # The balance is projected from the one BambooHR holds, with the carryover,
+    # accruals and adjustments, on the day before the request or today if
+    # earlier. It is cached with the balance tool's, so future requests usually
+    # make no call. Without one, from the grant at the start of the policy year
+    opening_date = min(today, start - datetime.timedelta(days=1))
+    opening = get_opening_balances(
+        [str(employee_id)], opening_date.strftime("%Y-%m-%d"), policy
+    )[str(employee_id)]
+    if opening is None:
+        as_of = year_start
+        opening = policy.grant_hours
+    else:
+        as_of = opening_date + datetime.timedelta(days=1)
+
+    # Project the balance with the new request included, on its end date and on
+    # the last day of each policy year it spans, as a new year grant may hide an overdraft
+    year_requests = index.overlapping(
+        as_of.strftime("%Y-%m-%d"), end_date, employee_id=employee_id
+    )
+    requests = RequestArrays.from_bamboo(year_requests, [str(employee_id)], policy)
+    requests = RequestArrays(
+        employee_idx=np.append(requests.employee_idx, 0),
+        starts=np.append(requests.starts, np.datetime64(start_date, "D")),
+        ends=np.append(requests.ends, np.datetime64(end_date, "D")),
+    )
+    dates = [f"{year}-12-31" for year in range(start.year, end.year)] + [end_date]
+    balance = project_policy_balances(
+        initial_balances=np.array([opening]),
+        requests=requests,
+        dates=dates,
+        as_of=as_of,
+        policy=policy,
+        location=location,
+    )[0].min()
+    if balance < 0:
+        return f"The request needs {requested_hours:g} hours but employee {employee_id} would be {-balance:g} hours over their time off balance"
+
+    return None
@@ -0,0 +1,234 @@
+import bisect
+import re
+from dataclasses import dataclass
+
+from langchain.docstore.document import Document
+
+from app.config import settings
+from app.utils import count_tokens, truncate_to_tokens
+
+# "**3. Compensation and Benefits**", "3.5 **Leave Policies**" or "**10.1 Overview**"
+HEADING_PATTERN = re.compile(
+    r"\*\*\s*(\d+(?:\.\d+)*)\.?\s+([^*]+?)\s*\*\*|\b(\d+\.\d+)\s+\*\*([^*]+?)\*\*"
+)
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?:])\s+")
+
+# Sections shorter than this (e.g. a chapter heading alone) join the next one
+MIN_SECTION_TOKENS = 16
+# Shortest common text for two retrieved chunks to be considered overlapping
+MIN_OVERLAP_CHARS = 20
+# Smallest truncated chunk worth adding to a packed context
+MIN_PARTIAL_TOKENS = 40
+
+
+@dataclass
+class Section:
+    title: str
+    text: str
+    page: int
+
+
+def normalise_text(text: str) -> str:
+    """Collapses whitespace. The PDF loader emits a newline after every word."""
+    return " ".join(text.split())
+
+
+def split_sections(pages: list[Document]) -> list[Section]:
+    """
+    Splits the pages of a document at its numbered section headings
+
+    Args:
+        pages (list[Document]): pages of the document, in order
+
+    Returns:
+        list[Section]: sections titled with their chapter and heading, e.g.
+            "3. Compensation and Benefits > 3.5 Leave Policies"
+    """
+    page_starts, parts, offset = [], [], 0
+    for page in pages:
+        page_starts.append(offset)
+        parts.append(normalise_text(page.page_content))
+        offset += len(parts[-1]) + 1
+    text = " ".join(parts)
+
+    matches = list(HEADING_PATTERN.finditer(text))
+    starts = [0] + [match.start() for match in matches]
+    ends = starts[1:] + [len(text)]
+
+    sections, chapter = [], ""
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        title = ""
+        if i > 0:
+            match = matches[i - 1]
+            number = match.group(1) or match.group(3)
+            heading = f"{number} {(match.group(2) or match.group(4)).strip()}"
+            if "." not in number:
+                chapter = f"{number}. {(match.group(2) or match.group(4)).strip()}"
+                heading = ""
+            title = " > ".join(part for part in (chapter, heading) if part)
+
+        body = text[start:end].strip()
+        if body:
+            page_number = bisect.bisect_right(page_starts, start) - 1
+            sections.append(Section(title=title, text=body, page=page_number))
+    return sections
+
+
+def _split_long_text(text: str, max_tokens: int, overlap_tokens: int) -> list[str]:
+    """Windows of whole sentences of at most `max_tokens`, repeating up to
+    `overlap_tokens` of sentences between consecutive windows."""
+    sentences: list[str] = []
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        if count_tokens(sentence) <= max_tokens:
+            sentences.append(sentence)
+            continue
+        # A run-on "sentence" (e.g. a list) is cut at word boundaries
+        words = sentence.split()
+        while words:
+            piece = truncate_to_tokens(" ".join(words), max_tokens)
+            n_words = max(1, len(piece.split()) - 1)
+            sentences.append(" ".join(words[:n_words]))
+            words = words[n_words:]
+
+    windows: list[str] = []
+    window: list[str] = []
+    window_tokens = 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence) + 1
+        if window and window_tokens + tokens > max_tokens:
+            windows.append(" ".join(window))
+            overlap: list[str] = []
+            overlap_size = 0
+            for previous in reversed(window):
+                size = count_tokens(previous) + 1
+                if overlap_size + size > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += size
+            window, window_tokens = overlap, overlap_size
+        window.append(sentence)
+        window_tokens += tokens
+    if window:
+        windows.append(" ".join(window))
+    return windows
+
+
+def split_documents(
+    pages: list[Document],
+    max_tokens: int = settings.CHUNK_MAX_TOKENS,
+    overlap_tokens: int = settings.CHUNK_OVERLAP_TOKENS,
+) -> list[Document]:
+    """
+    Chunks a document along its sections, to a number of tokens. A section
+    that fits is one chunk, longer ones are split between sentences.
+
+    Args:
+        pages (list[Document]): pages of the document, in order
+        max_tokens (int, optional): Defaults to settings.CHUNK_MAX_TOKENS.
+        overlap_tokens (int, optional): Defaults to settings.CHUNK_OVERLAP_TOKENS.
+
+    Returns:
+        list[Document]: chunks with the "source", "page" and "section" metadata
+    """
+    source = pages[0].metadata.get("source") if pages else None
+
+    sections: list[Section] = []
+    pending: Section | None = None
+    for section in split_sections(pages):
+        if pending is not None:
+            section = Section(
+                title=section.title,
+                text=f"{pending.text} {section.text}",
+                page=pending.page,
+            )
+            pending = None
+        if count_tokens(section.text) < MIN_SECTION_TOKENS:
+            pending = section
+        else:
+            sections.append(section)
+    if pending is not None:
+        sections.append(pending)
+
+    return [
+        Document(
+            page_content=text,
+            metadata={"source": source, "page": section.page, "section": section.title},
+        )
+        for section in sections
+        for text in _split_long_text(section.text, max_tokens, overlap_tokens)
+    ]
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest end of `first` that starts `second`, 0 if too short."""
+    start = first.find(second[:MIN_OVERLAP_CHARS])
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(second[:MIN_OVERLAP_CHARS], start + 1)
+    return 0
+
+
+def merge_chunks(docs: list[Document]) -> list[Document]:
+    """
+    Drops retrieved chunks contained in others and merges the ones whose
+    texts overlap, so no span is repeated. Keeps the order of relevance.
+
+    Args:
+        docs (list[Document]): retrieved chunks, most relevant first
+
+    Returns:
+        list[Document]: merged chunks
+    """
+    merged: list[Document] = []
+    for doc in docs:
+        text = normalise_text(doc.page_content)
+        metadata = dict(doc.metadata)
+        # A merged chunk may now overlap a kept one, so merge until stable
+        while True:
+            for i, kept in enumerate(merged):
+                if text in kept.page_content:
+                    text, metadata = kept.page_content, kept.metadata
+                elif kept.page_content in text:
+                    metadata = kept.metadata
+                elif overlap := _overlap(kept.page_content, text):
+                    text, metadata = kept.page_content + text[overlap:], kept.metadata
+                elif overlap := _overlap(text, kept.page_content):
+                    text = text + kept.page_content[overlap:]
+                    metadata = kept.metadata
+                else:
+                    continue
+                del merged[i]
+                break
+            else:
+                break
+        merged.append(Document(page_content=text, metadata=metadata))
+    return merged
+
+
+def pack_context(
+    docs: list[Document], max_tokens: int = settings.QA_CONTEXT_MAX_TOKENS
+) -> str:
+    """
+    Renders retrieved chunks as a prompt context within a token budget
+
+    Args:
+        docs (list[Document]): retrieved chunks, most relevant first
+        max_tokens (int, optional): Defaults to settings.QA_CONTEXT_MAX_TOKENS.
+
+    Returns:
+        str: merged chunks under their section titles, most relevant first
+    """
+    blocks: list[str] = []
+    used = 0
+    for doc in merge_chunks(docs):
+        section = doc.metadata.get("section")
+        block = f"[{section}]\n{doc.page_content}" if section else doc.page_content
+        tokens = count_tokens(block)
+        if used + tokens > max_tokens:
+            if max_tokens - used >= MIN_PARTIAL_TOKENS:
+                blocks.append(truncate_to_tokens(block, max_tokens - used))
+            break
+        blocks.append(block)
+        used += tokens + 2
+    return "\n\n".join(blocks)
@@ -1,47 +1,243 @@
 import pickle
 from pathlib import Path
+from typing import Callable
 
+# Missing typed stubs
+import faiss  # type: ignore
+import numpy as np
 from langchain.chat_models import ChatOpenAI
+from langchain.docstore.document import Document
 from langchain.document_loaders import PyPDFLoader
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
 
 from app.config import settings
+from app.integrations.chunking import pack_context, split_documents
 
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+SQ8 = "sq8"
+PQ = "pq"
+VECTOR_STORAGES = (FLOAT32, FLOAT16, SQ8, PQ)
 
-def build_index(pdf_path_str: str, use_cached: bool = True) -> FAISS:
+# Product quantization trains 2**nbits centroids per sub-vector, which needs
+# at least as many vectors. Smaller corpora fall back to float16.
+PQ_MIN_NBITS = 4
+PQ_MAX_NBITS = 8
+
+
+def compress_vectors(
+    vectors: np.ndarray,
+    storage: str,
+    pq_subquantizers: int = settings.VECTOR_PQ_SUBQUANTIZERS,
+) -> faiss.Index:
+    """
+    Builds a FAISS index holding compressed copies of the vectors
+
+    Args:
+        vectors (np.ndarray): (N, D) float32 vectors
+        storage (str): "float16", "sq8" or "pq"
+        pq_subquantizers (int, optional): bytes per vector with 8-bit PQ codes. Defaults to settings.VECTOR_PQ_SUBQUANTIZERS.
+
+    Returns:
+        faiss.Index: L2 index over the compressed vectors
+    """
+    dimension = vectors.shape[1]
+    nbits = min(PQ_MAX_NBITS, int(np.log2(max(len(vectors), 1))))
+    if storage == PQ and nbits >= PQ_MIN_NBITS and dimension % pq_subquantizers == 0:
+        index = faiss.IndexPQ(dimension, pq_subquantizers, nbits)
+        # Small corpora are expected, don't warn about the few training points
+        index.pq.cp.min_points_per_centroid = 1
+        index.train(vectors)
+    else:
+        quantizer = (
+            faiss.ScalarQuantizer.QT_8bit
+            if storage == SQ8
+            else faiss.ScalarQuantizer.QT_fp16
+        )
+        index = faiss.IndexScalarQuantizer(dimension, quantizer, faiss.METRIC_L2)
+        # Learns the range of each dimension, a no-op for float16
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+class CompressedFAISS:
+    """Policy index keeping only compressed vectors in memory.
+
+    Candidates are searched over float16, 8-bit or product-quantized codes, then
+    re-ranked exactly with the float32 vectors. Those stay on disk in a
+    memory-mapped .npy file, and only the rows of the candidates are read.
+    Searches return the same documents and L2 scores as the LangChain FAISS
+    store it is built from.
+    """
+
+    def __init__(
+        self,
+        index: faiss.Index,
+        documents: list[Document],
+        vectors_path: Path,
+        embedding_function: Callable[[str], list[float]] | None = None,
+        rerank_factor: int = settings.VECTOR_RERANK_FACTOR,
+    ) -> None:
+        """
+        Args:
+            index (faiss.Index): index over the compressed vectors
+            documents (list[Document]): document of each vector, in index order
+            vectors_path (Path): .npy file with the float32 vectors
+            embedding_function (Callable[[str], list[float]] | None, optional): embeds text queries. Defaults to OpenAI embeddings.
+            rerank_factor (int, optional): candidates re-ranked per result. Defaults to settings.VECTOR_RERANK_FACTOR.
+        """
+        self.index = index
+        self.documents = documents
+        self.vectors = np.load(vectors_path, mmap_mode="r")
+        self.rerank_factor = rerank_factor
+        self._embedding_function = embedding_function
+
+    @staticmethod
+    def paths(prefix: Path, storage: str) -> tuple[Path, Path, Path]:
+        """Files of the compressed index, the float32 vectors and the documents."""
+        # Appended to the whole name, dots in the file name are not a suffix
+        return (
+            prefix.parent / f"{prefix.name}.{storage}.faiss",
+            prefix.parent / f"{prefix.name}.vectors.npy",
+            prefix.parent / f"{prefix.name}.docs.pickle",
+        )
+
+    @classmethod
+    def from_faiss(cls, store: FAISS, prefix: Path, storage: str) -> "CompressedFAISS":
+        """
+        Compresses a LangChain FAISS store and saves it next to `prefix`
+
+        Args:
+            store (FAISS): full-precision store
+            prefix (Path): path of the saved files, without suffix
+            storage (str): "float16", "sq8" or "pq"
+
+        Returns:
+            CompressedFAISS: the compressed store
+        """
+        index_path, vectors_path, documents_path = cls.paths(prefix, storage)
+        vectors = store.index.reconstruct_n(0, store.index.ntotal)
+        documents = [
+            store.docstore.search(store.index_to_docstore_id[i])
+            for i in range(len(vectors))
+        ]
+
+        np.save(vectors_path, vectors.astype(np.float32))
+        with open(documents_path, "wb") as handle:
+            pickle.dump(documents, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        index = compress_vectors(vectors, storage)
+        faiss.write_index(index, index_path.as_posix())
+
+        return cls(index, documents, vectors_path, store._embed_query)
+
+    @classmethod
+    def load(cls, prefix: Path, storage: str) -> "CompressedFAISS":
+        index_path, vectors_path, documents_path = cls.paths(prefix, storage)
+        with open(documents_path, "rb") as handle:
+            documents = pickle.load(handle)
+        return cls(faiss.read_index(index_path.as_posix()), documents, vectors_path)
+
+    @classmethod
+    def exists(cls, prefix: Path, storage: str) -> bool:
+        return all(path.exists() for path in cls.paths(prefix, storage))
+
+    def embed_query(self, query: str) -> list[float]:
+        if self._embedding_function is None:
+            self._embedding_function = OpenAIEmbeddings().embed_query
+        return self._embedding_function(query)
+
+    def search(self, vector: np.ndarray, k: int = 4) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest vectors to a query, re-ranked with the full-precision vectors
+
+        Args:
+            vector (np.ndarray): (D,) query vector
+            k (int, optional): number of results. Defaults to 4.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: positions and squared L2 distances, closest first
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        n_candidates = min(self.index.ntotal, k * self.rerank_factor)
+        _, candidates = self.index.search(query, n_candidates)
+        # Sorted positions read the memory-mapped file sequentially
+        candidates = np.sort(candidates[0][candidates[0] >= 0])
+
+        distances = ((self.vectors[candidates] - query) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return candidates[order], distances[order]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: list[float], k: int = 4
+    ) -> list[tuple[Document, float]]:
+        positions, distances = self.search(np.array(embedding), k)
+        return [
+            (self.documents[position], float(distance))
+            for position, distance in zip(positions, distances)
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4
+    ) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def memory_bytes(self) -> dict[str, int]:
+        """Resident size of the vectors and of the document texts."""
+        return {
+            "vectors": self.index.sa_code_size() * self.index.ntotal,
+            "documents": sum(len(doc.page_content.encode()) for doc in self.documents),
+        }
+
+
+def build_index(
+    pdf_path_str: str, use_cached: bool = True, storage: str = settings.VECTOR_STORAGE
+) -> FAISS | CompressedFAISS:
     """
     Build a FAISS index from a PDF file.
 
     Args:
         pdf_path_str (str): path to the PDF file
         use_cached (bool, optional): whether to use the cached index. Defaults to True.
+        storage (str, optional): vector storage, "float32", "float16", "sq8" or "pq". Defaults to settings.VECTOR_STORAGE.
 
     Raises:
         FileNotFoundError: if the PDF file does not exist
+        ValueError: if the vector storage is unknown
 
     Returns:
-        FAISS: the Langchain FAISS index object
+        FAISS | CompressedFAISS: the Langchain FAISS index object, or its compressed version
     """
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Unknown vector storage {storage}")
+
     pdf_path = Path(pdf_path_str).resolve()
     if not pdf_path.exists():
         raise FileNotFoundError(f"File {pdf_path} does not exist")
 
+    prefix = pdf_path.with_suffix("")
+    if storage != FLOAT32 and use_cached and CompressedFAISS.exists(prefix, storage):
+        return CompressedFAISS.load(prefix, storage)
+
     pickle_filepath = Path(pdf_path_str.replace(".pdf", ".pickle")).resolve()
     if pickle_filepath.exists() and use_cached:
         with open(pickle_filepath, "rb") as handle:
             faiss_index = pickle.load(handle)
     else:
         loader = PyPDFLoader(pdf_path.as_posix())
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=250, chunk_overlap=50)
-        all_splits = text_splitter.split_documents(loader.load())
+        all_splits = split_documents(loader.load())
 
         faiss_index = FAISS.from_documents(all_splits, OpenAIEmbeddings())
 
         with open(pickle_filepath, "wb") as handle:
             pickle.dump(faiss_index, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
+    if storage != FLOAT32:
+        return CompressedFAISS.from_faiss(faiss_index, prefix, storage)
     return faiss_index
 
 
@@ -58,8 +254,7 @@ if __name__ == "__main__":
     else:
         loader = PyPDFLoader(pdf_path.as_posix())
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=250, chunk_overlap=50)
-        all_splits = text_splitter.split_documents(loader.load())
+        all_splits = split_documents(loader.load())
 
         faiss_index = FAISS.from_documents(all_splits, OpenAIEmbeddings())
         with open(pickle_filepath, "wb") as handle_wb:
@@ -70,13 +265,13 @@ if __name__ == "__main__":
 
     llm = ChatOpenAI(temperature=0.1, model=settings.OPENAI_MODEL)
 
-    clean_docs = [doc.page_content for doc in docs]
+    context = pack_context(docs)
     result = llm.predict(
         f"""You are a helpful question-answering assistant. You are asked the following question:\n\n
         "{query}"\n
 
         You have to answer the question. You can use the following information:\n\n
-        {clean_docs}\n
+        {context}\n
 
         Be concise. Answer:"
         """
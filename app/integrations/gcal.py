@@ -1,33 +1,83 @@
 import datetime
-from typing import Any
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Collection
+from zoneinfo import ZoneInfo
 
 from app.config import settings
 from app.integrations.google_auth import GoogleService, get_google_service
+from app.ratelimit import RATE_LIMITER, Priority
+from app.resilience import get_breaker
 
+# Calendars accepted by a single free/busy query
+FREEBUSY_MAX_CALENDARS = 50
+# Calls sent in a single batch request, the limit recommended for Calendar
+BATCH_MAX_REQUESTS = 50
+BATCH_MAX_RETRIES = 3
+BATCH_RETRY_BACKOFF_SECONDS = 1.0
+# Rate limits and server errors of the calls in a batch
+RETRYABLE_STATUSES = {429, 500, 502, 503}
 
-def schedule_event(
-    service: Any,
+Interval = tuple[datetime.datetime, datetime.datetime]
+
+
+def new_event_id() -> str:
+    """Client-side event ID. Hex digits are valid base32hex, as the API requires."""
+    return uuid.uuid4().hex
+
+
+@dataclass
+class EventRequest:
+    """An event to create, or to update if `update` is set.
+
+    The event ID is chosen on our side, so retrying a request that was applied
+    (e.g. a batch cut by a timeout) does not create a duplicate event.
+    """
+
+    summary: str
+    start_time: str
+    end_time: str
+    attendees: list[str] = field(default_factory=list)
+    timezone: str = "UTC"
+    event_id: str = field(default_factory=new_event_id)
+    update: bool = False
+
+
+@dataclass
+class EventResult:
+    request: EventRequest
+    event_id: str | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def build_event_body(
     summary: str,
     start_time: str,
     end_time: str,
     attendees: list[str] = [],
     timezone: str = "UTC",
-) -> str:
+    conference_request_id: str | None = None,
+) -> dict[str, Any]:
     """
-    Schedule and event in Google Calendar.
+    Body of a Google Calendar event
 
     Args:
-        service (Any): Google Calendar API service object
         summary (str): Title of the event
         start_time (str): Start time of the event in ISO format
         end_time (str): End time of the event in ISO format
         attendees (list[str], optional): list of attendees emails. Defaults to [].
         timezone (str, optional): timezone. Defaults to "UTC".
+        conference_request_id (str | None, optional): ID of the Meet creation request, a repeated ID is ignored by Google. Defaults to a new one.
 
     Returns:
-        str: event ID
+        dict[str, Any]: event body, with a Meet conference if there are attendees
     """
-    event = {
+    event: dict[str, Any] = {
         "summary": summary,
         "start": {
             "dateTime": start_time,
@@ -44,9 +94,36 @@ def schedule_event(
         event["conferenceData"] = {
             "createRequest": {
                 "conferenceSolutionKey": {"type": "hangoutsMeet"},
-                "requestId": "randomString",
+                "requestId": conference_request_id or uuid.uuid4().hex,
             }
         }
+    return event
+
+
+def schedule_event(
+    service: Any,
+    summary: str,
+    start_time: str,
+    end_time: str,
+    attendees: list[str] = [],
+    timezone: str = "UTC",
+) -> str:
+    """
+    Schedule and event in Google Calendar. A single event can have many
+    attendees, e.g. a welcome session shared by a cohort of new hires.
+
+    Args:
+        service (Any): Google Calendar API service object
+        summary (str): Title of the event
+        start_time (str): Start time of the event in ISO format
+        end_time (str): End time of the event in ISO format
+        attendees (list[str], optional): list of attendees emails. Defaults to [].
+        timezone (str, optional): timezone. Defaults to "UTC".
+
+    Returns:
+        str: event ID
+    """
+    event = build_event_body(summary, start_time, end_time, attendees, timezone)
 
     event = (
         service.events()
@@ -54,7 +131,313 @@ def schedule_event(
         .execute()
     )
 
-    return event["id"]  # type: ignore
+    return event["id"]
+
+
+def _event_http_request(service: Any, request: EventRequest) -> Any:
+    if request.update:
+        # A patch keeps the fields not sent, e.g. the existing Meet conference
+        body = build_event_body(
+            request.summary,
+            request.start_time,
+            request.end_time,
+            request.attendees,
+            request.timezone,
+        )
+        body.pop("conferenceData", None)
+        return service.events().patch(
+            calendarId="primary", eventId=request.event_id, body=body
+        )
+
+    body = build_event_body(
+        request.summary,
+        request.start_time,
+        request.end_time,
+        request.attendees,
+        request.timezone,
+        # Retrying the insert must not create a second conference either
+        conference_request_id=request.event_id,
+    )
+    body["id"] = request.event_id
+    return service.events().insert(
+        calendarId="primary", body=body, conferenceDataVersion=1
+    )
+
+
+def _error_status(exception: Exception) -> int | None:
+    response = getattr(exception, "resp", None)
+    return getattr(response, "status", None)
+
+
+def _is_retryable(exception: Exception) -> bool:
+    status = _error_status(exception)
+    # Calendar reports most rate limits as 403 with a rateLimitExceeded reason
+    content = getattr(exception, "content", b"") or b""
+    return status in RETRYABLE_STATUSES or (
+        status == 403 and b"ateLimitExceeded" in content
+    )
+
+
+def schedule_events(
+    service: Any, requests: list[EventRequest], max_retries: int = BATCH_MAX_RETRIES
+) -> list[EventResult]:
+    """
+    Creates or updates many events with Google batch requests, one per
+    BATCH_MAX_REQUESTS events. The events rate limited or failing with a server
+    error, and those of a batch that failed as a whole, are sent again in a new
+    batch, after a backoff.
+
+    Args:
+        service (Any): Google Calendar API service object
+        requests (list[EventRequest]): events to create or update
+        max_retries (int, optional): batches sent again for the failed events. Defaults to BATCH_MAX_RETRIES.
+
+    Returns:
+        list[EventResult]: result of each event, in the order of `requests`
+    """
+    results = [EventResult(request=request) for request in requests]
+    retryable: list[int] = []
+
+    def callback(request_id: str, response: Any, exception: Exception | None) -> None:
+        i = int(request_id)
+        status = _error_status(exception) if exception else None
+        if exception is None:
+            results[i].event_id, results[i].error = response["id"], None
+        elif status == 409 and not requests[i].update:
+            # Already created by a previous attempt with the same event ID
+            results[i].event_id, results[i].error = requests[i].event_id, None
+        else:
+            results[i].error = str(exception)
+            if _is_retryable(exception):
+                retryable.append(i)
+
+    pending = list(range(len(requests)))
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(BATCH_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        retryable.clear()
+        for start in range(0, len(pending), BATCH_MAX_REQUESTS):
+            chunk = pending[start : start + BATCH_MAX_REQUESTS]
+            # Each call of a batch counts against the quota
+            RATE_LIMITER.acquire("google.calendar", len(chunk), Priority.BULK)
+            batch = service.new_batch_http_request(callback=callback)
+            for i in chunk:
+                batch.add(_event_http_request(service, requests[i]), request_id=str(i))
+            try:
+                get_breaker("google.calendar").call(batch.execute)
+            except Exception as error:
+                # The batch failed as a whole, e.g. a timeout or an open breaker:
+                # the events without a result are sent again, their IDs make it safe
+                for i in chunk:
+                    if results[i].event_id is None and i not in retryable:
+                        results[i].error = str(error)
+                        if _error_status(error) is None or _is_retryable(error):
+                            retryable.append(i)
+        if not retryable:
+            break
+        pending = sorted(retryable)
+    return results
+
+
+def schedule_cohort_events(
+    service: Any,
+    summary: str,
+    start_time: str,
+    end_time: str,
+    new_hires: list[str],
+    hosts: list[str] = [],
+    timezone: str = "UTC",
+    shared: bool = False,
+) -> list[EventResult]:
+    """
+    Schedules the same onboarding meeting for a cohort of new hires, either as
+    one event per new hire or as a single event they all attend
+
+    Args:
+        service (Any): Google Calendar API service object
+        summary (str): Title of the events
+        start_time (str): Start time of the events in ISO format
+        end_time (str): End time of the events in ISO format
+        new_hires (list[str]): emails of the new hires
+        hosts (list[str], optional): emails of the attendees of every event. Defaults to [].
+        timezone (str, optional): timezone. Defaults to "UTC".
+        shared (bool, optional): a single event for the whole cohort. Defaults to False.
+
+    Returns:
+        list[EventResult]: result of each event
+    """
+    if shared:
+        requests = [
+            EventRequest(summary, start_time, end_time, hosts + new_hires, timezone)
+        ]
+    else:
+        requests = [
+            EventRequest(summary, start_time, end_time, hosts + [email], timezone)
+            for email in new_hires
+        ]
+    return schedule_events(service, requests)
+
+
+def query_free_busy(
+    service: Any,
+    calendars: list[str],
+    time_min: datetime.datetime,
+    time_max: datetime.datetime,
+) -> dict[str, list[Interval]]:
+    """
+    Gets the busy intervals of several calendars with one free/busy query
+    (one per FREEBUSY_MAX_CALENDARS calendars)
+
+    Args:
+        service (Any): Google Calendar API service object
+        calendars (list[str]): calendar IDs, i.e. attendees emails
+        time_min (datetime.datetime): start of the window, timezone-aware
+        time_max (datetime.datetime): end of the window, timezone-aware
+
+    Raises:
+        Exception: Error getting the free/busy information of a calendar
+
+    Returns:
+        dict[str, list[Interval]]: busy intervals of each calendar, in UTC
+    """
+    busy: dict[str, list[Interval]] = {}
+    for i in range(0, len(calendars), FREEBUSY_MAX_CALENDARS):
+        body = {
+            "timeMin": time_min.isoformat(),
+            "timeMax": time_max.isoformat(),
+            "items": [{"id": c} for c in calendars[i : i + FREEBUSY_MAX_CALENDARS]],
+        }
+        response = service.freebusy().query(body=body).execute()
+
+        for calendar_id, calendar in response["calendars"].items():
+            # Calendars we cannot see (e.g. external attendees) are treated as free
+            errors = calendar.get("errors", [])
+            if any(error.get("reason") != "notFound" for error in errors):
+                raise Exception(f"Error getting the free/busy of {calendar_id}")
+            busy[calendar_id] = [
+                (
+                    datetime.datetime.fromisoformat(interval["start"]),
+                    datetime.datetime.fromisoformat(interval["end"]),
+                )
+                for interval in calendar.get("busy", [])
+            ]
+    return busy
+
+
+def merge_intervals(intervals: list[Interval]) -> list[Interval]:
+    """Merges overlapping or touching intervals, in a single sweep over them
+    sorted by start."""
+    merged: list[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def find_free_slots(
+    busy: list[Interval],
+    window_start: datetime.datetime,
+    window_end: datetime.datetime,
+    duration: datetime.timedelta,
+    timezone: str = settings.CALENDAR_TIMEZONE,
+    working_hours: tuple[int, int] = settings.CALENDAR_WORKING_HOURS,
+    weekmask: str = "1111100",
+    holidays: Collection[str] = (),
+) -> list[Interval]:
+    """
+    Free slots long enough for a meeting, within the working hours of the
+    working days of a window
+
+    Args:
+        busy (list[Interval]): busy intervals of all the attendees, timezone-aware
+        window_start (datetime.datetime): timezone-aware
+        window_end (datetime.datetime): timezone-aware
+        duration (datetime.timedelta): meeting duration
+        timezone (str, optional): IANA timezone of the working hours. Defaults to settings.CALENDAR_TIMEZONE.
+        working_hours (tuple[int, int], optional): start and end hours. Defaults to settings.CALENDAR_WORKING_HOURS.
+        weekmask (str, optional): working days of the week, Monday first. Defaults to "1111100".
+        holidays (Collection[str], optional): non-working days in format YYYY-MM-DD. Defaults to ().
+
+    Returns:
+        list[Interval]: free slots in the given timezone, earliest first
+    """
+    tz = ZoneInfo(timezone)
+    merged = merge_intervals(busy)
+
+    slots: list[Interval] = []
+    day = window_start.astimezone(tz).date()
+    position = 0  # busy intervals ending before the current day are skipped
+    while day <= window_end.astimezone(tz).date():
+        if weekmask[day.weekday()] == "1" and day.isoformat() not in holidays:
+            # Wall-clock working hours, so DST changes are handled by zoneinfo
+            free_start = max(
+                datetime.datetime.combine(day, datetime.time(working_hours[0]), tz),
+                window_start.astimezone(tz),
+            )
+            day_end = min(
+                datetime.datetime.combine(day, datetime.time(working_hours[1]), tz),
+                window_end.astimezone(tz),
+            )
+            while position < len(merged) and merged[position][1] <= free_start:
+                position += 1
+
+            for busy_start, busy_end in merged[position:]:
+                if busy_start >= day_end:
+                    break
+                if busy_start - free_start >= duration:
+                    slots.append((free_start, busy_start.astimezone(tz)))
+                free_start = max(free_start, busy_end.astimezone(tz))
+            if day_end - free_start >= duration:
+                slots.append((free_start, day_end))
+        day += datetime.timedelta(days=1)
+    return slots
+
+
+def find_earliest_slot(
+    service: Any,
+    attendees: list[str],
+    duration: datetime.timedelta,
+    window_start: datetime.datetime,
+    window_end: datetime.datetime,
+    timezone: str = settings.CALENDAR_TIMEZONE,
+    **kwargs: Any,
+) -> Interval | None:
+    """
+    Finds the earliest slot when all the attendees are free, with a single
+    free/busy query for the whole window
+
+    Args:
+        service (Any): Google Calendar API service object
+        attendees (list[str]): attendees emails
+        duration (datetime.timedelta): meeting duration
+        window_start (datetime.datetime): naive datetimes are in `timezone`
+        window_end (datetime.datetime): naive datetimes are in `timezone`
+        timezone (str, optional): IANA timezone. Defaults to settings.CALENDAR_TIMEZONE.
+        **kwargs: working hours and days, see `find_free_slots`
+
+    Returns:
+        Interval | None: start and end of the slot in `timezone`, None if there is none in the window
+    """
+    tz = ZoneInfo(timezone)
+    window_start = (
+        window_start if window_start.tzinfo else window_start.replace(tzinfo=tz)
+    )
+    window_end = window_end if window_end.tzinfo else window_end.replace(tzinfo=tz)
+
+    busy = query_free_busy(service, attendees, window_start, window_end)
+    slots = find_free_slots(
+        [interval for intervals in busy.values() for interval in intervals],
+        window_start,
+        window_end,
+        duration,
+        timezone=timezone,
+        **kwargs,
+    )
+    if not slots:
+        return None
+    return slots[0][0], slots[0][0] + duration
 
 
 def delete_event(service: Any, event_id: str) -> None:
@@ -1,12 +1,23 @@
 import enum
 import os
 import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
 from typing import Any
 
 # Missing typed stubs
 from google.auth.transport.requests import Request  # type: ignore
 from google_auth_oauthlib.flow import InstalledAppFlow  # type: ignore
 from googleapiclient.discovery import build  # type: ignore
+from googleapiclient.errors import HttpError  # type: ignore
+from googleapiclient.http import HttpRequest  # type: ignore
+
+from app.config import settings
+from app.ratelimit import RATE_LIMITER
+from app.resilience import get_breaker
 
 
 class GoogleService(enum.Enum):
@@ -20,6 +31,161 @@ SERVICE_TO_VERSION: dict[GoogleService, str] = {
 }
 
 
+class UpstreamHttpRequest(HttpRequest):
+    """API request going through the rate limit and the circuit breaker of its
+    upstream before each call."""
+
+    upstream = "google"
+
+    def execute(self, http: Any = None, num_retries: int = 0) -> Any:
+        RATE_LIMITER.acquire(self.upstream)
+        breaker = get_breaker(self.upstream)
+        breaker.before_call()
+        start = time.monotonic()
+        try:
+            response = super().execute(http=http, num_retries=num_retries)
+        except HttpError as error:
+            # Client errors (e.g. a missing event) say nothing about the upstream health
+            status = error.resp.status
+            breaker.record(status >= 500 or status == 429, time.monotonic() - start)
+            raise
+        except Exception:
+            breaker.record(True, time.monotonic() - start)
+            raise
+        breaker.record(False, time.monotonic() - start)
+        return response
+
+
+# Request class of each service, limited by the "google.<service>" bucket and breaker
+REQUEST_BUILDERS: dict[GoogleService, type[UpstreamHttpRequest]] = {
+    service: type(
+        f"{service.name.title()}HttpRequest",
+        (UpstreamHttpRequest,),
+        {"upstream": f"google.{service.value}"},
+    )
+    for service in GoogleService
+}
+
+
+class GoogleCredentialStore:
+    """Process-wide store for the Google OAuth credentials.
+
+    The credentials are loaded from disk once and then served from memory.
+    Refreshes are single-flight: when the token expires, the first caller
+    refreshes it while the others wait on the lock and reuse the result. A new
+    authorization is single-flight too, but runs outside the lock.
+    The token file is only rewritten after a refresh or a new authorization,
+    and always through an atomic replace so readers never see a partial file.
+    """
+
+    def __init__(self, token_path: str | Path) -> None:
+        self.token_path = Path(token_path)
+        self._creds: Any = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._authorization: Future[Any] | None = None
+
+    def get_credentials(
+        self,
+        client_config: dict[str, dict[str, str | list[str]]],
+        scopes: list[str],
+        use_cache: bool = True,
+    ) -> Any:
+        """Get valid credentials, refreshing or authorizing them if needed.
+
+        Args:
+            client_config (dict[str, dict[str, str  |  list[str]]]): Dictionary with the client configuration credentials.
+            scopes (list[str]): List of scopes to request during the authorization flow.
+            use_cache (bool, optional): whether to reuse the stored credentials. Defaults to True.
+
+        Returns:
+            Any: valid Google credentials
+        """
+        # Fast path: no locking and no disk access in the steady state
+        creds = self._creds
+        if use_cache and creds is not None and creds.valid:
+            return creds
+
+        with self._lock:
+            # Another thread may have refreshed the credentials while we waited
+            if use_cache and self._creds is not None and self._creds.valid:
+                return self._creds
+
+            if use_cache and not self._loaded:
+                self._creds = self._load()
+                self._loaded = True
+
+            creds = self._creds if use_cache else None
+            if creds and creds.valid:
+                return creds
+
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+                self._save(creds)
+                self._creds = creds
+                return creds
+
+            # The user authorizes in the browser, which can take minutes, so the
+            # flow runs outside the lock. Callers arriving meanwhile wait for its result
+            authorization = self._authorization
+            if authorization is None:
+                authorization = self._authorization = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return authorization.result()
+
+        try:
+            flow = InstalledAppFlow.from_client_config(client_config, scopes)
+            creds = flow.run_local_server(port=0)
+            with self._lock:
+                self._save(creds)
+                self._creds = creds
+                self._loaded = True
+        except BaseException as error:
+            authorization.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                self._authorization = None
+        authorization.set_result(creds)
+        return creds
+
+    def clear(self) -> None:
+        """Forget the in-memory credentials so they are reloaded from disk."""
+        with self._lock:
+            self._creds = None
+            self._loaded = False
+
+    def _load(self) -> Any:
+        if not self.token_path.exists():
+            return None
+        with open(self.token_path, "rb") as token:
+            return pickle.load(token)
+
+    def _save(self, creds: Any) -> None:
+        self.token_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.token_path.parent, prefix=f".{self.token_path.name}."
+        )
+        try:
+            with os.fdopen(fd, "wb") as token:
+                pickle.dump(creds, token)
+            os.replace(tmp_path, self.token_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+CREDENTIAL_STORE = GoogleCredentialStore(settings.GOOGLE_TOKEN_PATH)
+
+# Service objects wrap an httplib2 connection, which is not thread-safe, so
+# they are cached per thread and rebuilt whenever the credentials change
+_services = threading.local()
+
+
 def get_google_service(
     service_name: GoogleService,
     client_config: dict[str, dict[str, str | list[str]]],
@@ -36,23 +202,23 @@ def get_google_service(
     Returns:
         The Google API service.
     """
-    creds = None
-    # the file token.pickle stores the user's access and refresh tokens, and is
+    # the token file stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first time
-    if os.path.exists("token.pickle") and use_cache:
-        with open("token.pickle", "rb") as token:
-            creds = pickle.load(token)
-
-    # if there are no (valid) credentials availablle, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_config(client_config, scopes)
-            creds = flow.run_local_server(port=0)
-        # save the credentials for the next run
-        with open("token.pickle", "wb") as token:
-            pickle.dump(creds, token)
-    return build(
-        service_name.value, SERVICE_TO_VERSION[service_name], credentials=creds
+    creds = CREDENTIAL_STORE.get_credentials(client_config, scopes, use_cache)
+
+    cache: dict[GoogleService, tuple[Any, Any]] = _services.__dict__.setdefault(
+        "cache", {}
+    )
+    cached = cache.get(service_name)
+    if cached is not None and cached[0] is creds:
+        return cached[1]
+
+    service = build(
+        service_name.value,
+        SERVICE_TO_VERSION[service_name],
+        credentials=creds,
+        cache_discovery=False,
+        requestBuilder=REQUEST_BUILDERS[service_name],
     )
+    cache[service_name] = (creds, service)
+    return service
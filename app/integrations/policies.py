@@ -0,0 +1,144 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, TypeAlias
+
+from langchain.vectorstores import FAISS
+
+from app.config import settings
+from app.integrations.faiss import CompressedFAISS, build_index
+from app.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+PolicyIndex: TypeAlias = FAISS | CompressedFAISS
+
+
+def resolve_tenant(tenant: str | None = None, location: str | None = None) -> str:
+    """
+    Tenant whose HR policies apply: the given tenant if it has a handbook, else
+    the tenant of the employee location, else the default tenant
+
+    Args:
+        tenant (str | None, optional): tenant name. Defaults to None.
+        location (str | None, optional): BambooHR location of the employee. Defaults to None.
+
+    Returns:
+        str: a tenant of settings.POLICY_DOCUMENTS
+    """
+    if tenant is not None and tenant in settings.POLICY_DOCUMENTS:
+        return tenant
+    if location and location in settings.POLICY_LOCATION_TENANTS:
+        return settings.POLICY_LOCATION_TENANTS[location]
+    return settings.DEFAULT_POLICY_TENANT
+
+
+def index_memory_bytes(index: PolicyIndex) -> int:
+    """Approximate resident size of a policy index: its vectors and texts."""
+    if isinstance(index, CompressedFAISS):
+        return sum(index.memory_bytes().values())
+
+    documents = index.docstore._dict.values()
+    texts = sum(len(doc.page_content.encode()) for doc in documents)
+    return index.index.ntotal * index.index.d * 4 + texts
+
+
+class PolicyIndexCache:
+    """Policy indexes of the tenants, loaded on first use.
+
+    Indexes are kept least-recently-used first and evicted once their total
+    size exceeds `max_bytes`, so the resident memory of a worker depends on
+    the tenants it serves rather than on the number of configured tenants.
+    The index in use is never evicted, even if it alone exceeds the bound.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = settings.POLICY_INDEX_CACHE_MAX_BYTES,
+        loader: Callable[[str], PolicyIndex] = build_index,
+    ) -> None:
+        """
+        Args:
+            max_bytes (int, optional): Defaults to settings.POLICY_INDEX_CACHE_MAX_BYTES.
+            loader (Callable[[str], PolicyIndex], optional): loads the index of a PDF. Defaults to build_index.
+        """
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self._indexes: OrderedDict[str, tuple[PolicyIndex, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def __contains__(self, tenant: str) -> bool:
+        return tenant in self._indexes
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._indexes.values())
+
+    def get(self, tenant: str) -> PolicyIndex:
+        """
+        Gets the policy index of a tenant, loading it if needed
+
+        Args:
+            tenant (str): a tenant of settings.POLICY_DOCUMENTS
+
+        Raises:
+            Exception: No HR policies for the tenant
+
+        Returns:
+            PolicyIndex: the tenant's policy index
+        """
+        with self._lock:
+            if tenant in self._indexes:
+                self._indexes.move_to_end(tenant)
+                return self._indexes[tenant][0]
+            if tenant not in settings.POLICY_DOCUMENTS:
+                raise Exception(f"No HR policies for {tenant}")
+            load_lock = self._load_locks.setdefault(tenant, threading.Lock())
+
+        # Concurrent requests for a tenant wait for a single load, while other
+        # tenants are still served
+        with load_lock:
+            with self._lock:
+                if tenant in self._indexes:
+                    self._indexes.move_to_end(tenant)
+                    return self._indexes[tenant][0]
+
+            index = self.loader(settings.POLICY_DOCUMENTS[tenant])
+            METRICS.increment("policy_index.loads")
+
+            with self._lock:
+                self._indexes[tenant] = (index, index_memory_bytes(index))
+                self._evict()
+                METRICS.set_gauge("policy_index.resident_bytes", self.resident_bytes)
+            return index
+
+    def _evict(self) -> None:
+        while len(self._indexes) > 1 and self.resident_bytes > self.max_bytes:
+            tenant, _ = self._indexes.popitem(last=False)
+            METRICS.increment("policy_index.evictions")
+            logger.info("Evicted the policy index of %s", tenant)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+            METRICS.set_gauge("policy_index.resident_bytes", 0)
+
+
+POLICY_INDEXES = PolicyIndexCache()
+
+
+def get_policy_index(
+    tenant: str | None = None, location: str | None = None
+) -> PolicyIndex:
+    """
+    Gets the policy index applying to a tenant or an employee location
+
+    Args:
+        tenant (str | None, optional): tenant name. Defaults to None.
+        location (str | None, optional): BambooHR location of the employee. Defaults to None.
+
+    Returns:
+        PolicyIndex: the shared, lazily loaded policy index
+    """
+    return POLICY_INDEXES.get(resolve_tenant(tenant, location))
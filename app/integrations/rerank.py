@@ -0,0 +1,248 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.vectorstores import FAISS
+
+from app.config import settings
+from app.integrations.faiss import CompressedFAISS
+
+WORD_PATTERN = re.compile(r"[a-z0-9£$€]+")
+STOPWORDS = frozenset(
+    """a an and are as at be by can do does for from get have how i if in is it
+    me my of on or our per should the their there this to we what when where
+    which who will with you your""".split()
+)
+
+# BM25 term frequency saturation and length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Bounds of the retrieval options, which the LLM can override
+MAX_K = 20
+MAX_FETCH_K = 100
+
+
+def _int_option(value: Any, default: int, low: int, high: int) -> int:
+    try:
+        return min(max(int(value), low), high)
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
+def _float_option(value: Any, default: float, low: float, high: float) -> float:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return default if math.isnan(number) else min(max(number, low), high)
+
+
+@dataclass(frozen=True)
+class RetrievalOptions:
+    """How policy chunks are retrieved for a question.
+
+    Attributes:
+        k (int): chunks returned
+        fetch_k (int): candidates fetched from the vector index and re-ranked
+        mmr_lambda (float | None): relevance/diversity trade-off of the maximal
+            marginal relevance selection, 1 is pure relevance. None keeps the
+            re-ranked order.
+        lexical_weight (float): weight of the keyword match in the relevance,
+            against the embedding similarity
+    """
+
+    k: int = settings.RETRIEVAL_K
+    fetch_k: int = settings.RETRIEVAL_FETCH_K
+    mmr_lambda: float | None = settings.RETRIEVAL_MMR_LAMBDA
+    lexical_weight: float = settings.RETRIEVAL_LEXICAL_WEIGHT
+
+    @classmethod
+    def from_dict(cls, options: dict[str, Any]) -> "RetrievalOptions":
+        """
+        Options overridden by the matching keys of a dict, others ignored. The
+        values may come from the LLM, so they are converted to numbers and
+        clamped to sane bounds, and those that are not numbers are ignored.
+
+        Args:
+            options (dict[str, Any]): e.g. {"k": "3", "mmr_lambda": null}
+
+        Returns:
+            RetrievalOptions
+        """
+        defaults = cls()
+        k = _int_option(options.get("k"), defaults.k, 1, MAX_K)
+        fetch_k = _int_option(
+            options.get("fetch_k"), max(defaults.fetch_k, k), k, MAX_FETCH_K
+        )
+        mmr_lambda = defaults.mmr_lambda
+        if "mmr_lambda" in options:
+            # None turns the diversity selection off
+            mmr_lambda = (
+                None
+                if options["mmr_lambda"] is None
+                else _float_option(options["mmr_lambda"], mmr_lambda or 1.0, 0.0, 1.0)
+            )
+        lexical_weight = _float_option(
+            options.get("lexical_weight"), defaults.lexical_weight, 0.0, 1.0
+        )
+        return cls(
+            k=k, fetch_k=fetch_k, mmr_lambda=mmr_lambda, lexical_weight=lexical_weight
+        )
+
+
+def terms(text: str) -> list[str]:
+    """Lower-cased words of a text without stopwords, plurals reduced."""
+    words = WORD_PATTERN.findall(text.lower())
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") else word
+        for word in words
+        if word not in STOPWORDS
+    ]
+
+
+def lexical_scores(query: str, texts: list[str]) -> np.ndarray:
+    """
+    BM25 scores of texts for a query, with document frequencies taken over the
+    texts themselves, scaled so the best text scores 1
+
+    Args:
+        query (str): the question
+        texts (list[str]): candidate chunks
+
+    Returns:
+        np.ndarray: (N,) scores in [0, 1]
+    """
+    query_terms = set(terms(query))
+    documents = [Counter(terms(text)) for text in texts]
+    if not query_terms or not documents:
+        return np.zeros(len(texts))
+
+    mean_length = max(float(np.mean([sum(d.values()) for d in documents])), 1.0)
+    scores = np.zeros(len(texts))
+    for term in query_terms:
+        frequency = sum(1 for d in documents if term in d)
+        if not frequency:
+            continue
+        idf = math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+        for i, document in enumerate(documents):
+            tf = document[term]
+            length = sum(document.values()) / mean_length
+            scores[i] += (
+                idf
+                * tf
+                * (BM25_K1 + 1)
+                / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length))
+            )
+    return scores / scores.max() if scores.max() > 0 else scores
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min()
+    return (values - values.min()) / spread if spread > 0 else np.ones_like(values)
+
+
+def maximal_marginal_relevance(
+    relevance: np.ndarray, vectors: np.ndarray, k: int, mmr_lambda: float
+) -> list[int]:
+    """
+    Greedily selects relevant candidates that are not redundant with the ones
+    already selected
+
+    Args:
+        relevance (np.ndarray): (N,) relevance of the candidates, in [0, 1]
+        vectors (np.ndarray): (N, D) candidate vectors
+        k (int): candidates to select
+        mmr_lambda (float): 1 is pure relevance, 0 pure diversity
+
+    Returns:
+        list[int]: positions of the selected candidates, in selection order
+    """
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarity = unit @ unit.T
+    # Embedding similarities sit in a narrow band, spread them like the relevance
+    off_diagonal = similarity[~np.eye(len(similarity), dtype=bool)]
+    if off_diagonal.size:
+        low, high = off_diagonal.min(), off_diagonal.max()
+        similarity = (similarity - low) / (high - low) if high > low else similarity
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(relevance)):
+        redundancy = similarity[:, selected].max(axis=1)
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def search_candidates(
+    index: FAISS | CompressedFAISS, vector: np.ndarray, fetch_k: int
+) -> tuple[list[Document], np.ndarray]:
+    """Nearest chunks to a query vector with their full-precision vectors."""
+    if isinstance(index, CompressedFAISS):
+        positions, _ = index.search(vector, fetch_k)
+        return [index.documents[p] for p in positions], np.asarray(
+            index.vectors[positions], dtype=np.float32
+        )
+
+    _, ids = index.index.search(vector.reshape(1, -1).astype(np.float32), fetch_k)
+    ids = [int(i) for i in ids[0] if i >= 0]
+    documents = [index.docstore.search(index.index_to_docstore_id[i]) for i in ids]
+    vectors = np.vstack([index.index.reconstruct(i) for i in ids])
+    return documents, vectors
+
+
+def retrieve(
+    index: FAISS | CompressedFAISS,
+    query: str,
+    options: RetrievalOptions | None = None,
+    vector: np.ndarray | None = None,
+) -> list[Document]:
+    """
+    Retrieves the policy chunks for a question: fetches candidates from the
+    vector index, re-scores them with the embedding similarity and a keyword
+    match, then picks a diverse top k with maximal marginal relevance
+
+    Args:
+        index (FAISS | CompressedFAISS): policy index
+        query (str): the question
+        options (RetrievalOptions | None, optional): Defaults to RetrievalOptions().
+        vector (np.ndarray | None, optional): embedding of the question, computed if not given. Defaults to None.
+
+    Returns:
+        list[Document]: chunks, most relevant first
+    """
+    options = options or RetrievalOptions()
+    if vector is None:
+        embedded = (
+            index.embed_query(query)
+            if isinstance(index, CompressedFAISS)
+            else index._embed_query(query)
+        )
+        vector = np.array(embedded, dtype=np.float32)
+
+    documents, vectors = search_candidates(
+        index, vector, max(options.fetch_k, options.k)
+    )
+    if not documents:
+        return []
+
+    semantic = _min_max(vectors @ vector / np.linalg.norm(vectors, axis=1))
+    relevance = semantic
+    if options.lexical_weight:
+        lexical = lexical_scores(query, [doc.page_content for doc in documents])
+        relevance = (
+            1 - options.lexical_weight
+        ) * semantic + options.lexical_weight * lexical
+
+    if options.mmr_lambda is None:
+        order = list(np.argsort(-relevance)[: options.k])
+    else:
+        order = maximal_marginal_relevance(
+            relevance, vectors, options.k, options.mmr_lambda
+        )
+    return [documents[i] for i in order]
@@ -1,25 +1,12 @@
-import time
+import uuid
 from dataclasses import dataclass
+from typing import Any
 
+import requests
 import streamlit as st
-from langchain.agents import AgentExecutor
-
-from app.agent.executor import init_agent_executor
-from app.agent.tools import (
-    AddEmployeeToHRTool,
-    CancelTimeOffRequestTool,
-    CreateCalendarEventTool,
-    EstimateTimeOffBalanceTool,
-    HRPolicyEmailTool,
-    HRPolicyQATool,
-    MakeTimeOffRequestTool,
-    ModifyEmployeeTool,
-    RespondTool,
-    SlackInviteTool,
-    ViewTimeOffRequestsTool,
-    WelcomeEmailTool,
-)
-from app.utils import CaptureStdout, no_ansi_string
+
+from app.client import AgentServiceClient
+from app.config import settings
 
 
 @dataclass
@@ -29,71 +16,51 @@ class RoleType:
 
 
 class MariaApp:
+    """Chat interface of the agent. The conversations are held and answered by
+    the agent service (app/service.py), the app only renders them."""
+
     def __init__(self) -> None:
-        if "messages" not in st.session_state:
+        if "session_id" not in st.session_state:
             self.init_session_state()
+        self.client = AgentServiceClient()
 
     def init_session_state(self) -> None:
-        st.session_state.messages = [
-            {
-                "role": "assistant",
-                "content": """
-                Hi, I am Maria, your personal HR assistant. To get started, can you please provide the following information:\n
-                    - First Name
-                    - Last Name
-                    - Email Address
-                I will then:\n
-                    1. Send you a welcome email, the HR policies and a Slack invite.
-                    2. Schedule a calendar event for your onboarding.
-                    3. Enroll you in the HR system.
-                Thanks!
-                """,
-                "log": [],
-            }
-        ]
-        st.session_state.debug_logs = []
+        st.session_state.session_id = uuid.uuid4().hex
         st.session_state.thinking = False
 
-        # Onboarding status
-        st.session_state.welcome_email_sent = False
-        st.session_state.policies_email_sent = False
-        st.session_state.slack_invite_sent = False
-        st.session_state.calendar_event_created = False
-        st.session_state.enrolled_in_HR_system = False
-
-    def onboarding_status_widget(self) -> None:
+    def onboarding_status_widget(self, onboarding: dict[str, bool]) -> None:
         with st.expander("Onboarding Status", expanded=True):
             st.checkbox(
                 "Welcome Email",
-                value=st.session_state.welcome_email_sent,
+                value=onboarding["welcome_email_sent"],
                 disabled=True,
             )
 
             st.checkbox(
                 "Send HR Policies",
-                value=st.session_state.policies_email_sent,
+                value=onboarding["policies_email_sent"],
                 disabled=True,
             )
 
             st.checkbox(
                 "Slack Invite",
-                value=st.session_state.slack_invite_sent,
+                value=onboarding["slack_invite_sent"],
                 disabled=True,
             )
 
             st.checkbox(
                 "Schedule Onboarding Event",
-                value=st.session_state.calendar_event_created,
+                value=onboarding["calendar_event_created"],
                 disabled=True,
             )
 
             st.checkbox(
                 "Enroll in HR System",
-                value=st.session_state.enrolled_in_HR_system,
+                value=onboarding["enrolled_in_HR_system"],
                 disabled=True,
             )
 
-    def sidebar(self) -> None:
+    def sidebar(self, session: dict[str, Any]) -> None:
         with st.sidebar:
             st.title("Maria, your personal HR assistant")
             # Description
@@ -113,109 +80,89 @@ class MariaApp:
 
             st.markdown("<br>", unsafe_allow_html=True)
 
-            self.onboarding_status_widget()
+            self.onboarding_status_widget(session["onboarding"])
 
             #  Add a debug mode to show the logs
             with st.expander("Debug mode"):
-                st.warning(
-                    "Toggling debug mode while the agent is thinking will cause issues."
+                st.checkbox(
+                    "Debug mode", key="debug", disabled=st.session_state.thinking
                 )
-                debug = st.checkbox("Debug mode", disabled=st.session_state.thinking)
-                st.session_state.debug = debug
 
             if st.button("Reset", use_container_width=True):
-                self.init_session_state()
-
-    def render_chat(self) -> None:
-        for message in st.session_state.messages:
+                try:
+                    self.client.reset_session(st.session_state.session_id)
+                except Exception as error:
+                    # Refused while a message is being answered
+                    st.error(str(error))
+                else:
+                    st.rerun()
+
+    def render_chat(self, session: dict[str, Any]) -> None:
+        for message in session["messages"]:
             with st.chat_message(message["role"]):
                 st.write(message["content"])
                 if message["log"] and st.session_state.debug:
                     st.write(message["log"])
 
-    def store_message(self, role: str, content: str, log: list[str] = []) -> None:
-        st.session_state.messages.append({"role": role, "content": content, "log": log})
-
-    def init_agent(self) -> AgentExecutor:
-        # Status callbacks
-        def set_welcome_email_status() -> None:
-            st.session_state.welcome_email_sent = True
-
-        def set_policies_email_status() -> None:
-            st.session_state.policies_email_sent = True
-
-        def set_slack_invite_status() -> None:
-            st.session_state.slack_invite_sent = True
-
-        def set_calendar_event_status() -> None:
-            st.session_state.calendar_event_created = True
-
-        def set_enrolled_in_HR_system_status() -> None:
-            st.session_state.enrolled_in_HR_system = True
-
-        tools = [
-            RespondTool(),
-            WelcomeEmailTool(callback=set_welcome_email_status),
-            HRPolicyEmailTool(callback=set_policies_email_status),
-            SlackInviteTool(callback=set_slack_invite_status),
-            CreateCalendarEventTool(callback=set_calendar_event_status),
-            AddEmployeeToHRTool(callback=set_enrolled_in_HR_system_status),
-            HRPolicyQATool(),
-            ModifyEmployeeTool(),
-            ViewTimeOffRequestsTool(),
-            MakeTimeOffRequestTool(),
-            CancelTimeOffRequestTool(),
-            EstimateTimeOffBalanceTool(),
-        ]
-        return init_agent_executor(tools, verbose=True)
-
     def handle_chat_input(self) -> None:
         if user_input := st.chat_input("What's up?"):
-            # Count the number of words in the user input
-            num_words = len(user_input.split())
-            if num_words > 500:
-                st.error("Please keep your message under 500 words.")
-                return
-
-            self.store_message(RoleType.USER, user_input)
-
             with st.chat_message(RoleType.USER):
                 st.markdown(user_input)
 
-            agent_executor = self.init_agent()
-
             with st.chat_message(RoleType.ASSISTANT):
                 message_placeholder = st.empty()
+                message_placeholder.markdown("Thinking...")
                 full_response = ""
-
-                with st.spinner("Thinking..."):
-                    # TODO - manage conversation history length
-                    with CaptureStdout() as c:
-                        llm_output = agent_executor.invoke(
-                            {
-                                "input": user_input,
-                                "chat_history": st.session_state.messages[:-1],
-                            }
-                        )["output"]
-
-                for response in llm_output:
-                    full_response += response
-                    message_placeholder.markdown(full_response + "▌")
-                    time.sleep(0.02)
-
-                logs = no_ansi_string(c.getvalue()).split("\n")
-                logs = list(filter(None, logs))  # Remove blank lines
+                message = None
+
+                st.session_state.thinking = True
+                try:
+                    # The answer is shown as it is written, the steps before it as a status
+                    for event in self.client.send_message(
+                        st.session_state.session_id, user_input
+                    ):
+                        if event["type"] == "step":
+                            message_placeholder.markdown(f"Using `{event['tool']}`...")
+                        elif event["type"] == "token":
+                            full_response += event["text"]
+                            message_placeholder.markdown(full_response + "▌")
+                        elif event["type"] == "done":
+                            message = event["message"]
+                        elif event["type"] == "error":
+                            raise Exception(event["detail"])
+                except Exception as error:
+                    message_placeholder.empty()
+                    st.error(str(error))
+                    return
+                finally:
+                    st.session_state.thinking = False
+
+                if message is None:
+                    message_placeholder.empty()
+                    st.error("The agent service closed the connection, please retry.")
+                    return
+                message_placeholder.markdown(message["content"])
                 if st.session_state.debug:
-                    st.write(logs)
-
-                message_placeholder.markdown(full_response)
-            self.store_message(RoleType.ASSISTANT, full_response, logs)
+                    st.write(message["log"])
+            # Show the onboarding steps completed by the turn
+            st.rerun()
 
     def run(self) -> None:
         st.header("Talk to me!")
 
-        self.sidebar()
-        self.render_chat()
+        try:
+            session = self.client.get_session(
+                st.session_state.session_id, logs=st.session_state.get("debug", False)
+            )
+        except requests.RequestException:
+            st.error(
+                f"The agent service is unreachable at {settings.AGENT_SERVICE_URL}. "
+                "Start it with `poetry run uvicorn app.service:app`."
+            )
+            st.stop()
+
+        self.sidebar(session)
+        self.render_chat(session)
         self.handle_chat_input()
 
 
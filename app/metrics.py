@@ -0,0 +1,43 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread-safe in-process counters and gauges."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._gauges.get(name, self._counters.get(name, 0))
+
+    def ratio(self, numerator: str, denominator: str) -> float:
+        """Ratio between two counters, e.g. a failure rate. Zero if the denominator is zero."""
+        with self._lock:
+            total = self._counters.get(denominator, 0)
+            return self._counters.get(numerator, 0) / total if total else 0.0
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return {**self._counters, **self._gauges}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+
+METRICS = Metrics()
+
+__all__ = ["METRICS", "Metrics"]
@@ -0,0 +1,239 @@
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+from app.config import settings
+from app.metrics import METRICS
+
+
+class Priority(enum.IntEnum):
+    """Order in which the callers waiting on a bucket are served, lowest first."""
+
+    INTERACTIVE = 0
+    BULK = 1
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "rate_limit_priority", default=Priority.INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def rate_limit_priority(priority: Priority) -> Iterator[None]:
+    """Priority of the rate limited calls made in the block, e.g. by bulk jobs."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    Callers queue on the bucket and only the first caller in the queue, by
+    priority then arrival, takes tokens, so a bulk job cannot starve the chat.
+    With a `state_path` the bucket level is kept in a file locked on every
+    update, so the worker processes of a host share the limit. The queue
+    itself, and therefore the priority, is per process.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        capacity: float,
+        state_path: str | Path | None = None,
+    ) -> None:
+        """
+        Args:
+            name (str): upstream name, used in the metrics
+            rate (float): tokens added per second
+            capacity (float): maximum tokens, i.e. the allowed burst
+            state_path (str | Path | None, optional): file shared by the processes. Defaults to a process-local bucket.
+        """
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.state_path = Path(state_path) if state_path else None
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, tokens: float, updated: float, now: float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def _take(self, cost: float) -> float:
+        """Takes the tokens if they are available. Returns 0 if taken, else the
+        seconds until they will be."""
+        if self.state_path is not None:
+            return self._take_shared(cost)
+
+        now = time.monotonic()
+        self._tokens = self._refill(self._tokens, self._updated, now)
+        self._updated = now
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return 0.0
+        return (cost - self._tokens) / self.rate
+
+    def _take_shared(self, cost: float) -> float:
+        import fcntl
+
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)  # type: ignore
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)  # type: ignore
+        # The lock is released when the file is closed
+        with os.fdopen(fd, "r+") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                state = json.loads(handle.read() or "{}")
+            except ValueError:
+                state = {}
+            # Wall-clock time, comparable between processes
+            now = time.time()
+            tokens = self._refill(
+                state.get("tokens", self.capacity), state.get("updated", now), now
+            )
+            wait = 0.0 if tokens >= cost else (cost - tokens) / self.rate
+            if not wait:
+                tokens -= cost
+            handle.seek(0)
+            handle.truncate()
+            json.dump({"tokens": tokens, "updated": now}, handle)
+        return wait
+
+    def acquire(
+        self,
+        cost: float = 1,
+        priority: Priority | None = None,
+        timeout: float | None = None,
+    ) -> float:
+        """
+        Waits for its turn and takes tokens from the bucket
+
+        Args:
+            cost (float, optional): tokens to take, in several refills of the bucket if above its capacity. Defaults to 1.
+            priority (Priority | None, optional): Defaults to the priority of the context.
+            timeout (float | None, optional): maximum seconds to wait. Defaults to no limit.
+
+        Raises:
+            Exception: The tokens would not be available before the timeout
+
+        Returns:
+            float: seconds waited
+        """
+        priority = _priority.get() if priority is None else priority
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        ticket = (int(priority), next(self._sequence))
+
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        # A cost above the capacity is taken a bucket at a time,
+                        # the caller staying first in line until it is all taken
+                        step = min(cost, self.capacity)
+                        wait = self._take(step)
+                        if not wait:
+                            cost -= step
+                            if cost <= 0:
+                                break
+                            continue
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        needed = (
+                            None if wait is None else wait + (cost - step) / self.rate
+                        )
+                        if remaining <= 0 or (
+                            needed is not None and needed > remaining
+                        ):
+                            METRICS.increment(f"rate_limit.{self.name}.rejected")
+                            raise Exception(
+                                f"Rate limit of {self.name} exceeded, "
+                                f"no capacity within {timeout} seconds"
+                            )
+                        wait = remaining if wait is None else wait
+                    # Callers behind the first one wait until it has been served
+                    self._condition.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+        waited = time.monotonic() - start
+        METRICS.increment(f"rate_limit.{self.name}.requests")
+        METRICS.increment(f"rate_limit.{self.name}.wait_seconds", waited)
+        return waited
+
+
+class RateLimiter:
+    """Token buckets of the upstream APIs, by name. Upstreams without a
+    configured limit are not limited."""
+
+    def __init__(
+        self,
+        limits: dict[str, dict[str, float]],
+        state_dir: str | Path | None = None,
+        max_wait: float | None = None,
+    ) -> None:
+        """
+        Args:
+            limits (dict[str, dict[str, float]]): "rate" per second and "capacity" of each upstream
+            state_dir (str | Path | None, optional): directory of the bucket files shared by the processes. Defaults to process-local buckets.
+            max_wait (float | None, optional): seconds a call waits before failing. Defaults to no limit.
+        """
+        self.max_wait = max_wait
+        self.buckets = {
+            name: TokenBucket(
+                name,
+                limit["rate"],
+                limit["capacity"],
+                Path(state_dir) / f"{name}.bucket" if state_dir else None,
+            )
+            for name, limit in limits.items()
+        }
+
+    def acquire(
+        self, name: str, cost: float = 1, priority: Priority | None = None
+    ) -> float:
+        """
+        Waits until a call to an upstream is allowed
+
+        Args:
+            name (str): upstream, e.g. "bamboo" or "google.gmail"
+            cost (float, optional): calls, or tokens for OpenAI. Defaults to 1.
+            priority (Priority | None, optional): Defaults to the priority of the context.
+
+        Returns:
+            float: seconds waited
+        """
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire(cost, priority, self.max_wait)
+
+
+RATE_LIMITER = RateLimiter(
+    settings.RATE_LIMITS, settings.RATE_LIMIT_STATE_DIR, settings.RATE_LIMIT_MAX_WAIT
+)
+
+__all__ = [
+    "RATE_LIMITER",
+    "Priority",
+    "RateLimiter",
+    "TokenBucket",
+    "rate_limit_priority",
+]
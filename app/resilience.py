@@ -0,0 +1,225 @@
+import enum
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, TypeVar
+
+from app.config import settings
+from app.metrics import METRICS
+from app.utils import submit_in_context
+
+T = TypeVar("T")
+
+
+class CircuitState(enum.IntEnum):
+    """Breaker states, published as the value of the `circuit.<name>.state` gauge."""
+
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitBreaker:
+    """Fails the calls to an upstream fast while it is failing or too slow.
+
+    The breaker opens when enough of the recent calls failed or were slower
+    than `slow_call_seconds`, and rejects calls for `open_seconds`. It then
+    lets `half_open_probes` calls through: it closes if they all succeed, and
+    opens again on the first failure.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = settings.CIRCUIT_WINDOW,
+        min_calls: int = settings.CIRCUIT_MIN_CALLS,
+        failure_ratio: float = settings.CIRCUIT_FAILURE_RATIO,
+        slow_call_seconds: float = settings.CIRCUIT_SLOW_CALL_SECONDS,
+        open_seconds: float = settings.CIRCUIT_OPEN_SECONDS,
+        half_open_probes: int = settings.CIRCUIT_HALF_OPEN_PROBES,
+    ) -> None:
+        """
+        Args:
+            name (str): upstream name, used in the metrics
+            window (int, optional): recent calls considered. Defaults to settings.CIRCUIT_WINDOW.
+            min_calls (int, optional): calls needed to open. Defaults to settings.CIRCUIT_MIN_CALLS.
+            failure_ratio (float, optional): share of failed or slow calls that opens. Defaults to settings.CIRCUIT_FAILURE_RATIO.
+            slow_call_seconds (float, optional): successful calls slower than this count as failed. Defaults to settings.CIRCUIT_SLOW_CALL_SECONDS.
+            open_seconds (float, optional): seconds calls are rejected once open. Defaults to settings.CIRCUIT_OPEN_SECONDS.
+            half_open_probes (int, optional): calls let through to probe the upstream. Defaults to settings.CIRCUIT_HALF_OPEN_PROBES.
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        METRICS.set_gauge(f"circuit.{self.name}.state", int(self._state))
+
+    def _set_state(self, state: CircuitState) -> None:
+        self._state = state
+        METRICS.set_gauge(f"circuit.{self.name}.state", int(state))
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+            METRICS.increment(f"circuit.{self.name}.opened")
+        elif state == CircuitState.HALF_OPEN:
+            self._probes = self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+
+    def _current_state(self) -> CircuitState:
+        if (
+            self._state == CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self.open_seconds
+        ):
+            self._set_state(CircuitState.HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._current_state()
+
+    def before_call(self) -> None:
+        """
+        Checks that a call may be made, counting it as a probe when half-open
+
+        Raises:
+            Exception: The breaker is open
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CircuitState.CLOSED:
+                return
+            if state == CircuitState.HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            retry_in = max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+        METRICS.increment(f"circuit.{self.name}.rejected")
+        raise Exception(
+            f"{self.name} is unavailable, calls are suspended for {retry_in:.0f} more seconds"
+        )
+
+    def record(self, failed: bool, duration: float) -> None:
+        """
+        Records the outcome of a call let through by `before_call`
+
+        Args:
+            failed (bool): the call failed
+            duration (float): seconds the call took
+        """
+        failed = failed or duration > self.slow_call_seconds
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                if failed:
+                    self._set_state(CircuitState.OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._set_state(CircuitState.CLOSED)
+                return
+            if self._state == CircuitState.OPEN:
+                # A call started before the breaker opened
+                return
+
+            self._outcomes.append(failed)
+            if (
+                len(self._outcomes) >= self.min_calls
+                and sum(self._outcomes) / len(self._outcomes) >= self.failure_ratio
+            ):
+                self._set_state(CircuitState.OPEN)
+
+    def call(
+        self,
+        function: Callable[..., T],
+        *args: Any,
+        is_failure: Callable[[T], bool] | None = None,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Calls a function through the breaker. Exceptions count as failures.
+
+        Args:
+            function (Callable[..., T]): the upstream call
+            is_failure (Callable[[T], bool] | None, optional): whether a result is a failure, e.g. a 5xx response. Defaults to None.
+
+        Returns:
+            T: result of the function
+        """
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record(True, time.monotonic() - start)
+            raise
+        failed = is_failure(result) if is_failure is not None else False
+        self.record(failed, time.monotonic() - start)
+        return result
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Process-wide circuit breaker of an upstream, e.g. "bamboo"."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+# Hedged calls wait in the caller while their attempts run in these pools. The
+# second attempts have their own pool, so they do not queue behind the slow first
+# attempts they are meant to overtake
+_attempt_pool = ThreadPoolExecutor(
+    max_workers=settings.HEDGE_MAX_WORKERS, thread_name_prefix="hedge-first"
+)
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=settings.HEDGE_MAX_WORKERS, thread_name_prefix="hedge-second"
+)
+
+
+def hedged(function: Callable[[], T], hedge_after: float, name: str) -> T:
+    """
+    Calls an idempotent function, and calls it a second time if it has not
+    returned after `hedge_after` seconds. The first successful attempt wins,
+    the other one is left to finish in the background.
+
+    Args:
+        function (Callable[[], T]): the idempotent upstream call
+        hedge_after (float): seconds before the second attempt, e.g. the p95 latency
+        name (str): upstream name, used in the metrics
+
+    Returns:
+        T: result of the first successful attempt, or the error of the last one
+    """
+    # The attempts keep the context of the caller, e.g. its rate limit priority
+    attempts = [submit_in_context(_attempt_pool, function)]
+    done, _ = wait(attempts, timeout=hedge_after)
+    if done:
+        return attempts[0].result()
+
+    METRICS.increment(f"hedge.{name}.sent")
+    attempts.append(submit_in_context(_hedge_pool, function))
+    pending = list(attempts)
+    while True:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for attempt in done:
+            pending.remove(attempt)
+            if attempt.exception() is None or not pending:
+                if attempt is attempts[1] and attempt.exception() is None:
+                    METRICS.increment(f"hedge.{name}.won")
+                return attempt.result()
+
+
+__all__ = ["CircuitBreaker", "CircuitState", "get_breaker", "hedged"]
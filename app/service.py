@@ -0,0 +1,225 @@
+"""Headless agent service.
+
+Serves the agent over HTTP and WebSocket, streaming the answers:
+
+    poetry run uvicorn app.service:app --port 8000
+
+The Streamlit app is a client of this service (AGENT_SERVICE_URL).
+"""
+import asyncio
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from app.agent.session import MAX_INPUT_WORDS, AgentSession
+from app.agent.store import create_session_store
+from app.config import settings
+from app.metrics import METRICS
+
+
+class MessageIn(BaseModel):
+    content: str
+
+
+class TurnLimiter:
+    """Admission control of the agent turns.
+
+    At most `max_concurrent` turns run at once and at most `max_queued` wait
+    for a slot. Further turns are refused, so a burst is pushed back to the
+    clients instead of piling up work and memory in the service.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int) -> None:
+        self.max_queued = max_queued
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def acquire(self) -> bool:
+        """Waits for a slot, False if the queue is full."""
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            METRICS.increment("service.turns_refused")
+            return False
+        self.waiting += 1
+        METRICS.set_gauge("service.turns_waiting", self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            METRICS.set_gauge("service.turns_waiting", self.waiting)
+        return True
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+
+app = FastAPI(title="Maria HR agent")
+SESSIONS = create_session_store()
+TURNS = TurnLimiter(
+    settings.SERVICE_MAX_CONCURRENT_TURNS, settings.SERVICE_MAX_QUEUED_TURNS
+)
+# The agent is synchronous, its turns run on these threads
+_turn_pool = ThreadPoolExecutor(
+    max_workers=settings.SERVICE_MAX_CONCURRENT_TURNS, thread_name_prefix="turn"
+)
+
+
+async def admit_turn(session_id: str, content: str) -> AgentSession:
+    """
+    Checks a message and reserves a turn slot and the session for it
+
+    Returns:
+        AgentSession: the live session, reserved for the turn
+
+    Raises:
+        HTTPException: 422 if the message is too long, 409 if the session is
+            already running a turn, 503 if the service is saturated
+    """
+    if len(content.split()) > MAX_INPUT_WORDS:
+        raise HTTPException(
+            422, f"Please keep your message under {MAX_INPUT_WORDS} words."
+        )
+    session = SESSIONS.begin_turn(session_id)
+    if session is None:
+        raise HTTPException(409, "A message of this session is still being answered")
+    if not await TURNS.acquire():
+        session.end_turn()
+        raise HTTPException(
+            503,
+            "Too many conversations in progress, please retry shortly",
+            headers={"Retry-After": str(settings.SERVICE_RETRY_AFTER_SECONDS)},
+        )
+    return session
+
+
+def start_turn(
+    session: AgentSession, content: str
+) -> asyncio.Queue[dict[str, Any] | None]:
+    """
+    Starts an admitted turn on a worker thread, returning the queue of its
+    events: "step" and "token" events while the agent works, then "done" with
+    the answer or "error", then None. The turn is started before anything is
+    sent to the client, so it completes and releases its slot and the session
+    even if the client goes away before reading it.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+
+    def emit(event: dict[str, Any] | None) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def run() -> None:
+        try:
+            try:
+                message = session.run_turn(content, on_event=emit)
+            finally:
+                # Saved before it is released, idle sessions may be evicted
+                try:
+                    SESSIONS.save(session)
+                finally:
+                    session.end_turn()
+            emit(
+                {
+                    "type": "done",
+                    "message": message,
+                    "onboarding": session.onboarding_status(),
+                }
+            )
+        except Exception as error:
+            METRICS.increment("service.turn_errors")
+            emit({"type": "error", "detail": str(error)})
+        finally:
+            loop.call_soon_threadsafe(TURNS.release)
+            emit(None)
+
+    METRICS.increment("service.turns")
+    loop.run_in_executor(_turn_pool, run)
+    return queue
+
+
+async def turn_events(
+    queue: asyncio.Queue[dict[str, Any] | None],
+) -> AsyncIterator[dict[str, Any]]:
+    """Events of a started turn, see `start_turn`."""
+    while (event := await queue.get()) is not None:
+        yield event
+
+
+async def _ndjson(events: AsyncIterator[dict[str, Any]]) -> AsyncIterator[bytes]:
+    async for event in events:
+        yield (json.dumps(event) + "\n").encode()
+
+
+@app.post("/sessions")
+def create_session() -> dict[str, Any]:
+    return SESSIONS.snapshot(uuid.uuid4().hex)
+
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str, logs: bool = False) -> dict[str, Any]:
+    return SESSIONS.snapshot(session_id, logs=logs)
+
+
+@app.delete("/sessions/{session_id}")
+def reset_session(session_id: str) -> dict[str, Any]:
+    if SESSIONS.reset(session_id) is None:
+        raise HTTPException(409, "A message of this session is still being answered")
+    return SESSIONS.snapshot(session_id)
+
+
+@app.post("/sessions/{session_id}/messages")
+async def post_message(session_id: str, message: MessageIn) -> StreamingResponse:
+    """Answers a message as a stream of newline-delimited JSON events."""
+    session = await admit_turn(session_id, message.content)
+    events = turn_events(start_turn(session, message.content))
+    return StreamingResponse(
+        _ndjson(events),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.websocket("/sessions/{session_id}/ws")
+async def session_socket(websocket: WebSocket, session_id: str) -> None:
+    """Answers each {"content": ...} message received with the events of its
+    turn. The session is looked up again for each message, the one of the
+    previous turn may have been evicted or reset since."""
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                message = MessageIn(**await websocket.receive_json())
+            except (ValidationError, TypeError, ValueError) as error:
+                await websocket.send_json(
+                    {"type": "error", "status": 422, "detail": str(error)}
+                )
+                continue
+            try:
+                session = await admit_turn(session_id, message.content)
+            except HTTPException as error:
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "status": error.status_code,
+                        "detail": error.detail,
+                    }
+                )
+                continue
+            async for event in turn_events(start_turn(session, message.content)):
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/metrics")
+def get_metrics() -> dict[str, float]:
+    return METRICS.snapshot()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=settings.SERVICE_HOST, port=settings.SERVICE_PORT)
@@ -1,7 +1,17 @@
+import contextvars
+import functools
 import io
+import logging
 import re
 import sys
-from typing import Any
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, TypeVar
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 
 def no_ansi_string(ansi_string: str) -> str:
@@ -33,3 +43,54 @@ class CaptureStdout:
 
     def getvalue(self) -> str:
         return self.value.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str) -> Any:
+    """Tokenizer of an OpenAI model, or None if its files cannot be downloaded."""
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("Could not load the %s tokenizer, estimating tokens", model)
+        return None
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    """Number of tokens of a text for an OpenAI model, settings.OPENAI_MODEL by
+    default. Estimated at 4 characters per token without the tokenizer."""
+    encoding = _get_encoding(model or settings.OPENAI_MODEL)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str | None = None) -> str:
+    """Longest prefix of a text that fits in a number of tokens."""
+    encoding = _get_encoding(model or settings.OPENAI_MODEL)
+    if encoding is None:
+        return text[: max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def submit_in_context(
+    pool: Executor, function: Callable[..., T], *args: Any
+) -> Future[T]:
+    """
+    Submits a call to a pool, run in a copy of the current context so the
+    context variables (e.g. the rate limit priority) reach the worker thread
+
+    Args:
+        pool (Executor)
+        function (Callable[..., T])
+        *args (Any): arguments of the call
+
+    Returns:
+        Future[T]: result of the call
+    """
+    context = contextvars.copy_context()
+    return pool.submit(context.run, function, *args)
@@ -0,0 +1,44 @@
+import json
+
+from app.agent.callbacks import RespondStream, TurnCallbackHandler
+from app.agent.constants import RESPOND_TOOL_NAME
+
+
+def stream(blob: str, size: int) -> list[str]:
+    return [blob[i : i + size] for i in range(0, len(blob), size)]
+
+
+def test_respond_stream_decodes_the_answer_token_by_token() -> None:
+    answer = 'You have 12 days left.\nSay "thanks" to HR — or not.'
+    blob = json.dumps(
+        {
+            "thought": "I know the balance, I can answer the user.",
+            "tool": RESPOND_TOOL_NAME,
+            "tool_input": answer,
+        },
+        indent=4,
+    )
+    for size in (1, 2, 3, 7):
+        respond = RespondStream()
+        assert "".join(respond.feed(token) for token in stream(blob, size)) == answer
+
+
+def test_respond_stream_ignores_other_tools() -> None:
+    blob = json.dumps(
+        {"thought": "Look it up", "tool": "get_time_off_balance", "tool_input": "42"}
+    )
+    respond = RespondStream()
+    assert "".join(respond.feed(token) for token in stream(blob, 1)) == ""
+
+
+def test_turn_callback_handler_emits_token_events() -> None:
+    events: list[dict] = []
+    handler = TurnCallbackHandler(events.append)
+    blob = json.dumps(
+        {"thought": "Greet", "tool": RESPOND_TOOL_NAME, "tool_input": "Hi there!"}
+    )
+    for token in stream(blob, 4):
+        handler.on_llm_new_token(token)
+
+    assert events and all(event["type"] == "token" for event in events)
+    assert "".join(event["text"] for event in events) == "Hi there!"
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+from langchain.schema import AgentAction, AgentFinish, OutputParserException
+
+from app.agent.output_parser import CustomJSONOutputParser, parse_json_action
+
+ACTION = {"thought": "Look it up", "tool": "view_employee_tool", "tool_input": "42"}
+
+
+@pytest.mark.parametrize(
+    "text, expected, repaired",
+    [
+        # Well-formed, with fences or prose around it
+        ('{"tool": "a", "tool_input": "b"}', {"tool": "a", "tool_input": "b"}, False),
+        ('```json\n{"tool": "a"}\n```', {"tool": "a"}, False),
+        ('```\n{"tool": "a"}\n```', {"tool": "a"}, False),
+        ('Sure! Here it is:\n{"tool": "a"} Hope it helps', {"tool": "a"}, False),
+        (
+            '{"tool": "a", "tool_input": "line 1\nline 2"}',
+            {"tool": "a", "tool_input": "line 1\nline 2"},
+            False,
+        ),
+        (
+            '{"tool_input": "use {braces} and ]"}',
+            {"tool_input": "use {braces} and ]"},
+            False,
+        ),
+        # Truncated output is closed
+        (
+            '{"tool": "a", "tool_input": {"x": 1',
+            {"tool": "a", "tool_input": {"x": 1}},
+            False,
+        ),
+        (
+            '```json\n{"tool": "a", "tool_input": "cut',
+            {"tool": "a", "tool_input": "cut"},
+            False,
+        ),
+        ('[{"tool": "a"}, {"tool": "b"', [{"tool": "a"}, {"tool": "b"}], False),
+        # Trailing commas
+        ('{"tool": "a", "tool_input": "b",}', {"tool": "a", "tool_input": "b"}, True),
+        ('[{"tool": "a",}, {"tool": "b"},]', [{"tool": "a"}, {"tool": "b"}], True),
+        # Python literals
+        ("{'tool': 'a', 'tool_input': 'b'}", {"tool": "a", "tool_input": "b"}, True),
+        (
+            "{'tool': 'a', 'done': True, 'x': None}",
+            {"tool": "a", "done": True, "x": None},
+            True,
+        ),
+        (
+            "{'tool': 'a', 'tool_input': 'line 1\nline 2'}",
+            {"tool": "a", "tool_input": "line 1\nline 2"},
+            True,
+        ),
+        (
+            "{'tool': 'a', 'tool_input': \"it's\",}",
+            {"tool": "a", "tool_input": "it's"},
+            True,
+        ),
+    ],
+)
+def test_parse_json_action_repairs(text: str, expected: object, repaired: bool) -> None:
+    assert parse_json_action(text) == (expected, repaired)
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["", "I can help you with that.", "{tool: a}", '{"tool": "a" "tool_input": "b"}'],
+)
+def test_parse_json_action_rejects(text: str) -> None:
+    with pytest.raises(ValueError):
+        parse_json_action(text)
+
+
+def test_parser_treats_prose_as_the_answer() -> None:
+    output = CustomJSONOutputParser().parse("  Hi! How can I help?  ")
+    assert isinstance(output, AgentFinish)
+    assert output.return_values == {"output": "Hi! How can I help?"}
+
+
+def test_parser_fails_on_unrepairable_json() -> None:
+    with pytest.raises(OutputParserException):
+        CustomJSONOutputParser().parse('{"tool": "a" "tool_input": "b"}')
+
+
+def test_parser_respond_action_finishes() -> None:
+    text = '{"thought": "Greet", "tool": "respond_tool", "tool_input": "Hello"}'
+    output = CustomJSONOutputParser().parse(text)
+    assert isinstance(output, AgentFinish)
+    assert output.return_values == {"output": "Hello"}
+
+
+def test_parser_dict_input_is_passed_as_json() -> None:
+    text = '{"tool": "make_time_off_request_tool", "tool_input": {"employee_id": "4"}}'
+    output = CustomJSONOutputParser().parse(text)
+    assert isinstance(output, AgentAction)
+    assert output.tool_input == '{"employee_id": "4"}'
+
+
+def test_parser_runs_a_list_of_actions() -> None:
+    text = '[{"tool": "a", "tool_input": "1"}, {"tool": "b", "tool_input": "2"}]'
+    output = CustomJSONOutputParser().parse(text)
+    assert isinstance(output, list)
+    assert [(a.tool, a.tool_input, a.log) for a in output] == [
+        ("a", "1", text),
+        ("b", "2", text),
+    ]
+
+
+def test_parser_drops_responses_listed_with_actions() -> None:
+    text = json.dumps([{"tool": "respond_tool", "tool_input": "Done"}, ACTION])
+    output = CustomJSONOutputParser().parse(text)
+    assert isinstance(output, list)
+    assert [a.tool for a in output] == ["view_employee_tool"]
+
+
+def test_parser_list_of_responses_finishes() -> None:
+    text = '[{"tool": "respond_tool", "tool_input": "Done"}]'
+    output = CustomJSONOutputParser().parse(text)
+    assert isinstance(output, AgentFinish)
+    assert output.return_values == {"output": "Done"}
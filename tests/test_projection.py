@@ -0,0 +1,102 @@
+import datetime
+from typing import Any, Iterator
+
+import pytest
+
+from app.integrations.bamboo import projection
+from app.integrations.bamboo.absences import AbsenceIndex
+from app.integrations.bamboo.balance import VACATION_POLICY
+from app.integrations.bamboo.leave import calculate_leave_hours
+
+
+def request(request_id: str, employee_id: str, start: str, end: str) -> dict[str, Any]:
+    return {
+        "id": request_id,
+        "employeeId": employee_id,
+        "start": start,
+        "end": end,
+        "type": {"id": VACATION_POLICY.time_off_type_id},
+        "status": {"status": "approved"},
+    }
+
+
+def days_from_today(days: int) -> str:
+    return (datetime.date.today() + datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+class FakeBamboo:
+    """Counts the balance calls, serves an index of the given requests."""
+
+    def __init__(
+        self, balances: dict[str, float | None], requests: list[dict[str, Any]]
+    ) -> None:
+        self.balances = balances
+        self.index = AbsenceIndex(requests)
+        self.calls: list[tuple[str, str]] = []
+
+    def get_time_off_balance(
+        self, employee_id: str, date: str, time_off_type_id: str
+    ) -> float | None:
+        self.calls.append((employee_id, date))
+        return self.balances[employee_id]
+
+    def get_absence_index(self, start_date: str, end_date: str) -> AbsenceIndex:
+        return self.index
+
+
+@pytest.fixture
+def bamboo(monkeypatch: pytest.MonkeyPatch) -> Iterator[FakeBamboo]:
+    start, end = days_from_today(2), days_from_today(4)
+    fake = FakeBamboo(
+        balances={"1": 100.0, "2": None},
+        requests=[request("r1", "1", start, end), request("r2", "3", start, end)],
+    )
+    monkeypatch.setattr(projection, "get_time_off_balance", fake.get_time_off_balance)
+    monkeypatch.setattr(projection, "get_absence_index", fake.get_absence_index)
+    projection.invalidate_opening_balances()
+    yield fake
+    projection.invalidate_opening_balances()
+
+
+def test_estimate_deducts_the_indexed_requests_from_the_bamboo_balance(
+    bamboo: FakeBamboo,
+) -> None:
+    today, later = days_from_today(0), days_from_today(6)
+    if today[:4] != later[:4]:
+        pytest.skip("the new year grant would be added")
+    hours = float(calculate_leave_hours(days_from_today(2), days_from_today(4)))
+
+    balances = projection.estimate_balances(["1", "2"], [today, later])
+
+    assert balances["1"] == {today: 100.0, later: 100.0 - hours}
+    # No BambooHR balance: the policy grant
+    assert balances["2"] == {
+        today: VACATION_POLICY.grant_hours,
+        later: VACATION_POLICY.grant_hours,
+    }
+
+
+def test_opening_balances_are_cached(bamboo: FakeBamboo) -> None:
+    dates = [days_from_today(0)]
+    projection.estimate_balances(["1", "2"], dates)
+    projection.estimate_balances(["2", "1"], dates)
+    assert sorted(bamboo.calls) == [("1", dates[0]), ("2", dates[0])]
+
+    projection.invalidate_opening_balances("1")
+    projection.estimate_balances(["1", "2"], dates)
+    assert len(bamboo.calls) == 3 and bamboo.calls[-1][0] == "1"
+
+
+def test_invalidation_during_a_fetch_is_not_undone(
+    bamboo: FakeBamboo, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fetch_then_invalidate(*args: Any) -> float | None:
+        projection.invalidate_opening_balances()
+        return bamboo.get_time_off_balance(*args)
+
+    monkeypatch.setattr(projection, "get_time_off_balance", fetch_then_invalidate)
+    projection.get_opening_balances(["1"], days_from_today(0))
+    monkeypatch.setattr(projection, "get_time_off_balance", bamboo.get_time_off_balance)
+    projection.get_opening_balances(["1"], days_from_today(0))
+
+    assert len(bamboo.calls) == 2
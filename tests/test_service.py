@@ -0,0 +1,39 @@
+import asyncio
+import json
+from typing import Any
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app.service import session_socket
+
+
+class FakeWebSocket:
+    """Receives the given texts, then disconnects."""
+
+    def __init__(self, texts: list[str]) -> None:
+        self.texts = texts
+        self.sent: list[dict[str, Any]] = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_json(self) -> Any:
+        if not self.texts:
+            raise WebSocketDisconnect()
+        return json.loads(self.texts.pop(0))
+
+    async def send_json(self, data: dict[str, Any]) -> None:
+        self.sent.append(data)
+
+
+@pytest.mark.parametrize(
+    "text",
+    ['["not", "an", "object"]', "{}", '{"content": 42}', '{"text": "hi"}', "{not"],
+)
+def test_socket_refuses_invalid_messages(text: str) -> None:
+    websocket = FakeWebSocket([text, "null"])
+    asyncio.run(session_socket(websocket, "invalid"))  # type: ignore
+
+    # Each message is refused and the connection stays open for the next one
+    assert [event["status"] for event in websocket.sent] == [422, 422]
@@ -0,0 +1,142 @@
+from typing import Any
+
+import pytest
+
+from app.agent.session import ONBOARDING_STEPS, AgentSession
+from app.agent.store import (
+    MemorySessionBackend,
+    SessionStore,
+    decode_state,
+    encode_state,
+    truncate_log,
+)
+
+
+class FakeAgent:
+    def __init__(self, output: str) -> None:
+        self.output = output
+
+    def invoke(self, inputs: dict[str, Any], config: dict[str, Any]) -> dict[str, Any]:
+        return {"output": self.output, "intermediate_steps": []}
+
+
+class FakePrefetcher:
+    def observe(self, text: str) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+def run_turn(session: AgentSession, user_input: str, output: str) -> None:
+    """Runs a turn of a reserved session without calling the LLM."""
+    session._prefetcher = FakePrefetcher()  # type: ignore
+    session.init_agent = lambda streaming=False: FakeAgent(output)  # type: ignore
+    session.run_turn(user_input)
+
+
+def contents(session: AgentSession) -> list[str]:
+    return [message["content"] for message in session.messages[1:]]
+
+
+@pytest.fixture
+def store() -> SessionStore:
+    return SessionStore(MemorySessionBackend(), max_live=1)
+
+
+def test_state_round_trip() -> None:
+    messages = [
+        {"role": "user", "content": "Hi, I'm Ana — ana@example.com"},
+        {"role": "assistant", "content": "Welcome Ana!\n"},
+    ]
+    onboarding = {step: i % 2 == 0 for i, step in enumerate(ONBOARDING_STEPS)}
+
+    assert decode_state(encode_state(messages, onboarding)) == (messages, onboarding)
+    assert decode_state(encode_state([], dict.fromkeys(ONBOARDING_STEPS, False))) == (
+        [],
+        dict.fromkeys(ONBOARDING_STEPS, False),
+    )
+
+
+@pytest.mark.parametrize("max_lines", [1, 2, 3, 10])
+def test_truncate_log_bounds(max_lines: int) -> None:
+    log = [f"line {i}" for i in range(20)]
+    truncated = truncate_log(log, max_lines=max_lines, max_line_chars=100)
+
+    assert len(truncated) == max_lines
+    assert sum("lines truncated" in line for line in truncated) == 1
+    if max_lines > 1:
+        assert truncated[0] == "line 0"
+    if max_lines > 2:
+        assert truncated[-1] == "line 19"
+
+
+def test_truncate_log_cuts_long_lines() -> None:
+    assert truncate_log(["short", "x" * 50], max_lines=10, max_line_chars=10) == [
+        "short",
+        "x" * 10 + "[...]",
+    ]
+    assert truncate_log(["a", "b"], max_lines=2, max_line_chars=10) == ["a", "b"]
+
+
+def test_lru_skips_busy_sessions(store: SessionStore) -> None:
+    busy = store.begin_turn("busy")
+    assert busy is not None
+    store.get("other")
+    store.get("third")
+
+    # The busy session stays live, the idle ones beyond max_live are evicted
+    assert store.get("busy") is busy
+    assert list(store._live) == ["busy"]
+
+
+def test_reset_refused_while_busy(store: SessionStore) -> None:
+    session = store.begin_turn("a")
+    assert session is not None
+    assert store.reset("a") is None
+    assert store.begin_turn("a") is None
+
+    session.end_turn()
+    assert store.reset("a") is not None
+
+
+def test_turn_saved_before_release_survives_eviction(store: SessionStore) -> None:
+    session = store.begin_turn("a")
+    assert session is not None
+    run_turn(session, "hello", "hi there")
+    store.save(session)
+    session.end_turn()
+
+    store.get("b")
+    assert contents(store.get("a")) == ["hello", "hi there"]
+
+
+def test_eviction_between_end_turn_and_save_keeps_the_turn(
+    store: SessionStore,
+) -> None:
+    session = store.begin_turn("a")
+    assert session is not None
+    run_turn(session, "hello", "hi there")
+    session.end_turn()
+    # Another user evicts the idle session before its turn is saved
+    store.get("b")
+    store.save(session)
+
+    reloaded = store.get("a")
+    assert reloaded is not session
+    assert contents(reloaded) == ["hello", "hi there"]
+    assert store.snapshot("a", logs=True)["messages"][2]["log"] == []
+
+
+def test_save_after_reset_is_dropped(store: SessionStore) -> None:
+    session = store.begin_turn("a")
+    assert session is not None
+    run_turn(session, "hello", "hi there")
+    store.save(session)
+    session.end_turn()
+
+    assert store.reset("a") is not None
+    store.save(session)
+    store.get("b")
+
+    assert contents(store.get("a")) == []
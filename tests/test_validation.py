@@ -0,0 +1,99 @@
+import datetime
+from typing import Any, Iterator
+
+import pytest
+
+from app.integrations.bamboo import projection
+from app.integrations.bamboo.absences import AbsenceIndex
+from app.integrations.bamboo.leave import calculate_leave_hours
+from app.integrations.bamboo.validation import validate_time_off_request
+
+
+def next_weekday(days: int) -> datetime.date:
+    date = datetime.date.today() + datetime.timedelta(days=days)
+    while date.weekday() >= 5:
+        date += datetime.timedelta(days=1)
+    return date
+
+
+START = next_weekday(7)
+END = START + datetime.timedelta(days=2)
+# A working day after the existing request
+LATER = next_weekday(21)
+INDEX = AbsenceIndex(
+    [
+        {
+            "id": "r1",
+            "employeeId": "1",
+            "start": START.strftime("%Y-%m-%d"),
+            "end": START.strftime("%Y-%m-%d"),
+            "type": {"id": "78"},
+            "status": {"status": "approved"},
+        }
+    ]
+)
+
+
+@pytest.fixture
+def balances(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict[str, Any]]:
+    """BambooHR balances by employee, and the calls made to read them."""
+    state: dict[str, Any] = {"1": 80.0, "2": 300.0, "3": None, "calls": 0}
+
+    def get_time_off_balance(
+        employee_id: str, date: str, time_off_type_id: str
+    ) -> float | None:
+        state["calls"] += 1
+        return state[employee_id]
+
+    monkeypatch.setattr(projection, "get_time_off_balance", get_time_off_balance)
+    projection.invalidate_opening_balances()
+    yield state
+    projection.invalidate_opening_balances()
+
+
+def validate(employee_id: str, start: datetime.date, end: datetime.date) -> str | None:
+    return validate_time_off_request(
+        employee_id, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), index=INDEX
+    )
+
+
+def test_reversed_dates(balances: dict[str, Any]) -> None:
+    assert "before the start date" in str(validate("2", END, START))
+    assert balances["calls"] == 0
+
+
+def test_overlap_is_rejected_without_a_balance(balances: dict[str, Any]) -> None:
+    error = validate("1", START, END)
+    assert error is not None and "request r1" in error
+    assert balances["calls"] == 0
+
+
+def test_balance_from_bamboo_is_cached(balances: dict[str, Any]) -> None:
+    if calculate_leave_hours(str(LATER), str(LATER)) == 0:
+        pytest.skip("public holiday")
+    assert validate("2", LATER, LATER) is None
+    assert validate("2", LATER, LATER) is None
+    assert balances["calls"] == 1
+
+
+def test_bamboo_balance_below_the_grant(balances: dict[str, Any]) -> None:
+    # 4 hours left, well under the 200 hours granted by the policy
+    balances["4"] = 4.0
+    if calculate_leave_hours(str(LATER), str(LATER)) == 0:
+        pytest.skip("public holiday")
+    error = validate("4", LATER, LATER)
+    assert error is not None and "over their time off balance" in error
+
+
+def test_over_balance(balances: dict[str, Any]) -> None:
+    end = LATER + datetime.timedelta(days=30)
+    if end.year != LATER.year:
+        pytest.skip("the new year grant would be added")
+    error = validate("1", LATER, end)
+    assert error is not None and "over their time off balance" in error
+
+
+def test_grant_without_bamboo_balance(balances: dict[str, Any]) -> None:
+    if calculate_leave_hours(str(LATER), str(LATER)) == 0:
+        pytest.skip("public holiday")
+    assert validate("3", LATER, LATER) is None